@@ -0,0 +1,97 @@
+"""Сравнение JSON бэкендов на разборе кадров 24data и сериализации ответов API
+
+    python bench/bench_codec.py                     # синтетические кадры
+    python bench/bench_codec.py --frames rec.jsonl.gz --json codec.json
+
+Файл --frames - записанный поток (см. recorder) или JSON lines с сырыми кадрами.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from bench import synthetic  # noqa: E402
+from bench.replay import read_recording_lines  # noqa: E402
+
+
+def load_frames(path):
+    frames = []
+    for line in read_recording_lines(path):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            # Строка, оборванная при аварийной остановке рекордера
+            continue
+        # Записи рекордера: {"ts": ..., "frame": "<сырой кадр>"}
+        frames.append(item["frame"] if isinstance(item, dict) and "frame" in item else line)
+    return frames
+
+
+def synthetic_frames(aircraft, count):
+    frames = [synthetic.dumps(synthetic.make_flight_plan(i)) for i in range(aircraft)]
+    frames += [synthetic.dumps(synthetic.make_acft_frame(aircraft, tick=t)) for t in range(count)]
+    return frames
+
+
+def measure(func, items, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            func(item)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", help="записанные кадры (.jsonl или .jsonl.gz)")
+    parser.add_argument("--aircraft", type=int, default=1000, help="самолётов в синтетическом кадре")
+    parser.add_argument("--count", type=int, default=20, help="синтетических ACFT_DATA кадров")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="сохранить результаты в JSON файл")
+    args = parser.parse_args()
+
+    frames = load_frames(args.frames) if args.frames else synthetic_frames(args.aircraft, args.count)
+    frame_bytes = sum(len(frame) for frame in frames)
+
+    # Данные для сериализации: снимок dsr после применения кадров
+    main.set_json_backend("stdlib")
+    for frame in frames:
+        main.process_websocket_data(frame)
+    snapshot = main.get_store("dsr")
+
+    results = []
+    for backend in main.get_json_backends():
+        main.set_json_backend(backend)
+        decode = measure(main.decode_ws_frame, frames, args.repeat)
+        encode = measure(main.json_dumps, [snapshot], args.repeat)
+        results.append({
+            "backend": backend,
+            "frames": len(frames),
+            "frame_bytes": frame_bytes,
+            "decode_s": decode,
+            "decode_mb_s": frame_bytes / decode / 1e6,
+            "encode_flights": len(snapshot),
+            "encode_s": encode,
+        })
+
+    print(f"{'backend':<10}{'decode, s':>12}{'MB/s':>10}{'encode, ms':>14}")
+    for row in results:
+        print(f"{row['backend']:<10}{row['decode_s']:>12.4f}{row['decode_mb_s']:>10.1f}{row['encode_s'] * 1000:>14.2f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump({"benchmark": "codec", "results": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
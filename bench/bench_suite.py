@@ -0,0 +1,262 @@
+"""Набор бенчмарков: приём кадров, классификация состояний, ATC, статистика и API
+
+    python bench/bench_suite.py                          # все сценарии
+    python bench/bench_suite.py -k acft -k api           # только совпадающие по имени
+    python bench/bench_suite.py --json bench.json        # результаты для сравнения между версиями
+    python bench/bench_suite.py --compare old.json       # сравнение с прошлым прогоном
+
+Каждый сценарий запускается на свежем состоянии (модуль main перезагружается),
+время - лучшее из --repeat повторов.
+"""
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from bench import synthetic  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CASES = []
+
+
+def case(name, items=1):
+    """Регистрация сценария: setup(m) -> функция одного прогона; items - единиц работы за прогон"""
+    def register(setup):
+        CASES.append((name, items, setup))
+        return setup
+    return register
+
+
+def fresh_main():
+    """Чистое состояние: повторная загрузка модуля main"""
+    return importlib.reload(main)
+
+
+def load_flights(m, count, event=False):
+    """count рейсов с планом и одним кадром ACFT_DATA"""
+    with m.write_lock:
+        for i in range(count):
+            m.apply_frame(synthetic.make_flight_plan(i, event=event))
+        m.apply_frame(synthetic.make_acft_frame(count, event=event))
+        m.publish_state()
+
+
+class StubResponse:
+    def __init__(self, content):
+        self.status_code = 200
+        self.headers = {}
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+
+class StubSession:
+    """Заглушка внешнего API: по очереди отдаёт заранее сериализованные ответы"""
+
+    def __init__(self, bodies):
+        self.bodies = bodies
+        self.calls = 0
+
+    def get(self, url, headers=None, timeout=None):
+        body = self.bodies[self.calls % len(self.bodies)]
+        self.calls += 1
+        return StubResponse(body)
+
+
+for count in (100, 1000, 10000):
+    @case(f"process_acft_data[{count}]", items=count)
+    def bench_acft(m, count=count):
+        load_flights(m, count)
+        frames = [synthetic.make_acft_frame(count, tick=tick)["d"] for tick in range(1, 4)]
+        ticks = iter(range(10 ** 9))
+
+        def run():
+            tick = next(ticks)
+            with m.write_lock:
+                m.process_acft_data(frames[tick % len(frames)], received_at=time.time())
+                m.publish_state()
+        return run
+
+
+@case("process_flight_plan[burst 1000]", items=1000)
+def bench_flight_plans(m):
+    plans = [synthetic.make_flight_plan(i)["d"] for i in range(1000)]
+
+    def run():
+        with m.write_lock:
+            for plan in plans:
+                m.process_flight_plan(plan)
+            m.publish_state()
+    return run
+
+
+@case("get_flight_state[1000]", items=1000)
+def bench_flight_state(m):
+    load_flights(m, 1000)
+    aircraft = synthetic.make_acft_frame(1000, tick=1)["d"]
+    pairs = [(m.find_callsign(data["playerName"]), data) for data in aircraft.values()]
+
+    def run():
+        for callsign, data in pairs:
+            m.get_flight_state(callsign, data)
+    return run
+
+
+@case("fetch_external_atc_data[stub]")
+def bench_atc(m):
+    bodies = [json.dumps(synthetic.make_controllers(seed=seed)).encode() for seed in range(4)]
+    m.http_session = StubSession(bodies)
+    return m.fetch_external_atc_data
+
+
+@case("airport_stats[publish 10 airports]", items=10)
+def bench_airport_stats(m):
+    now = time.time()
+    for i in range(2000):
+        m.add_airport_sample(synthetic.AIRPORTS[i % 10], "taxi", 2 + i % 13, now - i)
+        m.add_airport_sample(synthetic.AIRPORTS[i % 10], "obt", 5 + i % 40, now - i)
+
+    def run():
+        with m.write_lock:
+            # Сводки пересчитываются для всех аэропортов, как после сдвига окна
+            m.dirty_airport_stats["airport_stats"].update(m.airport_aggregates["airport_stats"])
+            m.publish_state()
+    return run
+
+
+API_ENDPOINTS = [
+    "/api/v1/dsr",
+    "/api/v1/dsr?since=1",
+    "/api/v1/dsr?airport=IRFD&role=dep&fields=cs,state",
+    "/api/v1/atc",
+    "/api/v1/airport_stats",
+    "/api/v1/airport_history",
+    "/api/v1/track/SYN999",
+    "/api/v1/atis",
+    "/api/v1/boards",
+    "/api/v1/boards/IRFD",
+    "/api/v1/aircraft/bbox?bbox=-10000,-10000,10000,10000",
+    "/api/v1/aircraft/radius?x=0&y=0&radius=5000&limit=50",
+    "/api/v1/edsr",
+    "/api/v1/eatc",
+    "/api/v1/eairport_stats",
+    "/api/v1/eairport_history",
+    "/api/v1/eatis",
+    "/api/v1/sources",
+    "/api/v1/ingest",
+]
+
+for endpoint in API_ENDPOINTS:
+    for encoding in ("identity", "gzip"):
+        @case(f"GET {endpoint} [{encoding}]")
+        def bench_endpoint(m, endpoint=endpoint, encoding=encoding):
+            load_flights(m, 1000)
+            load_flights(m, 200, event=True)
+            m.apply_external_atc_data(synthetic.make_controllers())
+            with m.write_lock:
+                m.publish_state()
+            client = m.app.test_client()
+            headers = {"Accept-Encoding": encoding}
+
+            def run():
+                response = client.get(endpoint, headers=headers)
+                assert response.status_code == 200, (endpoint, response.status_code)
+            return run
+
+
+@case("POST /api/v1/event/atc")
+def bench_event_atc(m):
+    client = m.app.test_client()
+    body = json.dumps(synthetic.make_controllers())
+    headers = {"Authorization": f"Bearer {m.AUTH_TOKEN}", "Content-Type": "application/json"}
+
+    def run():
+        response = client.post("/api/v1/event/atc", data=body, headers=headers)
+        assert response.status_code == 200, response.status_code
+    return run
+
+
+def measure(run, repeat, min_time):
+    """Лучшее и среднее время одного прогона; прогон повторяется, пока не наберётся min_time"""
+    timings = []
+    for _ in range(repeat):
+        loops = 0
+        start = time.perf_counter()
+        while True:
+            run()
+            loops += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        timings.append(elapsed / loops)
+    return min(timings), sum(timings) / len(timings)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", dest="filters", action="append", default=[], help="подстрока имени сценария")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--min-time", type=float, default=0.2, help="минимальное время одного повтора, с")
+    parser.add_argument("--json", help="сохранить результаты в JSON файл")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    results = []
+    for name, items, setup in CASES:
+        if args.filters and not any(f in name for f in args.filters):
+            continue
+        # Логи обработки кадров (print) не попадают в вывод и не искажают замеры
+        with contextlib.redirect_stdout(io.StringIO()):
+            m = fresh_main()
+            run = setup(m)
+            best, mean = measure(run, args.repeat, args.min_time)
+        results.append({
+            "name": name,
+            "items": items,
+            "best_s": best,
+            "mean_s": mean,
+            "per_item_us": best / items * 1e6,
+        })
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = {row["name"]: row for row in json.load(file)["results"]}
+
+    print(f"{'benchmark':<48}{'best, ms':>12}{'per item, us':>14}{'vs base':>10}")
+    for row in results:
+        base = baseline.get(row["name"])
+        ratio = f"{row['best_s'] / base['best_s']:.2f}x" if base else ""
+        print(f"{row['name']:<48}{row['best_s'] * 1000:>12.3f}{row['per_item_us']:>14.2f}{ratio:>10}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump({
+                "benchmark": "suite",
+                "revision": git_revision(),
+                "timestamp": time.time(),
+                "python": platform.python_version(),
+                "json_backend": main.json_backend,
+                "results": results,
+            }, file, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
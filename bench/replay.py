@@ -0,0 +1,209 @@
+"""Воспроизведение записанного потока 24data (RECORD_FILE) для нагрузочных и регрессионных прогонов
+
+    python bench/replay.py rec.jsonl.gz                     # с максимальной скоростью
+    python bench/replay.py rec.jsonl.gz --speed 1           # в реальном времени
+    python bench/replay.py rec.jsonl.gz --speed 10 --json replay.json
+    python bench/replay.py rec.jsonl.gz --serve 8765 --speed 1
+
+По умолчанию кадры подаются прямо в process_websocket_data с записанным временем
+приёма, поэтому прогон детерминирован. С --serve поднимается локальный WebSocket
+сервер, к которому можно подключить main.py (WEBSOCKET_URL=ws://localhost:8765).
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+GZIP_MAGIC = b"\x1f\x8b\x08"
+
+
+def decompress_member(data):
+    """(распакованное, member закончен, длина хвоста после member); zlib.error - поток испорчен"""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    chunk = decompressor.decompress(data)
+    return chunk, decompressor.eof, len(decompressor.unused_data)
+
+
+def read_gzip_members(data):
+    """Распакованные gzip members файла записи по порядку
+
+    Если процесс был убит во время записи, его member остаётся без окончания: из
+    него берётся всё, что удалось распаковать, и чтение продолжается со следующего
+    member (следующего запуска рекордера).
+    """
+    start = 0
+    while start < len(data):
+        try:
+            chunk, finished, rest = decompress_member(data[start:])
+        except zlib.error:
+            chunk, finished = None, False
+        if finished:
+            yield chunk
+            start = len(data) - rest
+            continue
+        if chunk is not None:
+            # Файл кончается оборванным member
+            yield chunk + b"\n"
+            return
+
+        # За оборванным member идёт следующий: первый заголовок, с которого читается поток
+        end = data.find(GZIP_MAGIC, start + 1)
+        while end >= 0:
+            try:
+                decompress_member(data[end:end + 4096])
+                break
+            except zlib.error:
+                end = data.find(GZIP_MAGIC, end + 1)
+        try:
+            chunk, _, _ = decompress_member(data[start:end if end >= 0 else len(data)])
+            yield chunk + b"\n"
+        except zlib.error:
+            pass
+        if end < 0:
+            return
+        start = end
+
+
+def read_recording_lines(path):
+    """Строки файла записи (gzip с несколькими members или обычный текст)"""
+    with open(path, "rb") as file:
+        data = file.read()
+    if not path.endswith(".gz"):
+        return data.decode("utf-8", errors="replace").splitlines()
+    text = b"".join(read_gzip_members(data)).decode("utf-8", errors="replace")
+    return text.splitlines()
+
+
+def load_recording(path):
+    """Записанные кадры: [(ts, frame)]; оборванные и повреждённые строки пропускаются"""
+    frames = []
+    for line in read_recording_lines(path):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+            frames.append((item["ts"], item["frame"]))
+        except (ValueError, TypeError, KeyError):
+            # Строка, оборванная при аварийной остановке рекордера
+            continue
+    return frames
+
+
+def paced(frames, speed):
+    """Кадры с паузами по записанным интервалам, ускоренными в speed раз (0 - без пауз)"""
+    if not frames:
+        return
+    first_ts = frames[0][0]
+    started = time.perf_counter()
+    for ts, frame in frames:
+        if speed > 0:
+            delay = (ts - first_ts) / speed - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+        yield ts, frame
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def replay_direct(frames, speed):
+    """Прогон кадров через process_websocket_data, замер задержки каждого кадра"""
+    latencies = []
+    failed = 0
+    aircraft = 0
+    started = time.perf_counter()
+
+    for ts, frame in paced(frames, speed):
+        frame_start = time.perf_counter()
+        if not main.process_websocket_data(frame, received_at=ts):
+            failed += 1
+        latencies.append(time.perf_counter() - frame_start)
+        if main.peek_frame_type(frame) in main.COALESCE_TYPES:
+            aircraft += frame.count('"playerName"')
+
+    elapsed = time.perf_counter() - started
+    processing = sum(latencies)
+    return {
+        "mode": "direct",
+        "speed": speed,
+        "frames": len(frames),
+        "failed": failed,
+        "aircraft_updates": aircraft,
+        "elapsed_s": elapsed,
+        "processing_s": processing,
+        "frames_per_s": len(frames) / processing if processing else None,
+        "aircraft_per_s": aircraft / processing if processing else None,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.5) * 1000 if latencies else None,
+            "p90": percentile(latencies, 0.9) * 1000 if latencies else None,
+            "p99": percentile(latencies, 0.99) * 1000 if latencies else None,
+            "max": max(latencies) * 1000 if latencies else None,
+        },
+        "flights": len(main.dsr),
+        "event_flights": len(main.edsr),
+    }
+
+
+def serve(frames, speed, port):
+    """Локальная замена wss://24data.ptfs.app/wss: каждому клиенту отдаётся вся запись"""
+    import websockets
+
+    async def handler(websocket, path=None):
+        first_ts = frames[0][0] if frames else 0
+        started = time.perf_counter()
+        sent = 0
+        for ts, frame in frames:
+            if speed > 0:
+                delay = (ts - first_ts) / speed - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await websocket.send(frame)
+            sent += 1
+        elapsed = time.perf_counter() - started
+        print(f"Sent {sent} frames in {elapsed:.2f}s ({sent / elapsed if elapsed else 0:.1f} frames/s)")
+
+    async def run():
+        async with websockets.serve(handler, "localhost", port, max_size=None):
+            print(f"Replaying {len(frames)} frames on ws://localhost:{port} at speed {speed or 'max'}")
+            await asyncio.Future()
+
+    asyncio.run(run())
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recording", help="файл записи (RECORD_FILE), .jsonl или .jsonl.gz")
+    parser.add_argument("--speed", type=float, default=0, help="1 - реальное время, N - в N раз быстрее, 0 - максимум")
+    parser.add_argument("--serve", type=int, metavar="PORT", help="отдавать кадры через локальный WebSocket сервер")
+    parser.add_argument("--json", help="сохранить результаты в JSON файл")
+    args = parser.parse_args()
+
+    frames = load_recording(args.recording)
+    if args.serve:
+        serve(frames, args.speed, args.serve)
+        return
+
+    result = replay_direct(frames, args.speed)
+    result["backend"] = main.json_backend
+    print(json.dumps(result, indent=2))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(result, file, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
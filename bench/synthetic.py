@@ -0,0 +1,72 @@
+"""Генераторы синтетических кадров 24data для бенчмарков"""
+import json
+import random
+
+AIRPORTS = ["IRFD", "ILAR", "IZOL", "ITKO", "IPPH", "IGRV", "IPAP", "IMLR", "ISAU", "IBTH"]
+AIRCRAFT = ["Boeing 737", "Airbus A320", "Boeing 777", "Cessna 172", "Bombardier Q400", "F16"]
+
+
+def make_aircraft(i, rnd, tick=0):
+    on_ground = rnd.random() < 0.4
+    return {
+        "playerName": f"player{i}",
+        "heading": rnd.randint(0, 359),
+        "altitude": 0 if on_ground else rnd.choice([3000, 12000, 31000]),
+        "aircraftType": rnd.choice(AIRCRAFT),
+        "position": {"x": rnd.uniform(-50000, 50000) + tick * 30, "y": rnd.uniform(-50000, 50000)},
+        "speed": rnd.choice([0, 15, 30]) if on_ground else rnd.choice([180, 280, 450]),
+        "groundSpeed": rnd.uniform(0, 500),
+        "wind": f"{rnd.randint(0, 35) * 10:03d}/{rnd.randint(2, 25)}",
+        "isOnGround": on_ground,
+        "isEmergencyOccuring": rnd.random() < 0.01,
+    }
+
+
+def make_acft_frame(count, tick=0, seed=0, event=False):
+    """Кадр ACFT_DATA с count самолётами (dict, как после разбора JSON)"""
+    rnd = random.Random(seed * 100003 + tick)
+    return {
+        "t": "EVENT_ACFT_DATA" if event else "ACFT_DATA",
+        "d": {f"RC-{i}": make_aircraft(i, rnd, tick) for i in range(count)},
+    }
+
+
+def make_flight_plan(i, seed=0, event=False):
+    """Кадр FLIGHT_PLAN для игрока player{i}"""
+    rnd = random.Random(seed * 100003 + i)
+    departure, arrival = rnd.sample(AIRPORTS, 2)
+    return {
+        "t": "EVENT_FLIGHT_PLAN" if event else "FLIGHT_PLAN",
+        "d": {
+            "robloxName": f"player{i}",
+            "callsign": f"SYN{i}",
+            "realcallsign": f"RC-{i}",
+            "departing": departure,
+            "arriving": arrival,
+            "flightlevel": f"FL{rnd.randint(5, 40) * 10:03d}",
+            "aircraft": rnd.choice(AIRCRAFT),
+            "flightrules": rnd.choice(["IFR", "VFR"]),
+            "route": "GPS DCT",
+        },
+    }
+
+
+def make_controllers(airports=AIRPORTS, seed=0):
+    """Ответ /controllers внешнего API"""
+    rnd = random.Random(seed)
+    controllers = []
+    for airport in airports:
+        for position in ("TWR", "GND"):
+            controllers.append({
+                "airport": airport,
+                "position": position,
+                "holder": f"atc{rnd.randint(1, 999)}" if rnd.random() < 0.6 else None,
+                "queue": [],
+            })
+    for fir in ("IRCC", "IZCC", "IOCC"):
+        controllers.append({"airport": fir, "position": "CTR", "holder": "ctr", "queue": []})
+    return controllers
+
+
+def dumps(frame):
+    return json.dumps(frame)
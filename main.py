@@ -1,17 +1,55 @@
 
 import asyncio
+import atexit
+import bisect
+import functools
+import gzip
+import hashlib
+import heapq
+import hmac
+import itertools
 import json
+import math
+import mmap
+import struct
+import tempfile
 import threading
 import time
 import os
-from collections import defaultdict
+import random
+import signal
+import socket
+import sys
+import uuid
+from array import array
+from collections import OrderedDict, defaultdict, deque
 from datetime import datetime, timezone, timedelta
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 import websockets
 import requests
 from flask_cors import CORS
 from dotenv import load_dotenv
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
 # Загрузка переменных окружения
 load_dotenv()
 
@@ -29,15 +67,187 @@ ATC_UPDATE_INTERVAL = int(os.getenv("ATC_UPDATE_INTERVAL", 10))
 ATIS_UPDATE_INTERVAL = int(os.getenv("ATIS_UPDATE_INTERVAL", 30))
 WEBSOCKET_UPDATE_INTERVAL = int(os.getenv("WEBSOCKET_UPDATE_INTERVAL", 5))
 WEBSOCKET_URL = os.getenv("WEBSOCKET_URL", "wss://24data.ptfs.app/wss")
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", 1024))
+CHANGE_LOG_SIZE = int(os.getenv("CHANGE_LOG_SIZE", 20000))
+STREAM_INTERVAL = float(os.getenv("STREAM_INTERVAL", 0.5))
+STREAM_BUFFER_SIZE = int(os.getenv("STREAM_BUFFER_SIZE", 32))
+STREAM_KEEPALIVE = int(os.getenv("STREAM_KEEPALIVE", 15))
+STREAM_WS_PORT = int(os.getenv("STREAM_WS_PORT", 0))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 256))
+JSON_BACKEND = os.getenv("JSON_BACKEND", "auto")
+UPSTREAM_JITTER = float(os.getenv("UPSTREAM_JITTER", 0.1))
+UPSTREAM_MAX_BACKOFF = int(os.getenv("UPSTREAM_MAX_BACKOFF", 60))
+UPSTREAM_BREAKER_THRESHOLD = int(os.getenv("UPSTREAM_BREAKER_THRESHOLD", 5))
+UPSTREAM_BREAKER_COOLDOWN = int(os.getenv("UPSTREAM_BREAKER_COOLDOWN", 60))
+TRACK_MAX_POINTS = int(os.getenv("TRACK_MAX_POINTS", 360))
+TRACK_MAX_FLIGHTS = int(os.getenv("TRACK_MAX_FLIGHTS", 1000))
+TRACK_TOLERANCE = float(os.getenv("TRACK_TOLERANCE", 50))
+TRACK_ALT_TOLERANCE = float(os.getenv("TRACK_ALT_TOLERANCE", 200))
+SPATIAL_CELL_SIZE = float(os.getenv("SPATIAL_CELL_SIZE", 2000))
+AIRPORT_POSITIONS_FILE = os.getenv("AIRPORT_POSITIONS_FILE", "")
+STATE_DIR = os.getenv("STATE_DIR", "")
+SNAPSHOT_INTERVAL = int(os.getenv("SNAPSHOT_INTERVAL", 300))
+JOURNAL_FSYNC_INTERVAL = float(os.getenv("JOURNAL_FSYNC_INTERVAL", 1.0))
+RECORD_FILE = os.getenv("RECORD_FILE", "")
+SPAN_TIMING = os.getenv("SPAN_TIMING", "False").lower() == "true"
+SLOW_OP_THRESHOLD_MS = float(os.getenv("SLOW_OP_THRESHOLD_MS", 250))
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", 60))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")  # Пустой - admin эндпоинты выключены
+SERVE_MODE = os.getenv("SERVE_MODE", "standalone")  # standalone | ingestor | worker
+SHARED_SNAPSHOT_FILE = os.getenv("SHARED_SNAPSHOT_FILE", os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "24schedule.snapshot"))
+SHARED_PUBLISH_INTERVAL = float(os.getenv("SHARED_PUBLISH_INTERVAL", 0.5))
+SHARED_DELTA_WINDOW = float(os.getenv("SHARED_DELTA_WINDOW", 15))  # Секунды; больше интервала опроса страниц
+SHARED_DELTA_STEP = float(os.getenv("SHARED_DELTA_STEP", 2))  # Секунды между контрольными точками дельт
+SHARED_DELTA_BUDGET = float(os.getenv("SHARED_DELTA_BUDGET", 1))  # Все дельты образа, доля от размера снимка
+CLUSTER_BACKEND = os.getenv("CLUSTER_BACKEND", "")  # "" | memory | redis
+CLUSTER_REDIS_URL = os.getenv("CLUSTER_REDIS_URL", "redis://localhost:6379/0")
+CLUSTER_PREFIX = os.getenv("CLUSTER_PREFIX", "24schedule")
+CLUSTER_LEASE_TTL = float(os.getenv("CLUSTER_LEASE_TTL", 10))
+CLUSTER_STATE_INTERVAL = int(os.getenv("CLUSTER_STATE_INTERVAL", 30))
+NODE_ID = os.getenv("NODE_ID", f"{socket.gethostname()}-{os.getpid()}")
+
+
+# JSON кодек: orjson / msgspec если установлены, иначе stdlib json.
+# Выбор через JSON_BACKEND=auto|orjson|msgspec|stdlib или set_json_backend().
+# omit_defaults: в журнал структуры пишутся без отсутствовавших полей, иначе после
+# повтора журнала get(key, default) получил бы null вместо значения по умолчанию.
+if msgspec is not None:
+    class Position(msgspec.Struct, omit_defaults=True):
+        x: int | float | None = None
+        y: int | float | None = None
+
+        def get(self, key, default=None):
+            value = getattr(self, key, None)
+            return default if value is None else value
+
+    class AircraftPayload(msgspec.Struct, omit_defaults=True):
+        """Типизированный самолёт из ACFT_DATA (имена полей как в 24data)"""
+        playerName: str | None = None
+        heading: int | float | None = None
+        altitude: int | float | None = None
+        aircraftType: str | None = None
+        position: Position | None = None
+        speed: int | float | None = None
+        groundSpeed: int | float | None = None
+        wind: str | None = None
+        isOnGround: bool | None = None
+        isEmergencyOccuring: bool | None = None
+
+        def get(self, key, default=None):
+            value = getattr(self, key, None)
+            return default if value is None else value
+
+    class FlightPlanPayload(msgspec.Struct, omit_defaults=True):
+        """Типизированный FLIGHT_PLAN (имена полей как в 24data)"""
+        robloxName: str | None = None
+        callsign: str | None = None
+        realcallsign: str | None = None
+        departing: str | None = None
+        arriving: str | None = None
+        flightlevel: str | None = None
+        aircraft: str | None = None
+        flightrules: str | None = None
+        route: str | None = None
+        isEmergencyOccuring: bool | None = None
+
+        def get(self, key, default=None):
+            value = getattr(self, key, None)
+            return default if value is None else value
+
+    class FrameHeader(msgspec.Struct):
+        t: str | None = None
+        d: msgspec.Raw = msgspec.Raw(b"null")
+
+    MSGSPEC_FRAME_DECODER = msgspec.json.Decoder(FrameHeader)
+    MSGSPEC_PAYLOAD_DECODERS = {
+        "ACFT_DATA": msgspec.json.Decoder(dict[str, AircraftPayload]),
+        "EVENT_ACFT_DATA": msgspec.json.Decoder(dict[str, AircraftPayload]),
+        "FLIGHT_PLAN": msgspec.json.Decoder(FlightPlanPayload),
+        "EVENT_FLIGHT_PLAN": msgspec.json.Decoder(FlightPlanPayload),
+    }
+    MSGSPEC_ENCODER = msgspec.json.Encoder(enc_hook=str)
+
+json_backend = None
+
+
+def set_json_backend(name):
+    """Выбор JSON бэкенда; auto - самый быстрый из установленных"""
+    global json_backend
+    available = get_json_backends()
+    if name == "auto":
+        name = available[0]
+    if name not in available:
+        raise ValueError(f"JSON backend {name} is not available (installed: {', '.join(available)})")
+    json_backend = name
+    return name
+
+
+def get_json_backends():
+    """Доступные бэкенды в порядке предпочтения"""
+    backends = []
+    if orjson is not None:
+        backends.append("orjson")
+    if msgspec is not None:
+        backends.append("msgspec")
+    backends.append("stdlib")
+    return backends
+
+
+def json_dumps(obj):
+    """Сериализация в UTF-8 bytes; datetime кодируется нативно (stdlib - через str)"""
+    if json_backend == "orjson":
+        try:
+            return orjson.dumps(obj, default=str)
+        except TypeError:
+            pass
+    elif json_backend == "msgspec":
+        try:
+            return MSGSPEC_ENCODER.encode(obj)
+        except (TypeError, msgspec.EncodeError):
+            pass
+    # Компактные разделители - как у orjson/msgspec, тела и ETag не зависят от бэкенда
+    return json.dumps(obj, default=str, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def json_loads(data):
+    if json_backend == "orjson":
+        return orjson.loads(data)
+    if json_backend == "msgspec":
+        return msgspec.json.decode(data)
+    return json.loads(data)
+
+
+def decode_ws_frame(raw):
+    """Разбор кадра 24data в {"t": ..., "d": ...}
+
+    С msgspec полезная нагрузка ACFT_DATA/FLIGHT_PLAN разбирается сразу в типизированные
+    структуры (с методом get(), как у dict); остальные бэкенды возвращают словари.
+    Если одно поле не прошло проверку типов, кадр разбирается в словари целиком -
+    иначе из-за одного самолёта пропал бы весь ACFT_DATA.
+    """
+    if json_backend == "msgspec":
+        header = MSGSPEC_FRAME_DECODER.decode(raw)
+        decoder = MSGSPEC_PAYLOAD_DECODERS.get(header.t)
+        try:
+            payload = decoder.decode(header.d) if decoder else msgspec.json.decode(header.d)
+        except msgspec.ValidationError:
+            payload = msgspec.json.decode(header.d)
+        return {"t": header.t, "d": payload}
+    return json_loads(raw)
+
+
+set_json_backend(JSON_BACKEND)
 
 DATA_TIMEOUT = timedelta(hours=2)
 LIVE_TIMEOUT = timedelta(seconds=15)
 
 # Раздельные хранилища для обычных и ивентовых данных
-dsr = {}  # Обычные рейсы
-edsr = {}  # Ивентовые рейсы
-flight_times = defaultdict(dict)
-event_flight_times = defaultdict(dict)
+dsr = {}  # Обычные рейсы: callsign -> FlightRecord
+edsr = {}  # Ивентовые рейсы: callsign -> FlightRecord
+
+# Общий HTTP клиент для опроса внешнего API
+http_session = None
 
 # Раздельные хранилища ATC и ATIS
 atc = []  # Обычные ATC (получаем из внешнего API)
@@ -45,6 +255,55 @@ eatc = []  # Ивентовые ATC (приходят POST запросом)
 atis = {}  # Обычные ATIS (получаем из внешнего API)
 eatis = {}  # Ивентовые ATIS (приходят POST запросом)
 
+# Версии хранилищ (монотонно растут при каждом изменении) и кэш сериализованных снимков
+BOOT_ID = uuid.uuid4().hex[:8]
+store_versions = defaultdict(int)
+snapshot_cache = {}
+snapshot_lock = threading.Lock()
+
+# Запись в рабочие хранилища (dsr, edsr, atc, ...) - только под write_lock. Читатели
+# (Flask, рассылка) используют опубликованный неизменяемый снимок published_state:
+# писатель собирает следующий снимок и подменяет ссылку целиком.
+write_lock = threading.RLock()
+dirty_flights = {"dsr": set(), "edsr": set()}
+published_state = {
+    "versions": {},
+    "dsr": {},
+    "edsr": {},
+    "dsr_index": {},
+    "edsr_index": {},
+    "airport_stats": {},
+    "eairport_stats": {},
+    "airport_history": {},
+    "eairport_history": {},
+    "atc": [],
+    "eatc": [],
+    "atis": {},
+    "eatis": {},
+    "boards": {},
+    "eboards": {},
+    "airport_positions": {},
+}
+
+# Журналы изменений рейсов для дельта-выдачи: (version, callsign)
+change_logs = {"dsr": deque(maxlen=CHANGE_LOG_SIZE), "edsr": deque(maxlen=CHANGE_LOG_SIZE)}
+change_log_floor = {"dsr": 0, "edsr": 0}
+
+# Подписчики push-канала (SSE и WebSocket), раздельно для обычных и ивентовых данных
+STREAM_TOPICS = {
+    "normal": {"flights": "dsr", "atc": "atc", "atis": "atis"},
+    "event": {"flights": "edsr", "atc": "eatc", "atis": "eatis"},
+}
+stream_subscribers = {"normal": set(), "event": set()}
+stream_lock = threading.Lock()
+stream_stats = {"messages": 0, "resyncs": 0}
+
+# Вторичные индексы рейсов: player_name -> callsign и realcallsign -> callsign
+player_index = {}
+eplayer_index = {}
+realcs_index = {}
+erealcs_index = {}
+
 AIRPORTS = {
     "IRFD": {"name": "Greater Rockford", "city": "Rockford", "fir": "IRCC"},
     "ILAR": {"name": "Larnaca Intl.", "city": "Cyprus", "fir": "ICCC"},
@@ -287,6 +546,258 @@ FLIGHT_STATES = {
 RECONNECT_DELAY = 2
 DATA_TIMEOUT = timedelta(minutes=30)
 LIVE_TIMEOUT = timedelta(seconds=10)
+EXPIRY_TICK = 1
+AIRPORT_STATS_WINDOW = 3600
+AIRPORT_STATS_BUCKET = 300
+AIRPORT_STATS_REFRESH = 60
+AIRPORT_STATS_BINS = {"taxi": 0.25, "obt": 0.5}  # Ширина бина гистограммы, минуты
+HISTORY_RESOLUTIONS = {"1m": (60, 240), "5m": (300, 288), "1h": (3600, 168)}  # Шаг (сек) и число слотов: 4ч, 24ч, 7д
+HISTORY_METRICS = ("departures", "arrivals", "airborne", "on_ground")
+TRACK_DROPPED_LIMIT = 32  # Сколько точек подряд можно схлопнуть в один отрезок трека
+AIRPORT_POSITION_SAMPLES = 500  # Окно скользящего среднего координат аэропорта
+AIRPORT_POSITION_OUTLIER = 10000  # Дальше от оценки - игрок не у этого аэропорта
+AIRPORT_POSITION_MIN_SAMPLES = 3  # С этого числа выборок выбросы отбрасываются
+
+# Агрегаты taxi/obt по аэропорту вылета (обновляются на переходах состояний)
+airport_aggregates = {"airport_stats": {}, "eairport_stats": {}}
+dirty_airport_stats = {"airport_stats": set(), "eairport_stats": set()}
+
+# Временные ряды движения по аэропортам и текущий вклад каждого рейса в счётчики
+airport_history = {"dsr": {}, "edsr": {}}
+airport_presence = {"dsr": {}, "edsr": {}}
+dirty_airport_history = {"dsr": set(), "edsr": set()}
+
+# Треки рейсов: (event, callsign) -> FlightTrack, от давно не обновлявшихся к свежим
+flight_tracks = OrderedDict()
+
+# Координаты аэропортов: изученные по ВС на земле (ICAO -> [x, y, выборок]) и опубликованная таблица
+airport_positions = {}
+airport_position_table = {}
+
+# Планировщик дедлайнов live/устаревания: min-heap (deadline, seq, kind, event, callsign)
+expiry_heap = []
+expiry_seq = itertools.count()
+expiry_scheduled = {}  # (kind, event, callsign) -> seq актуальной записи в куче
+flight_listeners = []
+
+class FlightRecord:
+    """Запись рейса: данные ACFT_DATA, плана полёта и трекинг времени в одном объекте
+
+    Времена хранятся как epoch seconds (float). В JSON запись отдаётся в прежнем виде:
+    поля ACFT_DATA появляются только после первого кадра, поля плана - после FLIGHT_PLAN.
+    """
+
+    COMMON_FIELDS = (
+        "realcallsign", "player_name", "aircraft", "data_valid", "live",
+        "state", "previous_state", "is_emergency", "cs",
+    )
+    ACFT_FIELDS = (
+        "heading", "altitude", "pos_x", "pos_y", "speed", "ground_speed", "wind", "is_on_ground",
+    )
+    FPL_FIELDS = (
+        "fpl_created_time", "departure", "arrival", "flight_level", "flightrules", "route",
+    )
+    TIME_FIELDS = ("fpl_created", "last_update", "obt_start", "takeoff_time")
+
+    __slots__ = COMMON_FIELDS + ACFT_FIELDS + FPL_FIELDS + TIME_FIELDS + (
+        "last_fresh_time", "has_acft", "has_fpl", "has_departed",
+    )
+
+    def __init__(self):
+        for field in self.__slots__:
+            setattr(self, field, None)
+        self.has_acft = False
+        self.has_fpl = False
+        self.has_departed = False
+        self.data_valid = False
+        self.live = False
+        self.is_emergency = False
+        self.state = 0
+        self.previous_state = 0
+
+    def to_dict(self):
+        """Представление записи в формате API"""
+        result = {field: getattr(self, field) for field in self.COMMON_FIELDS}
+        if self.has_acft:
+            for field in self.ACFT_FIELDS:
+                result[field] = getattr(self, field)
+        if self.has_fpl:
+            for field in self.FPL_FIELDS:
+                result[field] = getattr(self, field)
+        if self.last_fresh_time is not None:
+            result["last_fresh_time"] = str(datetime.fromtimestamp(self.last_fresh_time, timezone.utc))
+        return result
+
+    def to_state(self):
+        """Все поля записи для снимка на диске"""
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    @classmethod
+    def from_state(cls, state):
+        """Восстановление записи из снимка на диске"""
+        record = cls()
+        for field in cls.__slots__:
+            if field in state:
+                setattr(record, field, intern_code(state[field]))
+        return record
+
+
+def intern_code(value):
+    """Интернирование повторяющихся строк (коды аэропортов, типы ВС, ветер)"""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Histogram:
+    """Гистограмма в формате Prometheus: фиксированные границы, только счётчики
+
+    observe - один bisect и два сложения, поэтому инструментирование горячего пути
+    можно держать включённым всегда.
+    """
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels=""):
+        lines = []
+        cumulative = 0
+        prefix = labels + "," if labels else ""
+        for bound, bucket_count in zip(self.buckets, self.counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {self.count}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+UPSTREAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+FRAME_TYPES = ("ACFT_DATA", "FLIGHT_PLAN", "EVENT_ACFT_DATA", "EVENT_FLIGHT_PLAN")
+
+# Метрики для /metrics (счётчики процесса, сбрасываются при перезапуске)
+frame_counts = defaultdict(int)
+frame_latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+frame_queue_delay = Histogram(LATENCY_BUCKETS)
+upstream_latency = defaultdict(lambda: Histogram(UPSTREAM_BUCKETS))
+request_latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+response_bytes = defaultdict(int)
+cache_stats = defaultdict(int)
+
+# Тайминг горячих функций (включается SPAN_TIMING или через /api/v1/admin/tracing)
+tracing = {"enabled": SPAN_TIMING, "threshold_ms": SLOW_OP_THRESHOLD_MS}
+span_latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+span_slow = defaultdict(int)
+
+
+def record_span(name, elapsed):
+    span_latency[name].observe(elapsed)
+    if elapsed * 1000 >= tracing["threshold_ms"]:
+        span_slow[name] += 1
+        print(f"🐢 Slow {name}: {elapsed * 1000:.1f} ms")
+
+
+class Span:
+    """Замер блока кода: with Span("serialize:dsr"): ..."""
+
+    __slots__ = ("name", "started")
+
+    def __init__(self, name):
+        self.name = name
+        self.started = None
+
+    def __enter__(self):
+        if tracing["enabled"]:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.started is not None:
+            record_span(self.name, time.perf_counter() - self.started)
+        return False
+
+
+def traced(name):
+    """Декоратор замера функции; при выключенном тайминге - одна проверка флага"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracing["enabled"]:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record_span(name, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+# Очередь кадров между приёмом (listen_websocket) и обработкой (run_ingest_processor)
+ingest_queue = deque()
+ingest_condition = threading.Condition()
+ingest_stats = {
+    "received": 0,
+    "processed": 0,
+    "coalesced": 0,
+    "dropped": 0,
+    "errors": 0,
+    "reconnects": 0,
+    "max_depth": 0,
+}
+COALESCE_TYPES = {"ACFT_DATA", "EVENT_ACFT_DATA"}
+
+
+class FrameRecorder:
+    """Запись сырых кадров 24data в gzip JSON lines: {"ts": <epoch>, "frame": "<кадр>"}
+
+    Каждый запуск дописывает новый gzip member, так что файл можно продолжать между
+    перезапусками; member закрывается при выходе процесса (atexit). Если процесс
+    убит без закрытия, bench/replay.py читает оборванный member до места обрыва.
+    Буфер сбрасывается на диск раз в flush_interval секунд.
+    """
+
+    def __init__(self, path, flush_interval=5):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.file = gzip.open(path, "at", encoding="utf-8")
+        self.last_flush = time.time()
+        self.frames = 0
+        self.lock = threading.Lock()
+
+    def write(self, wss_data, received_at):
+        if isinstance(wss_data, bytes):
+            wss_data = wss_data.decode("utf-8", errors="replace")
+        try:
+            with self.lock:
+                if self.file.closed:
+                    return
+                self.file.write(json.dumps({"ts": received_at, "frame": wss_data}) + "\n")
+                self.frames += 1
+                if received_at - self.last_flush >= self.flush_interval:
+                    self.file.flush()
+                    self.last_flush = received_at
+        except Exception as e:
+            print(f"Error recording frame to {self.path}: {e}")
+
+    def close(self):
+        """Запись окончания gzip member; после закрытия кадры не записываются"""
+        with self.lock:
+            self.file.close()
+
+
+frame_recorder = FrameRecorder(RECORD_FILE) if RECORD_FILE else None
+if frame_recorder is not None:
+    atexit.register(frame_recorder.close)
 
 
 async def listen_websocket(uri):
@@ -298,104 +809,239 @@ async def listen_websocket(uri):
                 while True:
                     try:
                         wss_data = await websocket.recv()
-                        process_websocket_data(wss_data)
+                        received_at = time.time()
+                        if frame_recorder is not None:
+                            frame_recorder.write(wss_data, received_at)
+                        enqueue_frame(wss_data, received_at)
                     except websockets.exceptions.ConnectionClosed as e:
                         print(f"WebSocket connection closed: {e}")
                         break
-                    except Exception as e:
-                        print(f"Error processing message: {e}")
-                        break
         except Exception as e:
             print(f"WebSocket connection error: {e}")
-            print(f"Reconnecting in {RECONNECT_DELAY} seconds...")
-            await asyncio.sleep(RECONNECT_DELAY)
+        ingest_stats["reconnects"] += 1
+        print(f"Reconnecting in {RECONNECT_DELAY} seconds...")
+        await asyncio.sleep(RECONNECT_DELAY)
+
+
+def peek_frame_type(wss_data):
+    """Тип кадра без полного разбора JSON (для вытеснения при переполнении очереди)"""
+    if isinstance(wss_data, dict):
+        return wss_data.get("t")
+    head = wss_data[:64]
+    if isinstance(head, bytes):
+        head = head.decode("utf-8", "ignore")
+    for msg_type in ("EVENT_ACFT_DATA", "ACFT_DATA", "EVENT_FLIGHT_PLAN", "FLIGHT_PLAN"):
+        if msg_type in head:
+            return msg_type
+    return None
+
+
+def enqueue_frame(wss_data, received_at):
+    """Приём кадра в ограниченную очередь
+
+    При переполнении вытесняется самый старый ACFT_DATA кадр - его позиции всё равно
+    перекрываются более новыми кадрами. Планы полётов вытесняются только если
+    в очереди нет ничего другого.
+    """
+    with ingest_condition:
+        ingest_stats["received"] += 1
+        if len(ingest_queue) >= INGEST_QUEUE_SIZE:
+            victim = None
+            for i, (queued, _) in enumerate(ingest_queue):
+                if peek_frame_type(queued) in COALESCE_TYPES:
+                    victim = i
+                    break
+            del ingest_queue[victim if victim is not None else 0]
+            ingest_stats["dropped"] += 1
+
+        ingest_queue.append((wss_data, received_at))
+        ingest_stats["max_depth"] = max(ingest_stats["max_depth"], len(ingest_queue))
+        ingest_condition.notify()
+
+
+def coalesce_frames(frames):
+    """Склейка подряд идущих ACFT_DATA кадров одного типа: остаётся новейшая позиция
+    каждого самолёта. Остальные кадры служат границами и сохраняют порядок.
+
+    Время приёма каждого самолёта сохраняется в "received" склеенного кадра, чтобы
+    самолёт из старого кадра не получил время более нового (и лишнее время live).
+    """
+    result = []
+    for data, received_at in frames:
+        msg_type = data.get("t")
+        if (result and msg_type in COALESCE_TYPES and result[-1][0].get("t") == msg_type
+                and isinstance(data.get("d"), dict) and isinstance(result[-1][0].get("d"), dict)):
+            previous, previous_at = result[-1]
+            merged = dict(previous["d"])
+            merged.update(data["d"])
+            received = previous.get("received")
+            received = dict(received) if received else dict.fromkeys(previous["d"], previous_at)
+            received.update(dict.fromkeys(data["d"], received_at))
+            result[-1] = ({"t": msg_type, "d": merged, "received": received}, received_at)
+            ingest_stats["coalesced"] += 1
+        else:
+            result.append((data, received_at))
+    return result
+
+
+def run_ingest_processor():
+    """Стадия обработки: забирает накопленные кадры пачкой, склеивает и применяет"""
+    while True:
+        with ingest_condition:
+            while not ingest_queue:
+                ingest_condition.wait()
+            batch = list(ingest_queue)
+            ingest_queue.clear()
+
+        frames = []
+        for wss_data, received_at in batch:
+            data = decode_frame(wss_data)
+            if data is None:
+                ingest_stats["errors"] += 1
+                continue
+            frames.append((data, received_at))
+
+        with write_lock:
+            for data, received_at in coalesce_frames(frames):
+                frame_queue_delay.observe(max(0.0, time.time() - received_at))
+                if not apply_frame(data, received_at):
+                    ingest_stats["errors"] += 1
+                ingest_stats["processed"] += 1
+            publish_state()
+
+
+def get_ingest_stats():
+    stats = dict(ingest_stats)
+    stats["queue_depth"] = len(ingest_queue)
+    return stats
+
+
+@traced("decode_frame")
+def decode_frame(wss_data):
+    """Разбор кадра WebSocket; None для битых кадров"""
+    try:
+        data = decode_ws_frame(wss_data) if isinstance(wss_data, (str, bytes)) else wss_data
+    except ValueError as e:
+        print(f"JSON decode error: {e}")
+        return None
+    if not isinstance(data, dict):
+        return None
+    return data
 
 
-def process_websocket_data(wss_data):
+def process_websocket_data(wss_data, received_at=None):
+    """Синхронная обработка одного кадра (разбор + применение)"""
+    data = decode_frame(wss_data)
+    if data is None:
+        return False
+    with write_lock:
+        applied = apply_frame(data, received_at)
+        publish_state()
+    return applied
+
+
+@traced("apply_frame")
+def apply_frame(data, received_at=None):
+    """Применение разобранного кадра к хранилищам; False если кадр не удалось обработать"""
+    started = time.perf_counter()
+    msg_type = data.get("t")
+    if msg_type not in FRAME_TYPES:
+        msg_type = "other"
     try:
-        data = json.loads(wss_data) if isinstance(wss_data, str) else wss_data
-        if not isinstance(data, dict):
-            return
-
-        received_at = datetime.now(timezone.utc)
-        msg_type = data.get("t")
+        if received_at is None:
+            received_at = time.time()
         msg_data = data.get("d", {})
 
         if msg_type == "ACFT_DATA":
-            process_acft_data(msg_data, received_at=received_at)
+            process_acft_data(msg_data, received_at=received_at, received_times=data.get("received"))
         elif msg_type == "FLIGHT_PLAN":
             process_flight_plan(msg_data, received_at=received_at)
+            journal_append("frame", data, received_at)
         elif msg_type == "EVENT_ACFT_DATA":
-            process_acft_data(msg_data, event=True, received_at=received_at)
+            process_acft_data(msg_data, event=True, received_at=received_at, received_times=data.get("received"))
         elif msg_type == "EVENT_FLIGHT_PLAN":
             process_flight_plan(msg_data, event=True, received_at=received_at)
+            journal_append("frame", data, received_at)
+        return True
 
-    except json.JSONDecodeError as e:
-        print(f"JSON decode error: {e}")
     except Exception as e:
         print(f"Error processing WebSocket data: {e}")
+        return False
 
+    finally:
+        frame_counts[msg_type] += 1
+        frame_latency[msg_type].observe(time.perf_counter() - started)
 
-def process_acft_data(data, event=False, received_at=None):
+
+@traced("process_acft_data")
+def process_acft_data(data, event=False, received_at=None, received_times=None):
+    """Применение ACFT_DATA; received_times - время приёма по самолётам для склеенных кадров"""
     if received_at is None:
-        received_at = datetime.now(timezone.utc)
+        received_at = time.time()
 
-    unalive_flights(event)
+    expire_flights(received_at)
 
     store = edsr if event else dsr
-    times_store = event_flight_times if event else flight_times
 
     for realcallsign, flight_data in data.items():
         player_name = flight_data.get("playerName")
         if not player_name:
             continue
 
-        callsign = None
-        for cs, flight_info in store.items():
-            if flight_info.get("player_name") == player_name:
-                callsign = cs
-                break
+        callsign = find_callsign(player_name, event=event)
 
         if callsign is None:
             callsign = realcallsign
             if callsign not in store:
-                store[callsign] = {}
+                store[callsign] = FlightRecord()
 
-        previous_state = store[callsign].get("state", 0)
-        current_state = get_flight_state(callsign, flight_data, event=event)
+        index_flight(callsign, player_name, realcallsign, event=event)
 
-        store[callsign].update({
-            "realcallsign": realcallsign,
-            "heading": flight_data.get("heading"),
-            "player_name": player_name,
-            "altitude": flight_data.get("altitude"),
-            "aircraft": AIRCRAFT_SHORT_NAMES.get(
-                flight_data.get("aircraftType"),
-                flight_data.get("aircraftType")
-            ),
-            "pos_x": flight_data.get("position", {}).get("x"),
-            "pos_y": flight_data.get("position", {}).get("y"),
-            "speed": flight_data.get("speed"),
-            "ground_speed": round(flight_data.get("groundSpeed", 0), 0),
-            "wind": flight_data.get("wind"),
-            "is_on_ground": flight_data.get("isOnGround", False),
-            "live": True,
-            "data_valid": True,
-            "last_fresh_time": received_at,
-            "state": current_state,
-            "previous_state": previous_state,
-            "is_emergency": flight_data.get("isEmergencyOccuring", False),
-            "cs": store[callsign].get("cs", realcallsign)
-        })
-
-        # Трекинг времени для обычных рейсов
-        if not event:
-            track_flight_times(callsign, store[callsign], received_at, previous_state, current_state)
+        record = store[callsign]
+        seen_at = received_times.get(realcallsign, received_at) if received_times else received_at
+        previous_state = record.state
+        was_on_ground = record.is_on_ground
+        current_state = get_flight_state(callsign, flight_data, event=event)
+        position = flight_data.get("position") or {}
+        aircraft_type = flight_data.get("aircraftType")
+
+        record.has_acft = True
+        record.realcallsign = realcallsign
+        record.heading = flight_data.get("heading")
+        record.player_name = player_name
+        record.altitude = flight_data.get("altitude")
+        record.aircraft = intern_code(AIRCRAFT_SHORT_NAMES.get(aircraft_type, aircraft_type))
+        record.pos_x = position.get("x")
+        record.pos_y = position.get("y")
+        record.speed = flight_data.get("speed")
+        record.ground_speed = round(flight_data.get("groundSpeed", 0), 0)
+        record.wind = intern_code(flight_data.get("wind"))
+        record.is_on_ground = flight_data.get("isOnGround", False)
+        record.live = True
+        record.data_valid = True
+        record.last_fresh_time = seen_at
+        record.state = current_state
+        record.previous_state = previous_state
+        if current_state in (2, 3, 4):
+            record.has_departed = True
+        record.is_emergency = flight_data.get("isEmergencyOccuring", False)
+        if record.cs is None:
+            record.cs = realcallsign
+
+        # Трекинг времени (обычные и ивентовые рейсы)
+        track_flight_times(callsign, record, seen_at, previous_state, current_state, event=event)
+        record_airport_movement(record, previous_state, current_state, was_on_ground, seen_at, event=event)
+        update_airport_presence(callsign, record, seen_at, event=event)
+        record_track_point(callsign, record, seen_at, event=event)
+        learn_airport_position(record)
+
+        schedule_flight(callsign, event=event)
+        mark_flight_changed(callsign, event=event)
 
 
 def process_flight_plan(data, event=False, received_at=None):
     if received_at is None:
-        received_at = datetime.now(timezone.utc)
+        received_at = time.time()
 
     player_name = data.get("robloxName")
     callsign_from_fpl = data.get("callsign")
@@ -405,23 +1051,17 @@ def process_flight_plan(data, event=False, received_at=None):
         return
 
     store = edsr if event else dsr
-    times_store = event_flight_times if event else flight_times
 
-    existing_callsign = None
-    for cs, flight_info in store.items():
-        if flight_info.get("player_name") == player_name:
-            existing_callsign = cs
-            break
+    existing_callsign = find_callsign(player_name, event=event)
 
     if existing_callsign:
         callsign = existing_callsign
-        for field in ["departure", "arrival", "flight_level", "flightrules", "route"]:
-            if field in store[callsign]:
-                del store[callsign][field]
     else:
         callsign = callsign_from_fpl if callsign_from_fpl else realcallsign
         if callsign not in store:
-            store[callsign] = {}
+            store[callsign] = FlightRecord()
+
+    index_flight(callsign, player_name, realcallsign, event=event)
 
     flight_level = 0
     try:
@@ -430,66 +1070,134 @@ def process_flight_plan(data, event=False, received_at=None):
     except (ValueError, AttributeError):
         flight_level = 0
 
-    store[callsign].update({
-        "realcallsign": realcallsign,
-        "fpl_created_time": received_at.strftime("%H:%M") + "z",
-        "departure": data.get("departing", "ZZZZ"),
-        "arrival": data.get("arriving", "ZZZZ"),
-        "flight_level": flight_level,
-        "player_name": player_name,
-        "aircraft": AIRCRAFT_SHORT_NAMES.get(data.get("aircraft"), data.get("aircraft")),
-        "flightrules": data.get("flightrules"),
-        "route": data.get("route", "N/A"),
-        "data_valid": False,
-        "live": False,
-        "last_fresh_time": received_at,
-        "state": 0,
-        "previous_state": 0,
-        "is_emergency": data.get("isEmergencyOccuring", False),
-        "cs": callsign_from_fpl if callsign_from_fpl else realcallsign
-    })
-
-    if callsign not in times_store:
-        times_store[callsign] = {}
-
-    times_store[callsign].update({
-        "fpl_created": received_at,
-        "last_update": received_at,
-    })
-
-
-def track_flight_times(callsign, flight_data, received_at, previous_state, current_state):
-    """Трекинг времени для рейсов"""
-    if callsign not in flight_times:
-        flight_times[callsign] = {}
+    record = store[callsign]
+    record.has_fpl = True
+    record.realcallsign = realcallsign
+    record.fpl_created_time = time.strftime("%H:%M", time.gmtime(received_at)) + "z"
+    record.departure = intern_code(data.get("departing", "ZZZZ"))
+    record.arrival = intern_code(data.get("arriving", "ZZZZ"))
+    record.flight_level = flight_level
+    record.player_name = player_name
+    record.aircraft = intern_code(AIRCRAFT_SHORT_NAMES.get(data.get("aircraft"), data.get("aircraft")))
+    record.flightrules = intern_code(data.get("flightrules"))
+    record.route = data.get("route", "N/A")
+    record.data_valid = False
+    record.live = False
+    record.last_fresh_time = received_at
+    record.state = 0
+    record.previous_state = 0
+    record.is_emergency = data.get("isEmergencyOccuring", False)
+    record.cs = callsign_from_fpl if callsign_from_fpl else realcallsign
+    record.fpl_created = received_at
+    record.last_update = received_at
+    record.obt_start = None
+    record.takeoff_time = None
+    record.has_departed = False
+    update_airport_presence(callsign, record, received_at, event=event)
+
+    schedule_flight(callsign, event=event)
+    mark_flight_changed(callsign, event=event)
+
+
+def find_callsign(player_name, event=False):
+    """Поиск ключа рейса по имени игрока через индекс"""
+    players = eplayer_index if event else player_index
+    return players.get(player_name)
+
+
+def find_callsign_by_realcallsign(realcallsign, event=False):
+    """Поиск ключа рейса по внутриигровому позывному через индекс"""
+    reals = erealcs_index if event else realcs_index
+    return reals.get(realcallsign)
+
+
+def index_flight(callsign, player_name, realcallsign, event=False):
+    """Обновление индексов перед записью player_name/realcallsign в рейс"""
+    store = edsr if event else dsr
+    players = eplayer_index if event else player_index
+    reals = erealcs_index if event else realcs_index
+    record = store.get(callsign)
+    if record is None:
+        return
+
+    # Снимаем старые ключи, если они указывают на этот рейс
+    old_player = record.player_name
+    if old_player and old_player != player_name and players.get(old_player) == callsign:
+        del players[old_player]
+
+    old_real = record.realcallsign
+    if old_real and old_real != realcallsign and reals.get(old_real) == callsign:
+        del reals[old_real]
+
+    if player_name:
+        players[player_name] = callsign
+    if realcallsign:
+        reals[realcallsign] = callsign
+
+
+def unindex_flight(callsign, event=False):
+    """Удаление рейса из индексов (вызывается перед удалением из хранилища)"""
+    store = edsr if event else dsr
+    players = eplayer_index if event else player_index
+    reals = erealcs_index if event else realcs_index
+    record = store.get(callsign)
+    if record is None:
+        return
+
+    player_name = record.player_name
+    if player_name and players.get(player_name) == callsign:
+        del players[player_name]
 
+    realcallsign = record.realcallsign
+    if realcallsign and reals.get(realcallsign) == callsign:
+        del reals[realcallsign]
+
+
+def track_flight_times(callsign, record, received_at, previous_state, current_state, event=False):
+    """Трекинг времени для рейсов
+
+    Времена фиксируются один раз на переходах состояний, и в этот же момент выборка
+    попадает в агрегаты аэропорта вылета.
+    """
     # Фиксируем начало Off-Block (state 0 -> state 1)
     if current_state == 1 and previous_state == 0:
-        if "obt_start" not in flight_times[callsign]:
-            flight_times[callsign]["obt_start"] = received_at
-            print(f"⏱️ {callsign}: Off-Block started at {received_at.strftime('%H:%M:%S')}")
+        if record.obt_start is None:
+            record.obt_start = received_at
+            print(f"⏱️ {callsign}: Off-Block started at {time.strftime('%H:%M:%S', time.gmtime(received_at))}")
 
-    # Фиксируем начало Taxi (state 1 -> state 2 или выше)
+            # Off-Block Time - от подачи плана до начала движения
+            if record.fpl_created is not None:
+                obt_time = (record.obt_start - record.fpl_created) / 60
+                if 0 < obt_time < 120:  # От 0 до 120 минут
+                    add_airport_sample(record.departure, "obt", obt_time, received_at, event=event)
+
+    # Фиксируем взлёт (state 1 -> state 2 или выше)
     elif current_state >= 2 and previous_state == 1:
-        if "taxi_start" not in flight_times[callsign]:
-            flight_times[callsign]["taxi_start"] = received_at
-            print(f"🚕 {callsign}: Taxi started at {received_at.strftime('%H:%M:%S')}")
+        if record.takeoff_time is None:
+            record.takeoff_time = received_at
+            print(f"🛫 {callsign}: Took off at {time.strftime('%H:%M:%S', time.gmtime(received_at))}")
 
             # Если OBT ещё не зафиксирован, фиксируем его тоже
-            if "obt_start" not in flight_times[callsign]:
-                flight_times[callsign]["obt_start"] = received_at
+            if record.obt_start is None:
+                record.obt_start = received_at
+
+            # Taxi Time - от начала движения до взлёта
+            taxi_time = (record.takeoff_time - record.obt_start) / 60
+            if 0 < taxi_time < 60:  # От 0 до 60 минут
+                add_airport_sample(record.departure, "taxi", taxi_time, received_at, event=event)
 
 
+@traced("get_flight_state")
 def get_flight_state(callsign, flight_data, event=False):
     store = edsr if event else dsr
-    data = store.get(callsign, {})
+    record = store.get(callsign)
 
     is_on_ground = flight_data.get("isOnGround", False)
     speed = flight_data.get("speed", 0)
     altitude = flight_data.get("altitude", 0)
-    previous_state = data.get("state", 0)
-    departure = data.get("departure", "")
-    arrival = data.get("arrival", "")
+    previous_state = record.state if record else 0
+    departure = record.departure if record else ""
+    arrival = record.arrival if record else ""
 
     cruise_altitude = 25000
     is_training_flight = departure and departure == arrival
@@ -518,90 +1226,602 @@ def get_flight_state(callsign, flight_data, event=False):
     return previous_state
 
 
-def unalive_flights(event=False):
-    current_time = datetime.now(timezone.utc)
+def add_flight_listener(callback):
+    """Подписка на переходы рейсов: callback(kind, callsign, record, event)
+
+    kind - "stale" (рейс перестал быть live) или "expired" (рейс удалён).
+    """
+    flight_listeners.append(callback)
+
+
+def emit_flight_event(kind, callsign, record, event=False):
+    """Рассылка перехода рейса подписчикам"""
+    for callback in flight_listeners:
+        try:
+            callback(kind, callsign, record, event)
+        except Exception as e:
+            print(f"Error in flight listener for {callsign}: {e}")
+
+
+def get_deadline(record, kind):
+    """Дедлайн рейса (epoch seconds) для перехода данного типа"""
+    if record.last_fresh_time is None:
+        return None
+    timeout = LIVE_TIMEOUT if kind == "stale" else DATA_TIMEOUT
+    return record.last_fresh_time + timeout.total_seconds()
+
+
+def schedule_flight(callsign, event=False):
+    """Постановка дедлайнов рейса в очередь
+
+    В куче держим не больше одной актуальной записи на (kind, event, callsign): при
+    срабатывании запись сверяется с актуальным last_fresh_time и при необходимости
+    переносится. Записи, чей seq не совпадает с expiry_scheduled, устарели и пропускаются.
+    """
     store = edsr if event else dsr
-    for callsign, data in store.items():
-        if data.get("live") and data.get("last_fresh_time"):
-            if current_time - data["last_fresh_time"] > LIVE_TIMEOUT:
-                data["live"] = False
-
-
-def cleanup_old_data():
-    current_time = datetime.now(timezone.utc)
-
-    # Очистка обычных данных
-    for store, times_store in [(dsr, flight_times)]:
-        to_delete = [
-            callsign
-            for callsign, data in store.items()
-            if data.get("last_fresh_time")
-               and (current_time - data["last_fresh_time"]) > DATA_TIMEOUT
-        ]
-
-        for callsign in to_delete:
-            del store[callsign]
-            if callsign in times_store:
-                del times_store[callsign]
+    record = store.get(callsign)
+    if record is None:
+        return
+
+    with write_lock:
+        for kind in ("stale", "expired"):
+            if kind == "stale" and not record.live:
+                continue
+            key = (kind, event, callsign)
+            if key in expiry_scheduled:
+                continue
+            deadline = get_deadline(record, kind)
+            if deadline is None:
+                continue
+            seq = next(expiry_seq)
+            heapq.heappush(expiry_heap, (deadline, seq, kind, event, callsign))
+            expiry_scheduled[key] = seq
+
+
+def expire_flights(now=None):
+    """Обработка только тех рейсов, чьи дедлайны уже прошли"""
+    if now is None:
+        now = time.time()
+
+    transitions = []
+    with write_lock:
+        while expiry_heap and expiry_heap[0][0] <= now:
+            _, seq, kind, event, callsign = heapq.heappop(expiry_heap)
+            key = (kind, event, callsign)
+            if expiry_scheduled.get(key) != seq:
+                # Запись заменена более новой (рейс удалён и подключился снова)
+                continue
+            del expiry_scheduled[key]
+
+            store = edsr if event else dsr
+            record = store.get(callsign)
+            if record is None:
+                continue
+
+            if kind == "stale" and not record.live:
+                continue
+
+            # Рейс обновлялся после постановки в очередь - переносим дедлайн
+            deadline = get_deadline(record, kind)
+            if deadline is None:
+                continue
+            if deadline > now:
+                seq = next(expiry_seq)
+                heapq.heappush(expiry_heap, (deadline, seq, kind, event, callsign))
+                expiry_scheduled[key] = seq
+                continue
+
+            if kind == "stale":
+                record.live = False
+            else:
+                unindex_flight(callsign, event=event)
+                del store[callsign]
+                expiry_scheduled.pop(("stale", event, callsign), None)
                 print(f"🧹 Удалены устаревшие данные для {callsign}")
 
-    # Очистка устаревших flight_times
-    for times_store in [flight_times]:
-        times_to_delete = [
-            callsign
-            for callsign, times in times_store.items()
-            if "fpl_created" in times and (current_time - times["fpl_created"]) > timedelta(hours=tdel)
-        ]
+            transitions.append((kind, callsign, record, event))
+
+        for kind, callsign, record, event in transitions:
+            mark_flight_changed(callsign, event=event)
+            emit_flight_event(kind, callsign, record, event)
+
+    return len(transitions)
+
+
+class WindowedStats:
+    """Скользящее окно значений: count, mean и перцентили по гистограмме
+
+    Окно разбито на корзины по AIRPORT_STATS_BUCKET секунд, в каждой - счётчик,
+    сумма и разреженная гистограмма с шагом bin_width. Память ограничена числом
+    корзин и бинов, перцентили считаются без хранения отдельных значений.
+    """
+
+    __slots__ = ("bin_width", "buckets")
+
+    def __init__(self, bin_width):
+        self.bin_width = bin_width
+        self.buckets = deque()  # [bucket_start, count, total, {bin: count}]
+
+    def trim(self, now):
+        while self.buckets and self.buckets[0][0] + AIRPORT_STATS_BUCKET <= now - AIRPORT_STATS_WINDOW:
+            self.buckets.popleft()
+
+    def add(self, value, now):
+        start = now - now % AIRPORT_STATS_BUCKET
+        if not self.buckets or self.buckets[-1][0] != start:
+            self.buckets.append([start, 0, 0.0, {}])
+        bucket = self.buckets[-1]
+        bucket[1] += 1
+        bucket[2] += value
+        histogram = bucket[3]
+        index = int(value // self.bin_width)
+        histogram[index] = histogram.get(index, 0) + 1
+        self.trim(now)
+
+    def summary(self, now):
+        self.trim(now)
+        count = sum(bucket[1] for bucket in self.buckets)
+        if not count:
+            return None
+
+        histogram = defaultdict(int)
+        for bucket in self.buckets:
+            for index, bin_count in bucket[3].items():
+                histogram[index] += bin_count
+
+        return {
+            "count": count,
+            "mean": round(sum(bucket[2] for bucket in self.buckets) / count, 2),
+            "p50": self.percentile(histogram, count, 0.5),
+            "p90": self.percentile(histogram, count, 0.9),
+        }
+
+    def percentile(self, histogram, count, q):
+        """Перцентиль с линейной интерполяцией внутри бина"""
+        target = q * count
+        seen = 0
+        for index in sorted(histogram):
+            bin_count = histogram[index]
+            if seen + bin_count >= target:
+                fraction = (target - seen) / bin_count
+                return round((index + fraction) * self.bin_width, 2)
+            seen += bin_count
+        return round((max(histogram) + 1) * self.bin_width, 2)
+
+
+def add_airport_sample(departure, metric, minutes, now, event=False):
+    """Добавление выборки taxi/obt (в минутах) в агрегаты аэропорта вылета"""
+    if not departure or departure == "ZZZZ":
+        return
 
-        for callsign in times_to_delete:
-            del times_store[callsign]
+    name = "eairport_stats" if event else "airport_stats"
+    aggregates = airport_aggregates[name].get(departure)
+    if aggregates is None:
+        aggregates = {metric_name: WindowedStats(bin_width) for metric_name, bin_width in AIRPORT_STATS_BINS.items()}
+        airport_aggregates[name][departure] = aggregates
+
+    aggregates[metric].add(minutes, now)
+    dirty_airport_stats[name].add(departure)
+    bump_version(name)
+
+
+def refresh_airport_stats(now=None):
+    """Сдвиг окна статистики (вызывается раз в AIRPORT_STATS_REFRESH); True, если сводки изменились
+
+    Аэропорт помечается изменённым, только если его сводка после сдвига окна
+    отличается от опубликованной - иначе версии и ETag остаются прежними.
+    """
+    if now is None:
+        now = time.time()
+    changed = False
+    for name, aggregates in airport_aggregates.items():
+        published = published_state[name]
+        stale = set()
+        for icao, metrics in aggregates.items():
+            if icao in dirty_airport_stats[name]:
+                continue
+            summary = {metric: aggregate.summary(now) for metric, aggregate in metrics.items()}
+            summary = {metric: value for metric, value in summary.items() if value is not None}
+            if summary != published.get(icao, {}):
+                stale.add(icao)
+        if stale:
+            dirty_airport_stats[name].update(stale)
+            bump_version(name)
+            changed = True
+    return changed
+
+
+def summarize_airport_stats(previous, name, now):
+    """Сводка по изменившимся аэропортам для публикации: {ICAO: {"taxi": {...}, "obt": {...}}}"""
+    stats = dict(previous)
+    for icao in dirty_airport_stats[name]:
+        summary = {
+            metric: aggregate.summary(now)
+            for metric, aggregate in airport_aggregates[name][icao].items()
+        }
+        summary = {metric: value for metric, value in summary.items() if value is not None}
+        if summary:
+            stats[icao] = summary
+        else:
+            stats.pop(icao, None)
+    dirty_airport_stats[name].clear()
+    return stats
+
+
+class AirportHistory:
+    """Кольцевые буферы движения одного аэропорта для каждого разрешения
+
+    departures/arrivals - число событий за слот, airborne/on_ground - значение
+    на конец слота. Слоты, в которых ничего не менялось, не записываются:
+    при чтении счётчики в них нулевые, а текущие значения переносятся вперёд.
+    Опубликованные строки слотов не меняются на месте, поэтому view() копирует
+    только списки; строка текущего слота копируется один раз после публикации.
+    """
+
+    __slots__ = ("rings", "gauges", "owned")
+
+    def __init__(self):
+        self.rings = {
+            resolution: ([None] * size, [None] * size)  # (начало слота, значения)
+            for resolution, (step, size) in HISTORY_RESOLUTIONS.items()
+        }
+        self.gauges = [0, 0]  # airborne, on_ground
+        self.owned = set()  # Разрешения, чья строка текущего слота ещё не опубликована
+
+    def update(self, resolution, now, column, value=None):
+        """Новая строка текущего слота: +1 к column или value в column"""
+        step, size = HISTORY_RESOLUTIONS[resolution]
+        start = int(now // step) * step
+        index = (start // step) % size
+        stamps, values = self.rings[resolution]
+        if stamps[index] != start:
+            stamps[index] = start
+            values[index] = [0, 0] + self.gauges
+            self.owned.add(resolution)
+        elif resolution not in self.owned:
+            values[index] = list(values[index])
+            self.owned.add(resolution)
+        row = values[index]
+        row[column] = row[column] + 1 if value is None else value
+
+    def add(self, metric, now):
+        """Событие departures/arrivals"""
+        index = HISTORY_METRICS.index(metric)
+        for resolution in self.rings:
+            self.update(resolution, now, index)
+
+    def adjust(self, metric, delta, now):
+        """Изменение текущего значения airborne/on_ground"""
+        index = HISTORY_METRICS.index(metric)
+        self.gauges[index - 2] += delta
+        for resolution in self.rings:
+            self.update(resolution, now, index, self.gauges[index - 2])
+
+    def view(self):
+        """Копия буферов для публикации: {разрешение: (начала слотов, строки)}"""
+        self.owned.clear()
+        return {resolution: (tuple(stamps), tuple(values)) for resolution, (stamps, values) in self.rings.items()}
+
+
+def history_series(view, resolution, now):
+    """Ряды по всем метрикам от старого слота к текущему"""
+    step, size = HISTORY_RESOLUTIONS[resolution]
+    stamps, values = view[resolution]
+    current = int(now // step) * step
+    start = current - (size - 1) * step
+
+    columns = [[] for _ in HISTORY_METRICS]
+    carried = None
+    for slot_start in range(start, current + step, step):
+        index = (slot_start // step) % size
+        row = values[index] if stamps[index] == slot_start else None
+        if row is not None:
+            carried = row[2:]
+            row = list(row)
+        else:
+            row = [0, 0] + (carried if carried is not None else [0, 0])
+        for column, value in zip(columns, row):
+            column.append(value)
+
+    return start, dict(zip(HISTORY_METRICS, columns))
+
+
+def get_airport_history(icao, event=False):
+    """История аэропорта (только известные аэропорты, чтобы память была ограничена)"""
+    if icao not in AIRPORTS:
+        return None
+    name = "edsr" if event else "dsr"
+    history = airport_history[name].get(icao)
+    if history is None:
+        history = airport_history[name][icao] = AirportHistory()
+    dirty_airport_history[name].add(icao)
+    return history
+
+
+def get_airport_presence(record):
+    """Где рейс учитывается в текущих значениях: (аэропорт, метрика) или None
+
+    Учитываются только live рейсы: отключившийся игрок перестаёт считаться сразу,
+    а не через DATA_TIMEOUT.
+    """
+    if record is None or not record.has_acft or not record.live:
+        return None
+    # После посадки ВС тормозит в состоянии 4, затем 1 и 0 - до 5 доходит не всегда
+    if record.has_departed and (record.is_on_ground or record.state in (0, 1, 5)):
+        return (record.arrival, "on_ground")
+    if record.state in (0, 1):
+        return (record.departure, "on_ground")
+    if record.state == 5:
+        return (record.arrival, "on_ground")
+    return (record.arrival, "airborne")
+
+
+def record_airport_movement(record, previous_state, current_state, was_on_ground, now, event=False):
+    """Учёт вылета на переходе состояний и прилёта на первом кадре на земле после вылета"""
+    if previous_state in (0, 1) and current_state in (2, 3, 4, 6):
+        history = get_airport_history(record.departure, event=event)
+        if history is not None:
+            history.add("departures", now)
+    elif record.has_departed and record.is_on_ground and not was_on_ground:
+        history = get_airport_history(record.arrival, event=event)
+        if history is not None:
+            history.add("arrivals", now)
+
+
+def update_airport_presence(callsign, record, now, event=False):
+    """Перенос вклада рейса в airborne/on_ground, если он изменился"""
+    presence = airport_presence["edsr" if event else "dsr"]
+    previous = presence.get(callsign)
+    current = get_airport_presence(record)
+    if previous == current:
+        return
 
+    if previous is not None:
+        history = get_airport_history(previous[0], event=event)
+        if history is not None:
+            history.adjust(previous[1], -1, now)
+    if current is None:
+        presence.pop(callsign, None)
+        return
 
-def calculate_airport_stats(event=False):
-    """Расчёт статистики аэропортов"""
-    airport_stats = defaultdict(lambda: {"taxi_times": [], "obt_times": []})
-    current_time = datetime.now(timezone.utc)
-    one_hour_ago = current_time - timedelta(hours=1)
+    presence[callsign] = current
+    history = get_airport_history(current[0], event=event)
+    if history is not None:
+        history.adjust(current[1], 1, now)
 
-    store = edsr if event else dsr
-    times_store = event_flight_times if event else flight_times
 
-    for callsign, times in times_store.items():
-        if callsign not in store:
-            continue
+def on_flight_expired(kind, callsign, record, event):
+    """Устаревший (stale) или удалённый рейс больше не учитывается в текущих значениях"""
+    update_airport_presence(callsign, None, time.time(), event=event)
 
-        # Пропускаем старые данные (старше 1 часа)
-        if "fpl_created" in times and times["fpl_created"] < one_hour_ago:
-            continue
 
-        departure = store[callsign].get("departure")
-        if not departure:
-            continue
+add_flight_listener(on_flight_expired)
+
 
-        # Расчёт Off-Block Time (OBT) - время от подачи плана до начала движения (state 0 -> state 1)
-        if "fpl_created" in times and "obt_start" in times:
-            obt_time = (times["obt_start"] - times["fpl_created"]).total_seconds() / 60
-            if 0 < obt_time < 120:  # От 0 до 120 минут
-                airport_stats[departure]["obt_times"].append(obt_time)
+def load_airport_positions(path):
+    """Координаты аэропортов из AIRPORT_POSITIONS_FILE: {"IRFD": [x, y], ...}"""
+    if not path:
+        return {}
+    try:
+        with open(path, encoding="utf-8") as file:
+            data = json.load(file)
+        return {icao.upper(): (float(position[0]), float(position[1])) for icao, position in data.items()}
+    except (OSError, ValueError, TypeError, IndexError, AttributeError) as e:
+        print(f"⚠️ Не удалось загрузить координаты аэропортов из {path}: {e}")
+        return {}
 
-        # Расчёт Taxi Time - время от начала движения до взлета (state 1 -> state 2)
-        if "taxi_start" in times:
-            # Нужно время когда рейс взлетел (state >= 2)
-            # Пока просто используем текущее время если рейс уже в state >= 2
-            current_state = store[callsign].get("state", 0)
-            if current_state >= 2:
-                # Для простоты используем время последнего обновления
-                taxi_time = (times.get("last_update", current_time) - times["taxi_start"]).total_seconds() / 60
-                if 0 < taxi_time < 60:  # От 0 до 60 минут
-                    airport_stats[departure]["taxi_times"].append(taxi_time)
 
-    return airport_stats
+AIRPORT_POSITION_OVERRIDES = load_airport_positions(AIRPORT_POSITIONS_FILE)
+
+
+def learn_airport_position(record):
+    """Уточнение координат аэропорта по ВС на земле
+
+    До взлёта ВС находится в аэропорту вылета, после посадки (в том числе на
+    рулении к стоянке) - в аэропорту прибытия. Точки дальше AIRPORT_POSITION_OUTLIER
+    от текущей оценки отбрасываются (игрок появился не там, где указано в плане).
+    """
+    if not record.is_on_ground or not record.has_fpl:
+        return
+    x, y = record.pos_x, record.pos_y
+    if not isinstance(x, (int, float)) or not isinstance(y, (int, float)):
+        return
+    if not record.has_departed and record.state in (0, 1):
+        icao = record.departure
+    elif record.has_departed and record.state in (0, 1, 5):
+        icao = record.arrival
+    else:
+        return
+    if icao not in AIRPORTS:
+        return
+
+    sample = airport_positions.get(icao)
+    if sample is None:
+        airport_positions[icao] = [x, y, 1]
+        return
+    if sample[2] >= AIRPORT_POSITION_MIN_SAMPLES and (x - sample[0]) ** 2 + (y - sample[1]) ** 2 > AIRPORT_POSITION_OUTLIER ** 2:
+        return
+    samples = min(sample[2] + 1, AIRPORT_POSITION_SAMPLES)
+    sample[0] += (x - sample[0]) / samples
+    sample[1] += (y - sample[1]) / samples
+    sample[2] = samples
+
+
+def refresh_airport_positions():
+    """Пересборка опубликованной таблицы координат; True, если она изменилась
+
+    Изученные координаты округляются, поэтому таблица меняется редко.
+    """
+    global airport_position_table
+    table = {}
+    for icao, (x, y, samples) in airport_positions.items():
+        table[icao] = {"x": round(x), "y": round(y), "fir": AIRPORT_FIR.get(icao, "ZZZZ"), "source": "learned"}
+    for icao, (x, y) in AIRPORT_POSITION_OVERRIDES.items():
+        table[icao] = {"x": x, "y": y, "fir": AIRPORT_FIR.get(icao, "ZZZZ"), "source": "file"}
+
+    if table == airport_position_table:
+        return False
+    airport_position_table = table
+    bump_version("airport_positions")
+    return True
+
+
+def is_track_point_redundant(ax, ay, aalt, bx, by, balt, px, py, palt):
+    """Точка b лежит на отрезке a-p в пределах TRACK_TOLERANCE / TRACK_ALT_TOLERANCE"""
+    dx, dy = px - ax, py - ay
+    length_sq = dx * dx + dy * dy
+    if length_sq == 0:
+        fraction = 0.0
+        distance_sq = (bx - ax) ** 2 + (by - ay) ** 2
+    else:
+        fraction = max(0.0, min(1.0, ((bx - ax) * dx + (by - ay) * dy) / length_sq))
+        distance_sq = (ax + fraction * dx - bx) ** 2 + (ay + fraction * dy - by) ** 2
+    if distance_sq > TRACK_TOLERANCE * TRACK_TOLERANCE:
+        return False
+    return abs(aalt + fraction * (palt - aalt) - balt) <= TRACK_ALT_TOLERANCE
+
+
+class FlightTrack:
+    """Кольцевой буфер позиций рейса в массивах (t, x, y, altitude, heading)
+
+    Если предыдущая точка (и все уже выброшенные после последней сохранённой) лежит
+    на прямой между соседними, новая точка заменяет её, поэтому стоянка и прямые
+    участки занимают по две точки. При заполнении буфера затираются самые старые точки.
+    Запись и чтение точек - под собственным lock трека, читатель не ждёт write_lock.
+    """
+
+    __slots__ = ("times", "xs", "ys", "altitudes", "headings", "start", "count", "dropped", "lock")
+
+    def __init__(self):
+        self.times = array("d", bytes(8 * TRACK_MAX_POINTS))
+        self.xs = array("f", bytes(4 * TRACK_MAX_POINTS))
+        self.ys = array("f", bytes(4 * TRACK_MAX_POINTS))
+        self.altitudes = array("f", bytes(4 * TRACK_MAX_POINTS))
+        self.headings = array("f", bytes(4 * TRACK_MAX_POINTS))
+        self.start = 0
+        self.count = 0
+        self.dropped = []  # Выброшенные точки после предпоследней сохранённой (x, y, altitude)
+        self.lock = threading.Lock()
+
+    def index(self, offset):
+        return (self.start + offset) % TRACK_MAX_POINTS
+
+    def append(self, t, x, y, altitude, heading):
+        if self.count >= 2:
+            a = self.index(self.count - 2)
+            b = self.index(self.count - 1)
+            ax, ay, aalt = self.xs[a], self.ys[a], self.altitudes[a]
+            last = (self.xs[b], self.ys[b], self.altitudes[b])
+            if len(self.dropped) < TRACK_DROPPED_LIMIT and all(
+                is_track_point_redundant(ax, ay, aalt, *point, x, y, altitude)
+                for point in (last, *self.dropped)
+            ):
+                if not self.dropped or self.dropped[-1] != last:
+                    self.dropped.append(last)
+                self.write(b, t, x, y, altitude, heading)
+                return
+        self.dropped = []
+
+        if self.count < TRACK_MAX_POINTS:
+            self.write(self.index(self.count), t, x, y, altitude, heading)
+            self.count += 1
+        else:
+            self.write(self.start, t, x, y, altitude, heading)
+            self.start = (self.start + 1) % TRACK_MAX_POINTS
+
+    def write(self, i, t, x, y, altitude, heading):
+        self.times[i] = t
+        self.xs[i] = x
+        self.ys[i] = y
+        self.altitudes[i] = altitude
+        self.headings[i] = heading
+
+    def points(self):
+        """Точки трека от старых к новым: [t, x, y, altitude, heading]"""
+        result = []
+        for offset in range(self.count):
+            i = self.index(offset)
+            result.append([self.times[i], round(self.xs[i], 1), round(self.ys[i], 1),
+                           round(self.altitudes[i]), round(self.headings[i])])
+        return result
+
+
+def simplify_track(points, tolerance):
+    """Упрощение трека (Douglas-Peucker) по горизонтальному отклонению"""
+    if len(points) < 3 or tolerance <= 0:
+        return points
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    tolerance_sq = tolerance * tolerance
+
+    while stack:
+        first, last = stack.pop()
+        ax, ay = points[first][1], points[first][2]
+        dx, dy = points[last][1] - ax, points[last][2] - ay
+        length_sq = dx * dx + dy * dy
+
+        max_distance, max_index = 0.0, None
+        for i in range(first + 1, last):
+            px, py = points[i][1] - ax, points[i][2] - ay
+            if length_sq == 0:
+                distance = px * px + py * py
+            else:
+                cross = px * dy - py * dx
+                distance = cross * cross / length_sq
+            if distance > max_distance:
+                max_distance, max_index = distance, i
+
+        if max_index is not None and max_distance > tolerance_sq:
+            keep[max_index] = True
+            stack.append((first, max_index))
+            stack.append((max_index, last))
+
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def record_track_point(callsign, record, now, event=False):
+    """Добавление позиции рейса в трек (вызывается под write_lock)"""
+    if record.pos_x is None or record.pos_y is None:
+        return
+
+    key = (event, callsign)
+    track = flight_tracks.get(key)
+    if track is None:
+        # Глобальный лимит: вытесняем трек, который дольше всех не обновлялся
+        if len(flight_tracks) >= TRACK_MAX_FLIGHTS:
+            flight_tracks.popitem(last=False)
+        track = flight_tracks[key] = FlightTrack()
+    else:
+        flight_tracks.move_to_end(key)
+
+    with track.lock:
+        track.append(now, record.pos_x, record.pos_y, record.altitude or 0, record.heading or 0)
+
+
+def get_track_points(callsign, event=False):
+    """Копия точек трека для читателя или None (без write_lock, см. FlightTrack)"""
+    track = flight_tracks.get((event, callsign))
+    if track is None:
+        return None
+    with track.lock:
+        return track.points()
+
+
+def on_track_flight_expired(kind, callsign, record, event):
+    """Трек удаляется вместе с рейсом"""
+    if kind == "expired":
+        flight_tracks.pop((event, callsign), None)
+
+
+add_flight_listener(on_track_flight_expired)
 
 
 def get_active_arpts(event=False):
     """Получение активных аэропортов"""
     active = set()
-    store = edsr if event else dsr
+    store = published_state["edsr" if event else "dsr"]
 
     for callsign, data in store.items():
         if data.get('departure') and data.get('arrival'):
@@ -614,126 +1834,1276 @@ def get_active_arpts(event=False):
     return active
 
 
-def fetch_external_atc_data():
-    """Получение обычных ATC данных из внешнего API (GET запрос)"""
-    try:
-        url = f"{EXTERNAL_API_URL}/controllers"
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()
-        controllers = response.json()
-
-        active_arpt = get_active_arpts(event=False)
-        active_firs = []
-        filtered_controllers = []
-
-        for controller in controllers:
-            arpt = CTR_TO_ARPT.get(controller.get("airport"), controller.get("airport", 'ZZZZ'))
-
-            if controller['position'] == 'CTR':
-                fir_code = AIRPORTS[arpt].get('fir', 'ZZZZ')
-                position_name = fir_code + '_CTR'
-                active_firs.append(fir_code)
-            else:
-                position_name = arpt + '_' + controller.get('position', 'ZZZ')
+def build_atc_index():
+    """Статические индексы для разбора ATC (строятся один раз при старте)
+
+    AIRPORT_FIR: аэропорт -> FIR, FIR_AIRPORTS: FIR -> аэропорты,
+    POSITION_INDEX: (аэропорт, позиция) -> (имя позиции, частота).
+    """
+    airport_fir = {icao: info.get("fir", "ZZZZ") for icao, info in AIRPORTS.items()}
+    fir_airports = defaultdict(list)
+    for icao, fir_code in airport_fir.items():
+        fir_airports[fir_code].append(icao)
+
+    position_index = {}
+    for icao, fir_code in airport_fir.items():
+        position_name = fir_code + "_CTR"
+        position_index[(icao, "CTR")] = (position_name, FREQ_LIST.get(position_name, "ZZZ.ZZZ"))
+    for position_name, frequency in FREQ_LIST.items():
+        icao, position = position_name.split("_", 1)
+        if position != "CTR":
+            position_index[(icao, position)] = (position_name, frequency)
+
+    return airport_fir, dict(fir_airports), position_index
+
+
+AIRPORT_FIR, FIR_AIRPORTS, POSITION_INDEX = build_atc_index()
+CTR_AIRPORTS = set(CTR_TO_ARPT.values())
+POSITION_PRIORITY = {'CTR': 0, 'APP': 1, 'TWR': 2, 'GND': 3}
+
+
+def resolve_position(arpt, position):
+    """Имя позиции и частота по индексу"""
+    resolved = POSITION_INDEX.get((arpt, position))
+    if resolved is None:
+        if position == "CTR":
+            position_name = AIRPORT_FIR.get(arpt, "ZZZZ") + "_CTR"
+        else:
+            position_name = arpt + "_" + position
+        resolved = (position_name, FREQ_LIST.get(position_name, "ZZZ.ZZZ"))
+    return resolved
+
+
+@traced("apply_external_atc_data")
+def apply_external_atc_data(controllers):
+    """Обработка ответа /controllers внешнего API и публикация ATC
+
+    Версия atc (и зависящие от неё кэши) меняется только если покрытие изменилось.
+    Ошибки пробрасываются в poll_source: ответ не считается применённым и будет
+    обработан повторно.
+    """
+    active_arpt = get_active_arpts(event=False)
+    ctr_by_fir = {}
+    filtered_controllers = []
+
+    for controller in controllers:
+        arpt = CTR_TO_ARPT.get(controller.get("airport"), controller.get("airport", 'ZZZZ'))
+        position = controller.get('position', 'ZZZ')
+        position_name, frequency = resolve_position(arpt, position)
+
+        if position == 'CTR':
+            # Первый CTR в FIR покрывает её второстепенные аэропорты
+            ctr_by_fir.setdefault(AIRPORT_FIR.get(arpt, 'ZZZZ'), controller)
+
+        active_arpt.add(arpt)
+
+        filtered_controllers.append({
+            "holder": controller.get("holder"),
+            "airport": arpt,
+            "position": position,
+            "queue": controller.get("queue", []),
+            "frequency": frequency,
+            "position_name": position_name
+        })
 
-            active_arpt.add(arpt)
+    for arpt in active_arpt:
+        if arpt in CTR_AIRPORTS:
+            continue
 
+        fir_code = AIRPORT_FIR.get(arpt, 'ZZZZ')
+        ctr_controller = ctr_by_fir.get(fir_code)
+        if ctr_controller:
+            position_name, frequency = resolve_position(arpt, 'CTR')
             filtered_controllers.append({
-                "holder": controller.get("holder"),
+                "holder": ctr_controller.get("holder"),
                 "airport": arpt,
-                "position": controller.get('position', 'ZZZ'),
-                "queue": controller.get("queue", []),
-                "frequency": FREQ_LIST.get(position_name, 'ZZZ.ZZZ'),
+                "position": 'CTR',
+                "queue": ctr_controller.get("queue", []),
+                "frequency": frequency,
                 "position_name": position_name
             })
 
-        for arpt in list(active_arpt):
-            if arpt not in 'ISAU IGRV ITKO IPPH IZOL IBTH ILAR IRFD'.split():
-                fir_code = AIRPORTS[arpt].get('fir', 'ZZZZ')
-
-                if fir_code in active_firs:
-                    ctr_controller = None
-                    for controller in controllers:
-                        if controller['position'] == 'CTR':
-                            ctr_arpt = CTR_TO_ARPT.get(controller.get("airport"),
-                                                       controller.get("airport", 'ZZZZ'))
-                            if AIRPORTS[ctr_arpt].get('fir', 'ZZZZ') == fir_code:
-                                ctr_controller = controller
-                                break
-
-                    if ctr_controller:
-                        position_name = fir_code + '_CTR'
-                        filtered_controllers.append({
-                            "holder": ctr_controller.get("holder"),
-                            "airport": arpt,
-                            "position": 'CTR',
-                            "queue": ctr_controller.get("queue", []),
-                            "frequency": FREQ_LIST.get(position_name, 'ZZZ.ZZZ'),
-                            "position_name": position_name
-                        })
-
-        position_priority = {'CTR': 0, 'APP': 1, 'TWR': 2, 'GND': 3}
-
-        def sort_key(controller):
-            pos = controller['position']
-            priority = position_priority.get(pos, 99)
-            return priority, controller['airport']
-
-        filtered_controllers.sort(key=sort_key)
-
-        global atc
+    def sort_key(controller):
+        pos = controller['position']
+        priority = POSITION_PRIORITY.get(pos, 99)
+        return priority, controller['airport']
+
+    filtered_controllers.sort(key=sort_key)
+
+    global atc
+    with write_lock:
+        if filtered_controllers == atc:
+            return
         atc = filtered_controllers
-        print(f"External ATC data updated: {len(atc)} controllers")
+        bump_version("atc")
+        publish_state()
+    print(f"External ATC data updated: {len(atc)} controllers")
+
+
+def apply_external_atis_data(atis_data):
+    """Обработка ответа /atis внешнего API и публикация ATIS"""
+    global atis
+    with write_lock:
+        atis = {item["airport"]: item for item in atis_data if "airport" in item}
+        bump_version("atis")
+        publish_state()
+    print(f"External ATIS data updated: {len(atis)} airports")
+
+
+# Источники внешнего API: путь, интервал опроса, обработчик ответа и контекст -
+# данные помимо тела ответа, от которых зависит результат обработки (покрытие CTR
+# второстепенных аэропортов зависит от набора активных аэропортов)
+UPSTREAM_SOURCES = {
+    "atc": {"path": "/controllers", "interval": ATC_UPDATE_INTERVAL, "apply": apply_external_atc_data,
+            "context": get_active_arpts},
+    "atis": {"path": "/atis", "interval": ATIS_UPDATE_INTERVAL, "apply": apply_external_atis_data,
+             "context": None},
+}
+source_status = {
+    name: {
+        "state": "closed",
+        "failures": 0,
+        "open_until": 0.0,
+        "etag": None,
+        "last_modified": None,
+        "content_hash": None,
+        "payload": None,
+        "applied": None,
+        "last_attempt": None,
+        "last_success": None,
+        "last_change": None,
+        "latency_ms": None,
+        "fetches": 0,
+        "errors": 0,
+        "not_modified": 0,
+        "unchanged": 0,
+        "last_error": None,
+    }
+    for name in UPSTREAM_SOURCES
+}
+
+
+def apply_event_atc_data(data):
+    """Применение ивентовых ATC данных (POST или журнал)"""
+    global eatc
+    eatc = data
+    bump_version("eatc")
+
+
+def apply_event_atis_data(data):
+    """Применение ивентовых ATIS данных (POST или журнал)"""
+    global eatis
+    eatis = {item["airport"]: item for item in data if "airport" in item}
+    bump_version("eatis")
+
+
+def get_http_session():
+    """Общий keep-alive HTTP клиент для всех источников"""
+    global http_session
+    if http_session is None:
+        http_session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=len(UPSTREAM_SOURCES) * 2)
+        http_session.mount("http://", adapter)
+        http_session.mount("https://", adapter)
+    return http_session
+
+
+@traced("poll_source")
+def poll_source(name):
+    """Один условный запрос к источнику; True если запрос прошёл успешно
+
+    Сервер может ответить 304 по ETag/If-Modified-Since; если заголовков нет, тело
+    сравнивается по хэшу. Ответ обрабатывается заново, только если изменилось тело
+    или контекст источника; при 304 используется последний применённый ответ.
+    ETag и хэш запоминаются только после успешной обработки.
+    """
+    source = UPSTREAM_SOURCES[name]
+    status = source_status[name]
+    headers = {}
+    if status["etag"]:
+        headers["If-None-Match"] = status["etag"]
+    if status["last_modified"]:
+        headers["If-Modified-Since"] = status["last_modified"]
+
+    started = time.time()
+    status["last_attempt"] = started
+    status["fetches"] += 1
+    try:
+        response = get_http_session().get(f"{EXTERNAL_API_URL}{source['path']}", headers=headers, timeout=5)
+        status["latency_ms"] = round((time.time() - started) * 1000, 1)
+        upstream_latency[name].observe(time.time() - started)
+
+        context = source["context"]() if source["context"] else None
+        etag, last_modified = status["etag"], status["last_modified"]
+        if response.status_code == 304:
+            status["not_modified"] += 1
+            content_hash, payload = status["content_hash"], status["payload"]
+        else:
+            response.raise_for_status()
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            content_hash = hashlib.blake2b(response.content, digest_size=16).digest()
+            if content_hash == status["content_hash"]:
+                status["unchanged"] += 1
+                payload = status["payload"]
+            else:
+                payload = json_loads(response.content)
+
+        if payload is not None and (content_hash, context) != status["applied"]:
+            source["apply"](payload)
+            status["payload"] = payload
+            status["content_hash"] = content_hash
+            status["applied"] = (content_hash, context)
+            status["last_change"] = time.time()
+        status["etag"], status["last_modified"] = etag, last_modified
+        status["last_success"] = time.time()
+        return True
 
     except requests.exceptions.RequestException as e:
-        print(f"Error fetching external ATC data: {e}")
-    except json.JSONDecodeError as e:
-        print(f"Error parsing external ATC data: {e}")
+        print(f"Error fetching external {name} data: {e}")
+        status["last_error"] = str(e)
+    except ValueError as e:
+        print(f"Error parsing external {name} data: {e}")
+        status["last_error"] = str(e)
     except Exception as e:
-        print(f"Unexpected error in fetch_external_atc_data: {e}")
-        import traceback
-        traceback.print_exc()
+        print(f"Error applying external {name} data: {e}")
+        status["last_error"] = str(e)
+    status["errors"] += 1
+    return False
+
+
+def fetch_external_atc_data():
+    """Получение обычных ATC данных из внешнего API (GET запрос)"""
+    return poll_source("atc")
 
 
 def fetch_external_atis_data():
     """Получение обычных ATIS данных из внешнего API (GET запрос)"""
+    return poll_source("atis")
+
+
+def next_poll_delay(name, success):
+    """Задержка до следующего опроса: интервал с джиттером, при ошибках -
+    экспоненциальный backoff; после UPSTREAM_BREAKER_THRESHOLD ошибок подряд
+    размыкатель открывается на UPSTREAM_BREAKER_COOLDOWN секунд.
+    """
+    status = source_status[name]
+    interval = UPSTREAM_SOURCES[name]["interval"]
+    jitter = random.uniform(1 - UPSTREAM_JITTER, 1 + UPSTREAM_JITTER)
+
+    if success:
+        if status["state"] != "closed":
+            print(f"Upstream {name}: circuit closed")
+        status["failures"] = 0
+        status["state"] = "closed"
+        return interval * jitter
+
+    status["failures"] += 1
+    if status["state"] == "half_open" or status["failures"] >= UPSTREAM_BREAKER_THRESHOLD:
+        status["state"] = "open"
+        status["open_until"] = time.time() + UPSTREAM_BREAKER_COOLDOWN
+        print(f"Upstream {name}: circuit open for {UPSTREAM_BREAKER_COOLDOWN}s")
+        return UPSTREAM_BREAKER_COOLDOWN * jitter
+
+    backoff = min(interval * (2 ** status["failures"]), UPSTREAM_MAX_BACKOFF)
+    return backoff * jitter
+
+
+async def poll_source_loop(name):
+    """Независимый цикл опроса одного источника"""
+    loop = asyncio.get_running_loop()
+    status = source_status[name]
+    while True:
+        if status["state"] == "open":
+            # Пробный запрос после остывания размыкателя
+            status["state"] = "half_open"
+        success = await loop.run_in_executor(None, poll_source, name)
+        await asyncio.sleep(next_poll_delay(name, success))
+
+
+async def poll_upstream():
+    await asyncio.gather(*(poll_source_loop(name) for name in UPSTREAM_SOURCES))
+
+
+def get_source_status():
+    """Задержка, свежесть и состояние размыкателя по каждому источнику"""
+    now = time.time()
+    result = {}
+    for name, status in source_status.items():
+        last_success = status["last_success"]
+        result[name] = {
+            "state": status["state"],
+            "interval": UPSTREAM_SOURCES[name]["interval"],
+            "latency_ms": status["latency_ms"],
+            "staleness_s": round(now - last_success, 1) if last_success else None,
+            "last_change_s": round(now - status["last_change"], 1) if status["last_change"] else None,
+            "consecutive_failures": status["failures"],
+            "fetches": status["fetches"],
+            "errors": status["errors"],
+            "not_modified": status["not_modified"],
+            "unchanged": status["unchanged"],
+            "last_error": status["last_error"],
+        }
+    return result
+
+
+def run_updater():
+    """Обновление внешних данных"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(poll_upstream())
+
+
+def bump_version(name):
+    """Отметка изменения хранилища - кэшированный снимок станет неактуальным"""
+    store_versions[name] += 1
+
+
+def mark_flight_changed(callsign, event=False):
+    """Запись изменения рейса в журнал и увеличение версии хранилища
+
+    Запись попадает в журнал до увеличения версии, поэтому читатель может получить
+    изменение повторно, но никогда не пропустит его.
+    """
+    name = "edsr" if event else "dsr"
+    log = change_logs[name]
+    if len(log) == log.maxlen:
+        change_log_floor[name] = log[0][0]
+    log.append((store_versions[name] + 1, callsign))
+    dirty_flights[name].add(callsign)
+    bump_version(name)
+
+
+def get_flight_delta(name, since, version=None):
+    """Изменённые и удалённые рейсы после версии since (до версии version)
+
+    Если журнал уже не содержит всех изменений после since, отдаём полный снимок.
+    """
+    state = published_state
+    if version is None:
+        version = state["versions"].get(name, 0)
+    store = state[name]
+
+    if since < change_log_floor[name] or since > version:
+        return {"version": version, "boot": BOOT_ID, "full": True, "upserts": dict(store), "removed": []}
+
+    changed = set()
+    # list(deque) копируется атомарно под GIL; записи новее снимка пропускаем
+    for entry_version, callsign in reversed(list(change_logs[name])):
+        if entry_version > version:
+            continue
+        if entry_version <= since:
+            break
+        changed.add(callsign)
+
+    upserts = {}
+    removed = []
+    for callsign in changed:
+        data = store.get(callsign)
+        if data is None:
+            removed.append(callsign)
+        else:
+            upserts[callsign] = data
+
+    return {"version": version, "boot": BOOT_ID, "full": False, "upserts": upserts, "removed": removed}
+
+
+def full_delta_entry(name):
+    """Полный снимок в формате дельты из байтов кэша снимков, один раз на версию
+
+    Первый опрос клиента (since=0) и устаревший since получают его с ETag и
+    предсжатием, без обхода журнала и повторной сериализации всех рейсов.
+    """
+    entry = get_snapshot(name)
+    etag = f"{entry['etag']}-full"
+    cached = snapshot_cache.get(f"{name}_full")
+    if cached is not None and cached["etag"] == etag:
+        cache_stats["snapshot_hit"] += 1
+        return cached
+
+    boot = (get_shared_reader().boot or BOOT_ID) if serves_shared_snapshot() else BOOT_ID
+    cached = {
+        "version": entry["version"],
+        "etag": etag,
+        "identity": b"".join((
+            b'{"version":%d,"boot":"%s","full":true,"upserts":' % (entry["version"], boot.encode()),
+            entry["identity"],
+            b',"removed":[]}',
+        )),
+    }
+    snapshot_cache[f"{name}_full"] = cached
+    return cached
+
+
+def delta_response(name):
+    """Ответ дельта-эндпоинта: ?since=<version>[&boot=<id>]"""
+    try:
+        since = int(request.args.get("since", 0))
+    except ValueError:
+        return json.dumps({"error": "Invalid since"}), 400, {'Content-Type': 'application/json'}
+
+    # Worker сверяет boot с ingestor, а не со своим BOOT_ID
+    if serves_shared_snapshot():
+        delta = get_shared_reader().get_delta(name, since)
+        if delta is None:
+            return entry_response(full_delta_entry(name))
+        return body_response(delta, "application/json")
+
+    # После перезапуска сервера версии начинаются заново - отдаём полный снимок
+    boot = request.args.get("boot")
+    version = published_state["versions"].get(name, 0)
+    if (boot and boot != BOOT_ID) or since <= 0 or since < change_log_floor[name] or since > version:
+        return entry_response(full_delta_entry(name))
+
+    delta = get_flight_delta(name, since, version)
+    with Span(f"serialize:{name}_delta"):
+        body = json_dumps(delta)
+    return body, 200, {'Content-Type': 'application/json'}
+
+
+def track_response(callsign, event=False):
+    """Ответ трека рейса: ?tolerance=<единицы карты>&max_points=<N>"""
     try:
-        url = f"{EXTERNAL_API_URL}/atis"
-        response = requests.get(url, timeout=5)
-        response.raise_for_status()
-        atis_data = response.json()
+        tolerance = float(request.args.get("tolerance", 0))
+        max_points = int(request.args.get("max_points", 0))
+    except ValueError:
+        return json.dumps({"error": "Invalid tolerance or max_points"}), 400, {'Content-Type': 'application/json'}
+
+    points = get_track_points(callsign, event=event)
+    if points is None:
+        return json.dumps({"error": "Track not found"}), 404, {'Content-Type': 'application/json'}
+
+    points = simplify_track(points, tolerance)
+    if max_points >= 2 and len(points) > max_points:
+        step = (len(points) - 1) / (max_points - 1)
+        points = [points[round(i * step)] for i in range(max_points)]
+
+    payload = {"callsign": callsign, "fields": ["t", "x", "y", "altitude", "heading"], "points": points}
+    with Span("serialize:track"):
+        body = json_dumps(payload)
+    return body, 200, {'Content-Type': 'application/json'}
+
+
+def airport_history_response(event=False):
+    """Ответ истории аэропортов: ?resolution=1m|5m|1h[&airport=ICAO,ICAO]"""
+    resolution = request.args.get("resolution", "1m")
+    if resolution not in HISTORY_RESOLUTIONS:
+        return json.dumps({"error": "Invalid resolution"}), 400, {'Content-Type': 'application/json'}
+
+    histories = published_state["eairport_history" if event else "airport_history"]
+    airports = request.args.get("airport")
+    icaos = [icao.strip().upper() for icao in airports.split(",")] if airports else list(histories)
+
+    now = time.time()
+    start = None
+    series = {}
+    for icao in icaos:
+        history = histories.get(icao)
+        if history is None:
+            continue
+        start, series[icao] = history_series(history, resolution, now)
+
+    step = HISTORY_RESOLUTIONS[resolution][0]
+    if start is None:
+        start = int(now // step) * step - (HISTORY_RESOLUTIONS[resolution][1] - 1) * step
+
+    payload = {"resolution": resolution, "step": step, "start": start, "airports": series}
+    with Span("serialize:airport_history"):
+        body = json_dumps(payload)
+    return body, 200, {'Content-Type': 'application/json'}
+
+
+FLIGHT_FILTERS = ("airport", "role", "live", "state", "aircraft", "fields")
+EMPTY_SET = frozenset()
+QUERY_CACHE_SIZE = 256
+
+# Отфильтрованные ответы (LRU): (store, version, фильтры) -> запись кэша как в snapshot_cache
+query_cache = OrderedDict()
+query_lock = threading.Lock()
+worker_indexes = {}
+worker_positions = None
+
+
+def flight_index_keys(flight):
+    """Ключи индекса рейса: dep:<ICAO>, arr:<ICAO>, state:<n>, aircraft:<тип>, live, unknown
+
+    Живые ВС с координатами попадают ещё и в ячейку равномерной сетки cell:<cx>:<cy>.
+    """
+    if flight is None:
+        return ()
+    keys = [f"state:{flight.get('state')}"]
+    if (flight.get("departure") or "ZZZZ") == "ZZZZ" or (flight.get("arrival") or "ZZZZ") == "ZZZZ":
+        # На странице такие рейсы показываются отдельным блоком UNKNOWN
+        keys.append("unknown")
+    if flight.get("departure"):
+        keys.append(f"dep:{flight['departure']}")
+    if flight.get("arrival"):
+        keys.append(f"arr:{flight['arrival']}")
+    if flight.get("aircraft"):
+        keys.append(f"aircraft:{flight['aircraft']}")
+    if flight.get("live"):
+        keys.append("live")
+        x, y = flight.get("pos_x"), flight.get("pos_y")
+        if isinstance(x, (int, float)) and isinstance(y, (int, float)):
+            cx, cy = grid_cell(x, y)
+            keys.append(f"cell:{cx}:{cy}")
+    return keys
+
+
+def collect_index_changes(changes, callsign, old, new):
+    """Накопление изменений индекса: ключ -> (добавить, убрать)"""
+    old_keys = flight_index_keys(old)
+    new_keys = flight_index_keys(new)
+    if old_keys == new_keys:
+        return
+    for key in set(old_keys).difference(new_keys):
+        changes.setdefault(key, (set(), set()))[1].add(callsign)
+    for key in set(new_keys).difference(old_keys):
+        changes.setdefault(key, (set(), set()))[0].add(callsign)
+
+
+def apply_index_changes(previous, changes):
+    """Новая версия индекса: копируются только изменившиеся множества"""
+    if not changes:
+        return previous
+    index = dict(previous)
+    for key, (added, removed) in changes.items():
+        callsigns = (index.get(key, EMPTY_SET) - removed) | added
+        if callsigns:
+            index[key] = frozenset(callsigns)
+        else:
+            index.pop(key, None)
+    return index
+
+
+def build_flight_index(flights):
+    changes = {}
+    for callsign, flight in flights.items():
+        collect_index_changes(changes, callsign, None, flight)
+    return apply_index_changes({}, changes)
+
+
+def get_flight_query_state(name):
+    """(версия, рейсы, индекс) для фильтрации
+
+    Worker не имеет своего состояния: снимок ingestor разбирается и индексируется
+    один раз на версию.
+    """
+    if not serves_shared_snapshot():
+        state = published_state
+        return state["versions"].get(name, 0), state[name], state[f"{name}_index"]
+
+    entry = get_snapshot(name)
+    cached = worker_indexes.get(name)
+    if cached is None or cached[0] != entry["version"]:
+        flights = json_loads(bytes(entry["identity"]))
+        cached = worker_indexes[name] = (entry["version"], flights, build_flight_index(flights))
+    return cached
+
+
+def parse_flight_filters(args):
+    """Нормализованные фильтры запроса; ValueError при неверных значениях"""
+    filters = {}
+    airport = args.get("airport", "").strip().upper()
+    if airport:
+        filters["airport"] = airport
+    role = args.get("role", "").strip().lower()
+    if role:
+        if role not in ("dep", "arr"):
+            raise ValueError("role must be dep or arr")
+        if not airport:
+            raise ValueError("role requires airport")
+        filters["role"] = role
+    if args.get("live", "").strip().lower() in ("1", "true", "yes"):
+        filters["live"] = True
+    if args.get("state"):
+        filters["state"] = tuple(sorted({int(value) for value in args["state"].split(",") if value.strip()}))
+    if args.get("aircraft"):
+        filters["aircraft"] = tuple(sorted({value.strip().upper() for value in args["aircraft"].split(",") if value.strip()}))
+    if args.get("fields"):
+        filters["fields"] = tuple(field.strip() for field in args["fields"].split(",") if field.strip())
+    return filters
+
+
+def query_flights(flights, index, filters, within=None):
+    """Рейсы по фильтрам: пересечение множеств индекса, начиная с самого маленького
+
+    within - дополнительное ограничение множеством позывных (пространственный запрос).
+    """
+    sets = [] if within is None else [within]
+    airport = filters.get("airport")
+    if airport:
+        role = filters.get("role")
+        if role:
+            sets.append(index.get(f"{role}:{airport}", EMPTY_SET))
+        else:
+            sets.append(index.get(f"dep:{airport}", EMPTY_SET) | index.get(f"arr:{airport}", EMPTY_SET))
+    if filters.get("live"):
+        sets.append(index.get("live", EMPTY_SET))
+    if "state" in filters:
+        sets.append(EMPTY_SET.union(*(index.get(f"state:{value}", EMPTY_SET) for value in filters["state"])))
+    if "aircraft" in filters:
+        sets.append(EMPTY_SET.union(*(index.get(f"aircraft:{value}", EMPTY_SET) for value in filters["aircraft"])))
+
+    if sets:
+        sets = sorted(sets, key=len)
+        callsigns = sets[0].intersection(*sets[1:])
+    else:
+        callsigns = flights.keys()
 
-        global atis
-        atis = {item["airport"]: item for item in atis_data if "airport" in item}
-        print(f"External ATIS data updated: {len(atis)} airports")
+    fields = filters.get("fields")
+    result = {}
+    for callsign in callsigns:
+        flight = flights.get(callsign)
+        if flight is None:
+            continue
+        result[callsign] = {field: flight[field] for field in fields if field in flight} if fields else flight
+    return result
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching external ATIS data: {e}")
-    except json.JSONDecodeError as e:
-        print(f"Error parsing external ATIS data: {e}")
-    except Exception as e:
-        print(f"Unexpected error in fetch_external_atis_data: {e}")
-        import traceback
-        traceback.print_exc()
 
+def filtered_response(name):
+    """Ответ с фильтрами ?airport=&role=dep|arr&live=1&state=&aircraft=&fields=
 
-def run_updater():
-    """Обновление внешних данных"""
-    atc_counter = 0
-    atis_counter = 0
+    Результат кэшируется на версию хранилища, поэтому одинаковые запросы киосков
+    сериализуются один раз и получают 304 по ETag.
+    """
+    try:
+        filters = parse_flight_filters(request.args)
+    except ValueError as e:
+        return json.dumps({"error": f"Invalid filter: {e}"}), 400, {'Content-Type': 'application/json'}
+
+    version, flights, index = get_flight_query_state(name)
+    key = (name, version, tuple(sorted(filters.items())))
+    entry = query_cache.get(key)
+    if entry is None:
+        cache_stats["query_miss"] += 1
+        with Span(f"serialize:{name}_query"):
+            body = json_dumps(query_flights(flights, index, filters))
+        digest = hashlib.blake2b(repr(key[2]).encode(), digest_size=6).hexdigest()
+        entry = {"version": version, "etag": f"{BOOT_ID}-{name}-{version}-{digest}", "identity": body}
+        with query_lock:
+            query_cache[key] = entry
+            while len(query_cache) > QUERY_CACHE_SIZE:
+                query_cache.popitem(last=False)
+    else:
+        cache_stats["query_hit"] += 1
+        with query_lock:
+            if key in query_cache:
+                query_cache.move_to_end(key)
+    return entry_response(entry)
 
-    while True:
-        # Обновляем ATC каждые ATC_UPDATE_INTERVAL секунд
-        if atc_counter % ATC_UPDATE_INTERVAL == 0:
-            fetch_external_atc_data()
 
-        # Обновляем ATIS каждые ATIS_UPDATE_INTERVAL секунд
-        if atis_counter % ATIS_UPDATE_INTERVAL == 0:
-            fetch_external_atis_data()
+def grid_cell(x, y):
+    """Ячейка равномерной сетки SPATIAL_CELL_SIZE для координат карты"""
+    return int(x // SPATIAL_CELL_SIZE), int(y // SPATIAL_CELL_SIZE)
 
-        atc_counter += 1
-        atis_counter += 1
-        time.sleep(1)
+
+def flights_in_box(flights, index, min_x, min_y, max_x, max_y):
+    """{callsign: (x, y)} живых ВС в прямоугольнике: ячейки сетки, затем точная проверка"""
+    min_cx, min_cy = grid_cell(min_x, min_y)
+    max_cx, max_cy = grid_cell(max_x, max_y)
+    if (max_cx - min_cx + 1) * (max_cy - min_cy + 1) > len(index):
+        # Окно больше всей занятой сетки - дешевле пройти по занятым ячейкам
+        cells = [callsigns for key, callsigns in index.items() if key.startswith("cell:")]
+    else:
+        cells = [index.get(f"cell:{cx}:{cy}", EMPTY_SET)
+                 for cx in range(min_cx, max_cx + 1) for cy in range(min_cy, max_cy + 1)]
+
+    found = {}
+    for callsigns in cells:
+        for callsign in callsigns:
+            flight = flights.get(callsign)
+            if flight is None:
+                continue
+            x, y = flight["pos_x"], flight["pos_y"]
+            if min_x <= x <= max_x and min_y <= y <= max_y:
+                found[callsign] = (x, y)
+    return found
+
+
+def get_airport_positions():
+    """Опубликованная таблица координат аэропортов (worker - из разделяемого снимка)"""
+    global worker_positions
+    if not serves_shared_snapshot():
+        return published_state["airport_positions"]
+    entry = get_snapshot("airport_positions")
+    if worker_positions is None or worker_positions[0] != entry["version"]:
+        worker_positions = (entry["version"], json_loads(bytes(entry["identity"])))
+    return worker_positions[1]
+
+
+def nearest_airport(x, y, table):
+    """Ближайший к точке аэропорт (аэропортов несколько десятков - полный перебор)"""
+    best = None
+    best_distance = None
+    for icao, info in table.items():
+        distance = (info["x"] - x) ** 2 + (info["y"] - y) ** 2
+        if best_distance is None or distance < best_distance:
+            best, best_distance = icao, distance
+    return best
+
+
+def parse_number(value):
+    """Конечное число: inf/nan и переполнение (1e400) - ValueError"""
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"{value!r} is not a finite number")
+    return number
+
+
+def parse_coordinates(value, count):
+    """Список из count чисел через запятую"""
+    values = [parse_number(item) for item in value.split(",")]
+    if len(values) != count:
+        raise ValueError(f"expected {count} comma-separated numbers")
+    return values
+
+
+def spatial_response(name, mode):
+    """Живые ВС в окне карты (?bbox=min_x,min_y,max_x,max_y) или в радиусе (?x=&y=&radius=&limit=)
+
+    Поддерживаются те же фильтры, что у /dsr. К каждому ВС добавляются
+    nearest_airport и fir, в радиусном запросе ещё distance (результат по возрастанию).
+    """
+    args = request.args
+    try:
+        filters = parse_flight_filters(args)
+        if mode == "bbox":
+            min_x, min_y, max_x, max_y = parse_coordinates(args.get("bbox", ""), 4)
+            min_x, max_x = sorted((min_x, max_x))
+            min_y, max_y = sorted((min_y, max_y))
+        else:
+            x, y, radius = parse_number(args["x"]), parse_number(args["y"]), parse_number(args["radius"])
+            if radius <= 0:
+                raise ValueError("radius must be positive")
+            limit = int(args["limit"]) if "limit" in args else None
+            if limit is not None and limit <= 0:
+                raise ValueError("limit must be positive")
+            min_x, min_y, max_x, max_y = x - radius, y - radius, x + radius, y + radius
+            if not all(map(math.isfinite, (min_x, min_y, max_x, max_y))):
+                raise ValueError("radius is too large")
+    except (KeyError, ValueError) as e:
+        return json.dumps({"error": f"Invalid query: {e}"}), 400, {'Content-Type': 'application/json'}
+
+    _, flights, index = get_flight_query_state(name)
+    with Span(f"spatial:{name}"):
+        found = flights_in_box(flights, index, min_x, min_y, max_x, max_y)
+        order = None
+        if mode == "radius":
+            distances = {callsign: ((px - x) ** 2 + (py - y) ** 2) ** 0.5 for callsign, (px, py) in found.items()}
+            found = {callsign: found[callsign] for callsign, distance in distances.items() if distance <= radius}
+
+        matches = query_flights(flights, index, filters, within=frozenset(found))
+        if mode == "radius":
+            order = sorted(matches, key=distances.get)[:limit]
+
+        table = get_airport_positions()
+        result = {}
+        for callsign in order if order is not None else matches:
+            icao = nearest_airport(*found[callsign], table) if table else None
+            item = dict(matches[callsign], nearest_airport=icao, fir=table[icao]["fir"] if icao else None)
+            if order is not None:
+                item["distance"] = round(distances[callsign])
+            result[callsign] = item
+        body = json_dumps(result)
+
+    digest = hashlib.blake2b(body, digest_size=8).hexdigest()
+    return entry_response({"version": 0, "etag": f"{name}-{mode}-{digest}", "identity": body})
+
+
+# Табло аэропортов: имя -> (рейсы, ATC, ATIS), из которых оно собирается
+BOARD_SOURCES = {"boards": ("dsr", "atc", "atis"), "eboards": ("edsr", "eatc", "eatis")}
+UNKNOWN_BOARD = "UNKNOWN"
+BOARD_HIDDEN = {"ATC24 Staff Chat"}  # Не аэропорт, страница показывает его отдельно
+BOARD_ATC_POSITIONS = {"CTR", "TWR", "GND"}
+
+board_seq = itertools.count(1)
+board_cache = {}  # (табло, ICAO или None, live) -> запись кэша как в snapshot_cache
+board_lock = threading.Lock()
+atc_groups = {}
+worker_boards = {}
+
+
+def board_airports(flight):
+    """Табло, на которых показывается рейс (как processFlightData на странице)"""
+    if flight is None:
+        return ()
+    departure = flight.get("departure") or "ZZZZ"
+    arrival = flight.get("arrival") or "ZZZZ"
+    if departure == "ZZZZ" or arrival == "ZZZZ":
+        return (UNKNOWN_BOARD,)
+    return (departure, arrival)
+
+
+def get_atc_groups(controllers):
+    """Активные (занятые) позиции ATC по аэропортам, пересчитываются один раз на список"""
+    cached = atc_groups.get(id(controllers))
+    if cached is not None and cached[0] is controllers:
+        return cached[1]
+    grouped = defaultdict(list)
+    for controller in controllers or ():
+        if isinstance(controller, dict) and controller.get("holder"):
+            grouped[controller.get("airport")].append(controller)
+    grouped = dict(grouped)
+    if len(atc_groups) >= 8:
+        atc_groups.clear()
+    atc_groups[id(controllers)] = (controllers, grouped)
+    return grouped
+
+
+def changed_board_airports(previous, current):
+    """Аэропорты, у которых различаются значения в словарях previous и current"""
+    if previous is current:
+        return set()
+    return {icao for icao in previous.keys() | current.keys() if previous.get(icao) != current.get(icao)}
+
+
+def update_board_versions(previous, airports, index, atc_by_airport, atis_by_airport):
+    """Новые версии табло затронутых аэропортов: {ICAO: версия}
+
+    Сами табло здесь не собираются - это делает читатель, один раз на версию
+    аэропорта, поэтому приём кадров не платит за сортировку табло.
+    """
+    versions = dict(previous)
+    for icao in airports:
+        if icao in BOARD_HIDDEN:
+            continue
+        if icao == UNKNOWN_BOARD:
+            active = index.get("unknown")
+        else:
+            active = (index.get(f"dep:{icao}") or index.get(f"arr:{icao}")
+                      or atc_by_airport.get(icao) or atis_by_airport.get(icao))
+        if active:
+            versions[icao] = next(board_seq)
+        else:
+            versions.pop(icao, None)
+    return versions
+
+
+def get_board_state(name):
+    """(версия, {ICAO: версия табло}, (рейсы, индекс, ATC по аэропортам, ATIS))
+
+    Worker собирает то же из разделяемого снимка один раз на версию источников и,
+    как publish_state, меняет версии только аэропортов, чьи источники изменились.
+    """
+    flights_name, atc_name, atis_name = BOARD_SOURCES[name]
+    if not serves_shared_snapshot():
+        state = published_state
+        sources = (state[flights_name], state[f"{flights_name}_index"],
+                   get_atc_groups(state[atc_name]), state[atis_name])
+        return state["versions"].get(name, 0), state[name], sources
+
+    flights_version, flights, index = get_flight_query_state(flights_name)
+    atc_entry = get_snapshot(atc_name)
+    atis_entry = get_snapshot(atis_name)
+    key = (flights_version, atc_entry["version"], atis_entry["version"])
+
+    with board_lock:
+        cached = worker_boards.get(name)
+        if cached is None or cached[0] != key:
+            atc_by_airport = get_atc_groups(json_loads(bytes(atc_entry["identity"])))
+            atis_by_airport = json_loads(bytes(atis_entry["identity"]))
+            if cached is None:
+                previous = {}
+                airports = set(atc_by_airport) | set(atis_by_airport) | {UNKNOWN_BOARD}
+                airports.update(index_key.split(":", 1)[1] for index_key in index
+                                if index_key.startswith(("dep:", "arr:")))
+            else:
+                _, version, previous, (old_flights, _, old_atc, old_atis) = cached
+                airports = set()
+                if flights is not old_flights:
+                    for callsign in old_flights.keys() | flights.keys():
+                        old, new = old_flights.get(callsign), flights.get(callsign)
+                        if old != new:
+                            airports.update(board_airports(old))
+                            airports.update(board_airports(new))
+                airports |= changed_board_airports(old_atc, atc_by_airport)
+                airports |= changed_board_airports(old_atis, atis_by_airport)
+
+            versions = update_board_versions(previous, airports, index, atc_by_airport, atis_by_airport)
+            if cached is None or versions != previous:
+                version = next(board_seq)
+            cached = worker_boards[name] = (key, version, versions,
+                                            (flights, index, atc_by_airport, atis_by_airport))
+        return cached[1], cached[2], cached[3]
+
+
+def board_flights(flights, callsigns, live_only):
+    """Рейсы табло с полем callsign: сначала 7700, затем по позывному"""
+    items = [dict(flights[callsign], callsign=callsign) for callsign in callsigns
+             if callsign in flights and (flights[callsign].get("live") or not live_only)]
+    items.sort(key=lambda flight: (not flight.get("is_emergency"), flight["callsign"]))
+    return items
+
+
+def build_board(icao, sources, live_only):
+    """Табло аэропорта в формате страницы (live_only - только live рейсы, как showLiveOnly)"""
+    flights, index, atc_by_airport, atis_by_airport = sources
+    unknown = index.get("unknown", EMPTY_SET)
+    if icao == UNKNOWN_BOARD:
+        board = {"icao": icao, "flights": board_flights(flights, unknown, live_only)}
+        board["emergency"] = any(flight.get("is_emergency") for flight in board["flights"])
+        return board
+
+    board = {
+        "icao": icao,
+        "departures": board_flights(flights, index.get(f"dep:{icao}", EMPTY_SET) - unknown, live_only),
+        "arrivals": board_flights(flights, index.get(f"arr:{icao}", EMPTY_SET) - unknown, live_only),
+        "atc": atc_by_airport.get(icao, []),
+        "atis": atis_by_airport.get(icao),
+    }
+    board["emergency"] = any(flight.get("is_emergency") for flight in board["departures"] + board["arrivals"])
+    return board
+
+
+def board_visible(board):
+    """Правило shouldDisplayAirport страницы: есть рейсы или занят CTR/TWR/GND"""
+    if "flights" in board:
+        return bool(board["flights"])
+    if board["departures"] or board["arrivals"]:
+        return True
+    return any(controller.get("position") in BOARD_ATC_POSITIONS for controller in board["atc"])
+
+
+def board_entry(name, icao, version, sources, live_only):
+    """Сериализованное табло аэропорта, собирается только при смене его версии"""
+    key = (name, icao, live_only)
+    entry = board_cache.get(key)
+    if entry is not None and entry["version"] == version:
+        cache_stats["board_hit"] += 1
+        return entry
+
+    with board_lock:
+        entry = board_cache.get(key)
+        if entry is not None and entry["version"] == version:
+            cache_stats["board_hit"] += 1
+            return entry
+
+        cache_stats["board_miss"] += 1
+        with Span(f"serialize:{name}"):
+            board = build_board(icao, sources, live_only)
+            body = json_dumps(board)
+        # ETag по содержимому: одинаков у всех worker и не меняется, если табло пересобрано без изменений
+        digest = hashlib.blake2b(body, digest_size=8).hexdigest()
+        entry = {"version": version, "etag": f"{name}-{icao}-{digest}", "identity": body,
+                 "visible": board_visible(board)}
+        board_cache[key] = entry
+        return entry
+
+
+def boards_entry(name, live_only):
+    """Все видимые табло одним объектом: склейка закэшированных тел аэропортов"""
+    version, versions, sources = get_board_state(name)
+    key = (name, None, live_only)
+    entry = board_cache.get(key)
+    if entry is not None and entry["version"] == version:
+        cache_stats["board_hit"] += 1
+        return entry
+
+    parts = []
+    # Аэропорты по алфавиту, UNKNOWN последним
+    for icao in sorted(versions, key=lambda icao: (icao == UNKNOWN_BOARD, icao)):
+        airport_entry = board_entry(name, icao, versions[icao], sources, live_only)
+        if airport_entry["visible"]:
+            parts.append(json_dumps(icao) + b":" + airport_entry["identity"])
+    body = b"{" + b",".join(parts) + b"}"
+    digest = hashlib.blake2b(body, digest_size=8).hexdigest()
+    entry = {"version": version, "etag": f"{name}-{digest}", "identity": body}
+    board_cache[key] = entry
+    return entry
+
+
+def boards_response(name, icao=None):
+    """Ответ /boards или /boards/<ICAO> (?live=1 - только live рейсы)"""
+    live_only = request.args.get("live", "").strip().lower() in ("1", "true", "yes")
+    if icao is None:
+        return entry_response(boards_entry(name, live_only))
+
+    icao = icao.strip().upper()
+    version, versions, sources = get_board_state(name)
+    if icao not in versions and icao not in AIRPORTS and icao != UNKNOWN_BOARD:
+        return json.dumps({"error": f"Unknown airport {icao}"}), 404, {'Content-Type': 'application/json'}
+    return entry_response(board_entry(name, icao, versions.get(icao, 0), sources, live_only))
+
+
+def publish_state():
+    """Публикация следующего снимка состояния для читателей
+
+    Копируются только записи рейсов, изменённые с прошлой публикации; остальные
+    записи переиспользуются из предыдущего снимка. Вызывается под write_lock.
+    """
+    global published_state
+    previous = published_state
+    state = dict(previous)
+    board_dirty = {}
+
+    for name in ("dsr", "edsr"):
+        dirty = dirty_flights[name]
+        if not dirty:
+            continue
+
+        store = edsr if name == "edsr" else dsr
+        flights = dict(previous[name])
+        index_changes = {}
+        airports = board_dirty[name] = set()
+
+        for callsign in dirty:
+            record = store.get(callsign)
+            old = flights.get(callsign)
+            if record is None:
+                flights.pop(callsign, None)
+                new = None
+            else:
+                new = flights[callsign] = record.to_dict()
+            collect_index_changes(index_changes, callsign, old, new)
+            airports.update(board_airports(old))
+            airports.update(board_airports(new))
+
+        dirty.clear()
+        state[name] = flights
+        state[f"{name}_index"] = apply_index_changes(previous[f"{name}_index"], index_changes)
+
+    now = time.time()
+    for name in ("airport_stats", "eairport_stats"):
+        if dirty_airport_stats[name]:
+            state[name] = summarize_airport_stats(previous[name], name, now)
+
+    for name, history_name in (("dsr", "airport_history"), ("edsr", "eairport_history")):
+        if dirty_airport_history[name]:
+            views = dict(previous[history_name])
+            for icao in dirty_airport_history[name]:
+                views[icao] = airport_history[name][icao].view()
+            dirty_airport_history[name].clear()
+            state[history_name] = views
+
+    state["atc"] = atc
+    state["eatc"] = eatc
+    state["atis"] = atis
+    state["eatis"] = eatis
+    state["airport_positions"] = airport_position_table
+
+    for name, (flights_name, atc_name, atis_name) in BOARD_SOURCES.items():
+        airports = board_dirty.get(flights_name, set())
+        atc_by_airport = get_atc_groups(state[atc_name])
+        if state[atc_name] is not previous[atc_name]:
+            airports |= changed_board_airports(get_atc_groups(previous[atc_name]), atc_by_airport)
+        airports |= changed_board_airports(previous[atis_name], state[atis_name])
+        if not airports:
+            continue
+        state[name] = update_board_versions(previous[name], airports, state[f"{flights_name}_index"],
+                                            atc_by_airport, state[atis_name])
+        bump_version(name)
+
+    state["versions"] = dict(store_versions)
+    published_state = state
+
+
+def get_store(name):
+    """Опубликованное содержимое хранилища по имени"""
+    return published_state[name]
+
+
+def get_snapshot(name):
+    """Сериализованный снимок хранилища, пересобирается не чаще одного раза на версию"""
+    if serves_shared_snapshot():
+        return get_shared_reader().get(name)
+
+    state = published_state
+    version = state["versions"].get(name, 0)
+    entry = snapshot_cache.get(name)
+    if entry is not None and entry["version"] == version:
+        cache_stats["snapshot_hit"] += 1
+        return entry
+
+    with snapshot_lock:
+        entry = snapshot_cache.get(name)
+        if entry is not None and entry["version"] == version:
+            cache_stats["snapshot_hit"] += 1
+            return entry
+
+        cache_stats["snapshot_miss"] += 1
+        with Span(f"serialize:{name}"):
+            body = json_dumps(state[name])
+        entry = {
+            "version": version,
+            "etag": f"{BOOT_ID}-{name}-{version}",
+            "identity": body,
+        }
+        snapshot_cache[name] = entry
+        return entry
+
+
+def get_encoded_body(entry, encoding):
+    """Сжатое тело снимка (сжимается один раз на версию и кодировку)"""
+    body = entry.get(encoding)
+    if body is not None:
+        cache_stats["compressed_hit"] += 1
+    else:
+        cache_stats["compressed_miss"] += 1
+        with Span(f"compress:{encoding}"):
+            if encoding == "br":
+                body = brotli.compress(entry["identity"], quality=5)
+            else:
+                body = gzip.compress(entry["identity"], compresslevel=6)
+        entry[encoding] = body
+    return body
+
+
+def choose_encoding(size):
+    """Выбор кодировки ответа по Accept-Encoding клиента"""
+    if size < COMPRESS_MIN_SIZE:
+        return "identity"
+    offered = ["br", "gzip"] if brotli is not None else ["gzip"]
+    for encoding in offered:
+        if request.accept_encodings[encoding]:
+            return encoding
+    return "identity"
+
+
+def body_response(body, content_type):
+    """Ответ 200 из bytes или memoryview (memoryview из разделяемого снимка отдаётся без копии)"""
+    if isinstance(body, memoryview):
+        response = Response([body], status=200, content_type=content_type)
+        response.content_length = len(body)
+        return response
+    return Response(body, status=200, content_type=content_type)
+
+
+def snapshot_response(name):
+    """Ответ из кэша снимков с поддержкой ETag/If-None-Match и предсжатия"""
+    return entry_response(get_snapshot(name))
+
+
+def entry_response(entry):
+    """Ответ по записи кэша {"version", "etag", "identity", <кодировка>...}"""
+    if request.if_none_match.contains_weak(entry["etag"]):
+        cache_stats["not_modified"] += 1
+        response = Response(status=304)
+    else:
+        encoding = choose_encoding(len(entry["identity"]))
+        body = entry["identity"] if encoding == "identity" else get_encoded_body(entry, encoding)
+        response = body_response(body, "application/json")
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+
+    response.set_etag(entry["etag"], weak=True)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+
+class StreamSubscriber:
+    """Подписчик push-канала с ограниченным буфером
+
+    Если клиент не успевает забирать сообщения и буфер переполняется, накопленное
+    выбрасывается и клиент получает полный актуальный снимок вместо истории.
+    """
+
+    def __init__(self, channel, notify=None):
+        self.channel = channel
+        self.notify = notify
+        self.messages = deque()
+        self.resync = True
+        self.condition = threading.Condition()
+
+    def push(self, topic, payload):
+        with self.condition:
+            if len(self.messages) >= STREAM_BUFFER_SIZE:
+                self.messages.clear()
+                self.resync = True
+                stream_stats["resyncs"] += 1
+            elif not self.resync:
+                self.messages.append((topic, payload))
+            self.condition.notify()
+        if self.notify:
+            self.notify()
+
+    def drain(self, timeout=None):
+        """Забрать накопленные сообщения (с ожиданием до timeout секунд)"""
+        with self.condition:
+            if timeout and not self.resync and not self.messages:
+                self.condition.wait(timeout)
+            resync = self.resync
+            self.resync = False
+            messages = list(self.messages)
+            self.messages.clear()
+
+        if resync:
+            return build_stream_resync(self.channel)
+        return messages
+
+
+def subscribe_stream(channel, notify=None):
+    subscriber = StreamSubscriber(channel, notify)
+    with stream_lock:
+        stream_subscribers[channel].add(subscriber)
+    return subscriber
+
+
+def unsubscribe_stream(subscriber):
+    with stream_lock:
+        stream_subscribers[subscriber.channel].discard(subscriber)
+
+
+def build_stream_resync(channel):
+    """Полные сообщения по всем топикам канала из кэша снимков"""
+    messages = []
+    for topic, name in STREAM_TOPICS[channel].items():
+        entry = get_snapshot(name)
+        if topic == "flights":
+            payload = (b'{"version": %d, "boot": "%s", "full": true, "upserts": ' % (entry["version"], BOOT_ID.encode())
+                       + entry["identity"] + b', "removed": []}')
+        else:
+            payload = b'{"version": %d, "data": ' % entry["version"] + entry["identity"] + b'}'
+        messages.append((topic, payload))
+    return messages
+
+
+def broadcast_stream_updates(last_versions):
+    """Рассылка изменений с прошлого тика: одно сообщение на топик, сериализуется один раз"""
+    for channel, topics in STREAM_TOPICS.items():
+        with stream_lock:
+            subscribers = list(stream_subscribers[channel])
+
+        for topic, name in topics.items():
+            version = published_state["versions"].get(name, 0)
+            last_version = last_versions.get(name)
+            if last_version == version:
+                continue
+            last_versions[name] = version
+            if not subscribers or last_version is None:
+                continue
+
+            if topic == "flights":
+                delta = get_flight_delta(name, last_version)
+                with Span(f"serialize:stream_{name}"):
+                    payload = json_dumps(delta)
+            else:
+                entry = get_snapshot(name)
+                payload = b'{"version": %d, "data": ' % entry["version"] + entry["identity"] + b'}'
+
+            for subscriber in subscribers:
+                subscriber.push(topic, payload)
+            stream_stats["messages"] += 1
+
+
+def format_sse(topic, payload):
+    return b"event: " + topic.encode() + b"\ndata: " + payload + b"\n\n"
+
+
+def serves_shared_snapshot():
+    """Процесс отдаёт чужие снимки: worker или реплика кластера"""
+    return SERVE_MODE == "worker" or cluster_role == "follower"
+
+
+def ingestor_only(func):
+    """Эндпоинты, которым нужно живое состояние процесса: в worker и на репликах отвечают 503"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if serves_shared_snapshot():
+            return jsonify({"error": "Not available on worker processes, use the ingestor"}), 503
+        return func(*args, **kwargs)
+    return wrapper
 
 
 def check_auth():
@@ -750,12 +3120,112 @@ def check_auth():
     return False
 
 
+def check_admin_auth():
+    """Проверка авторизации admin эндпоинтов: отдельный ADMIN_TOKEN, сравнение за постоянное время"""
+    auth_header = request.headers.get('Authorization', '')
+    if not ADMIN_TOKEN or not auth_header.startswith('Bearer '):
+        return False
+    return hmac.compare_digest(auth_header[len('Bearer '):].encode(), ADMIN_TOKEN.encode())
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    """Латентность и размер ответа по шаблону маршрута (без стриминговых ответов)"""
+    started = g.get("request_started")
+    if started is not None and response.mimetype != "text/event-stream":
+        endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        request_latency[endpoint].observe(time.perf_counter() - started)
+        response_bytes[endpoint] += response.content_length or 0
+    return response
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ICON_FILES = {name for name in os.listdir(BASE_DIR) if name.endswith(".png")}
+ICON_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Страницы и иконки в памяти: {"mtime", "etag", "identity", <кодировка>: сжатое тело}
+page_cache = {}
+icon_cache = {}
+static_lock = threading.Lock()
+
+
+def get_icon_version():
+    """Версия набора иконок (хэш содержимого) - часть URL, поэтому иконки кэшируются навсегда"""
+    entry = icon_cache.get("__version__")
+    if entry is None:
+        digest = hashlib.blake2b(digest_size=6)
+        for name in sorted(ICON_FILES):
+            digest.update(name.encode())
+            digest.update(get_icon(name)["identity"])
+        entry = icon_cache["__version__"] = digest.hexdigest()
+    return entry
+
+
+def get_icon(name):
+    entry = icon_cache.get(name)
+    if entry is None:
+        with open(os.path.join(BASE_DIR, name), "rb") as file:
+            body = file.read()
+        entry = icon_cache[name] = {"identity": body, "etag": hashlib.blake2b(body, digest_size=8).hexdigest()}
+    return entry
+
+
+def get_page(filename):
+    """Страница из кэша; файл перечитывается, только если изменился на диске"""
+    path = os.path.join(BASE_DIR, filename)
+    stat = os.stat(path)
+    mtime = (stat.st_mtime_ns, stat.st_size)
+    entry = page_cache.get(filename)
+    if entry is not None and entry["mtime"] == mtime:
+        return entry
+
+    with static_lock:
+        entry = page_cache.get(filename)
+        if entry is not None and entry["mtime"] == mtime:
+            return entry
+
+        with open(path, "rb") as file:
+            body = file.read().replace(b"__ICON_VERSION__", get_icon_version().encode())
+        entry = {
+            "mtime": mtime,
+            "etag": hashlib.blake2b(body, digest_size=8).hexdigest(),
+            "identity": body,
+        }
+        # Сжатые варианты готовятся сразу, чтобы первый запрос не платил за сжатие
+        for encoding in ("br", "gzip") if brotli is not None else ("gzip",):
+            get_encoded_body(entry, encoding)
+        page_cache[filename] = entry
+        print(f"📄 Loaded {filename} ({len(body)} bytes)")
+        return entry
+
+
+def static_response(entry, mimetype, cache_control):
+    """Ответ из кэша статики с ETag и предсжатием"""
+    if request.if_none_match.contains_weak(entry["etag"]):
+        response = Response(status=304)
+    else:
+        encoding = choose_encoding(len(entry["identity"])) if mimetype.startswith("text/") else "identity"
+        body = entry["identity"] if encoding == "identity" else get_encoded_body(entry, encoding)
+        response = Response(body, status=200, mimetype=mimetype)
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+        response.headers["Vary"] = "Accept-Encoding"
+
+    response.set_etag(entry["etag"], weak=True)
+    response.headers["Cache-Control"] = cache_control
+    return response
+
+
 @app.route("/")
 def index():
     """Главная страница (обычная версия)"""
     try:
-        with open('web.html', 'r', encoding='utf-8') as file:
-            return file.read()
+        return static_response(get_page('web.html'), "text/html", "no-cache")
     except FileNotFoundError:
         return "Error: web.html file not found", 404
     except Exception as e:
@@ -766,20 +3236,35 @@ def index():
 def index_event():
     """Страница ивентов"""
     try:
-        with open('webevent.html', 'r', encoding='utf-8') as file:
-            return file.read()
+        return static_response(get_page('webevent.html'), "text/html", "no-cache")
     except FileNotFoundError:
         return "Error: webevent.html file not found", 404
     except Exception as e:
         return f"Error loading web page: {str(e)}", 500
 
 
+@app.route("/icons/<version>/<name>")
+def icon(version, name):
+    """Иконки состояний и ATC из репозитория; по актуальной версии - immutable кэш"""
+    if name not in ICON_FILES:
+        return "Error: icon not found", 404
+    try:
+        cache_control = ICON_CACHE_CONTROL if version == get_icon_version() else "no-cache"
+        return static_response(get_icon(name), "image/png", cache_control)
+    except Exception as e:
+        return f"Error loading icon: {str(e)}", 500
+
+
 # API эндпоинты для обычных данных (GET запросы к внешнему API)
 @app.route('/api/v1/dsr')
 def api_v1_dsr():
-    """API для обычных рейсов"""
+    """API для обычных рейсов (фильтры: airport, role, live, state, aircraft, fields)"""
     try:
-        return json.dumps(dsr, default=str, ensure_ascii=False), 200, {'Content-Type': 'application/json'}
+        if "since" in request.args:
+            return delta_response("dsr")
+        if any(name in request.args for name in FLIGHT_FILTERS):
+            return filtered_response("dsr")
+        return snapshot_response("dsr")
     except Exception as e:
         return json.dumps({"error": str(e)}), 500, {'Content-Type': 'application/json'}
 
@@ -788,17 +3273,36 @@ def api_v1_dsr():
 def api_v1_atc():
     """API для обычных ATC"""
     try:
-        return json.dumps(atc, default=str, ensure_ascii=False), 200, {'Content-Type': 'application/json'}
+        return snapshot_response("atc")
     except Exception as e:
         return json.dumps({"error": str(e)}), 500, {'Content-Type': 'application/json'}
 
 
 @app.route('/api/v1/airport_stats')
 def api_v1_airport_stats():
-    """API для статистики аэропортов (обычные)"""
+    """API для статистики аэропортов (обычные): taxi/obt count, mean, p50, p90 в минутах"""
     try:
-        stats = calculate_airport_stats(event=False)
-        return json.dumps(stats, default=str, ensure_ascii=False), 200, {'Content-Type': 'application/json'}
+        return snapshot_response("airport_stats")
+    except Exception as e:
+        return json.dumps({"error": str(e)}), 500, {'Content-Type': 'application/json'}
+
+
+@app.route('/api/v1/airport_history')
+@ingestor_only
+def api_v1_airport_history():
+    """API для истории движения по аэропортам (обычные)"""
+    try:
+        return airport_history_response(event=False)
+    except Exception as e:
+        return json.dumps({"error": str(e)}), 500, {'Content-Type': 'application/json'}
+
+
+@app.route('/api/v1/track/<callsign>')
+@ingestor_only
+def api_v1_track(callsign):
+    """API для трека рейса (обычные)"""
+    try:
+        return track_response(callsign, event=False)
     except Exception as e:
         return json.dumps({"error": str(e)}), 500, {'Content-Type': 'application/json'}
 
@@ -807,7 +3311,52 @@ def api_v1_airport_stats():
 def api_v1_atis():
     """API для обычных ATIS"""
     try:
-        return json.dumps(atis, default=str, ensure_ascii=False), 200, {'Content-Type': 'application/json'}
+        return snapshot_response("atis")
+    except Exception as e:
+        return json.dumps({"error": str(e)}), 500, {'Content-Type': 'application/json'}
+
+
+@app.route('/api/v1/aircraft/bbox')
+def api_v1_aircraft_bbox():
+    """API для ВС в окне карты (обычные): ?bbox=min_x,min_y,max_x,max_y"""
+    try:
+        return spatial_response("dsr", "bbox")
+    except Exception as e:
+        return json.dumps({"error": str(e)}), 500, {'Content-Type': 'application/json'}
+
+
+@app.route('/api/v1/aircraft/radius')
+def api_v1_aircraft_radius():
+    """API для ВС в радиусе (обычные): ?x=&y=&radius=&limit="""
+    try:
+        return spatial_response("dsr", "radius")
+    except Exception as e:
+        return json.dumps({"error": str(e)}), 500, {'Content-Type': 'application/json'}
+
+
+@app.route('/api/v1/airport_positions')
+def api_v1_airport_positions():
+    """API для координат аэропортов на карте: x, y, fir и источник (file/learned)"""
+    try:
+        return snapshot_response("airport_positions")
+    except Exception as e:
+        return json.dumps({"error": str(e)}), 500, {'Content-Type': 'application/json'}
+
+
+@app.route('/api/v1/boards')
+def api_v1_boards():
+    """API для табло всех аэропортов (обычные): вылеты, прилёты, ATC и ATIS"""
+    try:
+        return boards_response("boards")
+    except Exception as e:
+        return json.dumps({"error": str(e)}), 500, {'Content-Type': 'application/json'}
+
+
+@app.route('/api/v1/boards/<icao>')
+def api_v1_board(icao):
+    """API для табло одного аэропорта (обычные)"""
+    try:
+        return boards_response("boards", icao)
     except Exception as e:
         return json.dumps({"error": str(e)}), 500, {'Content-Type': 'application/json'}
 
@@ -815,9 +3364,13 @@ def api_v1_atis():
 # API эндпоинты для ивентовых данных (приходят через WebSocket)
 @app.route('/api/v1/edsr')
 def api_v1_edsr():
-    """API для ивентовых рейсов"""
+    """API для ивентовых рейсов (фильтры: airport, role, live, state, aircraft, fields)"""
     try:
-        return json.dumps(edsr, default=str, ensure_ascii=False), 200, {'Content-Type': 'application/json'}
+        if "since" in request.args:
+            return delta_response("edsr")
+        if any(name in request.args for name in FLIGHT_FILTERS):
+            return filtered_response("edsr")
+        return snapshot_response("edsr")
     except Exception as e:
         return json.dumps({"error": str(e)}), 500, {'Content-Type': 'application/json'}
 
@@ -826,17 +3379,36 @@ def api_v1_edsr():
 def api_v1_eatc():
     """API для ивентовых ATC"""
     try:
-        return json.dumps(eatc, default=str, ensure_ascii=False), 200, {'Content-Type': 'application/json'}
+        return snapshot_response("eatc")
     except Exception as e:
         return json.dumps({"error": str(e)}), 500, {'Content-Type': 'application/json'}
 
 
 @app.route('/api/v1/eairport_stats')
 def api_v1_eairport_stats():
-    """API для статистики аэропортов (ивенты)"""
+    """API для статистики аэропортов (ивенты): taxi/obt count, mean, p50, p90 в минутах"""
     try:
-        stats = calculate_airport_stats(event=True)
-        return json.dumps(stats, default=str, ensure_ascii=False), 200, {'Content-Type': 'application/json'}
+        return snapshot_response("eairport_stats")
+    except Exception as e:
+        return json.dumps({"error": str(e)}), 500, {'Content-Type': 'application/json'}
+
+
+@app.route('/api/v1/eairport_history')
+@ingestor_only
+def api_v1_eairport_history():
+    """API для истории движения по аэропортам (ивенты)"""
+    try:
+        return airport_history_response(event=True)
+    except Exception as e:
+        return json.dumps({"error": str(e)}), 500, {'Content-Type': 'application/json'}
+
+
+@app.route('/api/v1/etrack/<callsign>')
+@ingestor_only
+def api_v1_etrack(callsign):
+    """API для трека рейса (ивенты)"""
+    try:
+        return track_response(callsign, event=True)
     except Exception as e:
         return json.dumps({"error": str(e)}), 500, {'Content-Type': 'application/json'}
 
@@ -845,13 +3417,50 @@ def api_v1_eairport_stats():
 def api_v1_eatis():
     """API для ивентовых ATIS"""
     try:
-        return json.dumps(eatis, default=str, ensure_ascii=False), 200, {'Content-Type': 'application/json'}
+        return snapshot_response("eatis")
+    except Exception as e:
+        return json.dumps({"error": str(e)}), 500, {'Content-Type': 'application/json'}
+
+
+@app.route('/api/v1/eaircraft/bbox')
+def api_v1_eaircraft_bbox():
+    """API для ВС в окне карты (ивенты)"""
+    try:
+        return spatial_response("edsr", "bbox")
+    except Exception as e:
+        return json.dumps({"error": str(e)}), 500, {'Content-Type': 'application/json'}
+
+
+@app.route('/api/v1/eaircraft/radius')
+def api_v1_eaircraft_radius():
+    """API для ВС в радиусе (ивенты)"""
+    try:
+        return spatial_response("edsr", "radius")
+    except Exception as e:
+        return json.dumps({"error": str(e)}), 500, {'Content-Type': 'application/json'}
+
+
+@app.route('/api/v1/eboards')
+def api_v1_eboards():
+    """API для табло всех аэропортов (ивенты)"""
+    try:
+        return boards_response("eboards")
+    except Exception as e:
+        return json.dumps({"error": str(e)}), 500, {'Content-Type': 'application/json'}
+
+
+@app.route('/api/v1/eboards/<icao>')
+def api_v1_eboard(icao):
+    """API для табло одного аэропорта (ивенты)"""
+    try:
+        return boards_response("eboards", icao)
     except Exception as e:
         return json.dumps({"error": str(e)}), 500, {'Content-Type': 'application/json'}
 
 
 # POST эндпоинты для приёма ивентовых данных (с авторизацией)
 @app.route('/api/v1/event/atc', methods=['POST'])
+@ingestor_only
 def api_v1_event_atc():
     """POST endpoint для приёма ивентовых ATC данных"""
     try:
@@ -863,8 +3472,10 @@ def api_v1_event_atc():
         if not data:
             return jsonify({"error": "No data provided"}), 400
 
-        global eatc
-        eatc = data
+        with write_lock:
+            apply_event_atc_data(data)
+            journal_append("eatc", data)
+            publish_state()
 
         print(f"Event ATC data received via POST: {len(eatc)} controllers")
         return jsonify({"status": "success", "count": len(eatc)}), 200
@@ -875,6 +3486,7 @@ def api_v1_event_atc():
 
 
 @app.route('/api/v1/event/atis', methods=['POST'])
+@ingestor_only
 def api_v1_event_atis():
     """POST endpoint для приёма ивентовых ATIS данных"""
     try:
@@ -886,8 +3498,10 @@ def api_v1_event_atis():
         if not data:
             return jsonify({"error": "No data provided"}), 400
 
-        global eatis
-        eatis = {item["airport"]: item for item in data if "airport" in item}
+        with write_lock:
+            apply_event_atis_data(data)
+            journal_append("eatis", data)
+            publish_state()
 
         print(f"Event ATIS data received via POST: {len(eatis)} airports")
         return jsonify({"status": "success", "count": len(eatis)}), 200
@@ -897,6 +3511,688 @@ def api_v1_event_atis():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/api/v1/stream')
+@ingestor_only
+def api_v1_stream():
+    """SSE поток изменений рейсов, ATC и ATIS (?channel=normal|event)"""
+    channel = request.args.get("channel", "normal")
+    if channel not in STREAM_TOPICS:
+        return jsonify({"error": "Unknown channel"}), 400
+
+    subscriber = subscribe_stream(channel)
+
+    def generate():
+        try:
+            yield b"retry: 3000\n\n"
+            while True:
+                messages = subscriber.drain(timeout=STREAM_KEEPALIVE)
+                if not messages:
+                    yield b": keepalive\n\n"
+                    continue
+                for topic, payload in messages:
+                    yield format_sse(topic, payload)
+        finally:
+            unsubscribe_stream(subscriber)
+
+    response = Response(stream_with_context(generate()), content_type="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+async def stream_ws_handler(websocket, path=None):
+    """WebSocket поток: /normal или /event, сообщения вида {"type": topic, ...}"""
+    if path is None:
+        path = getattr(getattr(websocket, "request", None), "path", "/")
+    channel = "event" if path.rstrip("/").endswith("event") else "normal"
+
+    loop = asyncio.get_running_loop()
+    wakeup = asyncio.Event()
+    subscriber = subscribe_stream(channel, notify=lambda: loop.call_soon_threadsafe(wakeup.set))
+    try:
+        while True:
+            for topic, payload in subscriber.drain():
+                message = b'{"type": "' + topic.encode() + b'", "payload": ' + payload + b'}'
+                await websocket.send(message.decode("utf-8"))
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=STREAM_KEEPALIVE)
+            except asyncio.TimeoutError:
+                await websocket.ping()
+            wakeup.clear()
+    except websockets.exceptions.ConnectionClosed:
+        pass
+    finally:
+        unsubscribe_stream(subscriber)
+
+
+def run_stream_ws_server():
+    """Запуск WebSocket сервера push-канала"""
+    async def serve():
+        async with websockets.serve(stream_ws_handler, FLASK_HOST, STREAM_WS_PORT):
+            print(f"Stream WebSocket server listening on {FLASK_HOST}:{STREAM_WS_PORT}")
+            await asyncio.Future()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(serve())
+
+
+def run_broadcaster():
+    """Цикл рассылки изменений подписчикам push-канала"""
+    last_versions = {}
+    while True:
+        try:
+            broadcast_stream_updates(last_versions)
+        except Exception as e:
+            print(f"Error broadcasting stream updates: {e}")
+        time.sleep(STREAM_INTERVAL)
+
+
+# Режим нескольких процессов: один ingestor (WebSocket, опрос API, очистка) пишет
+# сериализованные снимки в файл в /dev/shm, worker-процессы (gunicorn main:app)
+# отображают его через mmap и отдают /api/v1/* без собственного состояния.
+SHARED_STORES = ("dsr", "edsr", "atc", "eatc", "atis", "eatis", "airport_stats", "eairport_stats",
+                 "airport_positions")
+SHARED_MAGIC = b"24SNAP1\n"
+SHARED_CHECK_INTERVAL = 0.05
+
+
+def build_shared_image(delta_history):
+    """Образ файла снимков: MAGIC, длина заголовка, JSON заголовок, тела подряд
+
+    В заголовке для каждого хранилища - версия, ETag и [смещение, длина] тела в
+    каждой кодировке; для рейсов ещё готовые дельты от контрольных точек (версий не
+    чаще SHARED_DELTA_STEP секунд за SHARED_DELTA_WINDOW, delta_history), чтобы
+    worker мог ответить на ?since без разбора JSON. Дельты берутся от новых точек
+    к старым, пока их сумма не превысит SHARED_DELTA_BUDGET от снимка: более
+    старым клиентам дешевле отдать сам снимок.
+    """
+    parts = []
+    offset = 0
+
+    def add(body):
+        nonlocal offset
+        parts.append(body)
+        span = [offset, len(body)]
+        offset += len(body)
+        return span
+
+    stores = {}
+    for name in SHARED_STORES:
+        entry = get_snapshot(name)
+        info = {"version": entry["version"], "etag": entry["etag"], "identity": add(entry["identity"])}
+        if len(entry["identity"]) >= COMPRESS_MIN_SIZE:
+            for encoding in ("br", "gzip") if brotli is not None else ("gzip",):
+                info[encoding] = add(get_encoded_body(entry, encoding))
+
+        if name in ("dsr", "edsr"):
+            history = delta_history[name]
+            now = time.monotonic()
+            if not history or (history[-1][0] != entry["version"] and now - history[-1][1] >= SHARED_DELTA_STEP):
+                history.append((entry["version"], now))
+            while history and now - history[0][1] > SHARED_DELTA_WINDOW:
+                history.popleft()
+
+            info["deltas"] = {}
+            budget = SHARED_DELTA_BUDGET * len(entry["identity"])
+            for since, _ in reversed(history):
+                delta = json_dumps(get_flight_delta(name, since, entry["version"]))
+                budget -= len(delta)
+                if budget < 0:
+                    # От этой и более старых точек дельта не дешевле снимка
+                    while history and history[0][0] <= since:
+                        history.popleft()
+                    break
+                info["deltas"][str(since)] = add(delta)
+        stores[name] = info
+
+    header = json_dumps({"boot": BOOT_ID, "published_at": time.time(), "stores": stores})
+    return [SHARED_MAGIC, struct.pack("<I", len(header)), header] + parts
+
+
+def write_shared_image(parts):
+    """Запись через временный файл и rename: читатели видят либо старый, либо новый образ"""
+    directory = os.path.dirname(SHARED_SNAPSHOT_FILE) or "."
+    fd, tmp_path = tempfile.mkstemp(prefix=".24schedule-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as file:
+            for part in parts:
+                file.write(part)
+        os.replace(tmp_path, SHARED_SNAPSHOT_FILE)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def run_shared_publisher():
+    """Цикл ingestor: публикация снимков в SHARED_SNAPSHOT_FILE при изменении версий"""
+    delta_history = {"dsr": deque(), "edsr": deque()}
+    last_versions = None
+    while True:
+        try:
+            versions = {name: published_state["versions"].get(name, 0) for name in SHARED_STORES}
+            if versions != last_versions:
+                with Span("shared_publish"):
+                    write_shared_image(build_shared_image(delta_history))
+                last_versions = versions
+        except Exception as e:
+            print(f"Error publishing shared snapshot: {e}")
+        time.sleep(SHARED_PUBLISH_INTERVAL)
+
+
+class SharedSnapshotReader:
+    """Чтение снимков ingestor из SHARED_SNAPSHOT_FILE (worker)
+
+    Файл заменяется целиком, поэтому каждый новый образ отображается отдельно;
+    тела отдаются как memoryview поверх mmap без копирования. Старое отображение
+    освобождается, когда на него не остаётся ссылок.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.key = None
+        self.boot = None
+        self.stores = {}
+        self.checked = 0.0
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        now = time.monotonic()
+        if now - self.checked < SHARED_CHECK_INTERVAL:
+            return
+        self.checked = now
+
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if key == self.key:
+            return
+
+        with self.lock:
+            if key == self.key:
+                return
+            with open(self.path, "rb") as file:
+                view = memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+            if bytes(view[:len(SHARED_MAGIC)]) != SHARED_MAGIC:
+                raise ValueError(f"{self.path} is not a shared snapshot file")
+
+            header_start = len(SHARED_MAGIC) + 4
+            (header_size,) = struct.unpack("<I", view[len(SHARED_MAGIC):header_start])
+            header = json_loads(bytes(view[header_start:header_start + header_size]))
+            body = view[header_start + header_size:]
+
+            stores = {}
+            for name, info in header["stores"].items():
+                entry = {"version": info["version"], "etag": info["etag"]}
+                for encoding in ("identity", "br", "gzip"):
+                    if encoding in info:
+                        start, size = info[encoding]
+                        entry[encoding] = body[start:start + size]
+                entry["deltas"] = {
+                    int(since): body[start:start + size]
+                    for since, (start, size) in info.get("deltas", {}).items()
+                }
+                entry["delta_versions"] = sorted(entry["deltas"])
+                stores[name] = entry
+
+            self.boot = header["boot"]
+            self.stores = stores
+            self.key = key
+
+    def get(self, name):
+        self.refresh()
+        entry = self.stores.get(name)
+        if entry is None:
+            # Ingestor ещё не опубликовал снимок
+            empty = b"[]" if name in ("atc", "eatc") else b"{}"
+            return {"version": 0, "etag": f"empty-{name}", "identity": empty}
+        return entry
+
+    def get_delta(self, name, since):
+        """Готовая дельта от ближайшей контрольной точки не новее since
+
+        Она включает и изменения между точкой и since - клиент применяет их повторно
+        без вреда. None - нужен полный снимок (full_delta_entry).
+        """
+        entry = self.get(name)
+        boot = request.args.get("boot")
+        if (boot and boot != self.boot) or since <= 0 or since > entry["version"]:
+            return None
+        versions = entry.get("delta_versions", ())
+        position = bisect.bisect_right(versions, since) - 1
+        if position < 0:
+            return None
+        return entry["deltas"][versions[position]]
+
+
+shared_reader = None
+
+
+def get_shared_reader():
+    global shared_reader
+    if shared_reader is None:
+        shared_reader = SharedSnapshotReader(SHARED_SNAPSHOT_FILE)
+    return shared_reader
+
+
+# Кластер: несколько узлов за балансировщиком, к 24data подключается только лидер.
+# Лидер кладёт в backend образ снимков (тот же, что build_shared_image) и состояние
+# для восстановления, реплики получают уведомление и пишут образ в свой
+# SHARED_SNAPSHOT_FILE - его читают и сам узел, и его worker-процессы.
+cluster_role = None  # None (кластер выключен) | "follower" | "leader"
+cluster_stats = {"elections": 0, "published": 0, "received": 0, "last_image_at": None, "leader": None}
+
+
+class MemoryBackend:
+    """Backend в памяти процесса: для тестов и бенчмарков нескольких узлов в одном процессе"""
+
+    def __init__(self):
+        self.values = {}
+        self.expires = {}
+        self.messages = defaultdict(int)
+        self.condition = threading.Condition()
+
+    def acquire_lease(self, key, node_id, ttl):
+        """Захват или продление аренды лидера; True, если лидер - node_id"""
+        with self.condition:
+            now = time.monotonic()
+            holder = self.values.get(key)
+            if holder is None or holder == node_id or self.expires.get(key, 0) <= now:
+                self.values[key] = node_id
+                self.expires[key] = now + ttl
+                return True
+            return False
+
+    def release_lease(self, key, node_id):
+        with self.condition:
+            if self.values.get(key) == node_id:
+                self.values.pop(key, None)
+                self.expires.pop(key, None)
+
+    def get(self, key):
+        with self.condition:
+            if key in self.expires and self.expires[key] <= time.monotonic():
+                return None
+            return self.values.get(key)
+
+    def set(self, key, value):
+        with self.condition:
+            self.values[key] = value
+            self.expires.pop(key, None)
+
+    def publish(self, channel, message):
+        with self.condition:
+            self.messages[channel] += 1
+            self.condition.notify_all()
+
+    def subscribe(self, channel):
+        return MemorySubscription(self, channel)
+
+
+class MemorySubscription:
+    def __init__(self, backend, channel):
+        self.backend = backend
+        self.channel = channel
+        self.seen = backend.messages[channel]
+
+    def wait(self, timeout):
+        """True, если после прошлого вызова были сообщения"""
+        with self.backend.condition:
+            self.backend.condition.wait_for(lambda: self.backend.messages[self.channel] != self.seen, timeout)
+            received = self.backend.messages[self.channel] != self.seen
+            self.seen = self.backend.messages[self.channel]
+            return received
+
+
+class RedisBackend:
+    """Backend поверх Redis (или совместимого по протоколу сервера)"""
+
+    # Продление аренды только своим держателем
+    RENEW_SCRIPT = """
+    if redis.call('get', KEYS[1]) == ARGV[1] then
+        return redis.call('pexpire', KEYS[1], ARGV[2])
+    end
+    return 0
+    """
+
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url)
+        self.renew = self.client.register_script(self.RENEW_SCRIPT)
+
+    def acquire_lease(self, key, node_id, ttl):
+        ttl_ms = int(ttl * 1000)
+        if self.client.set(key, node_id, nx=True, px=ttl_ms):
+            return True
+        return bool(self.renew(keys=[key], args=[node_id, ttl_ms]))
+
+    def release_lease(self, key, node_id):
+        if self.client.get(key) == node_id.encode():
+            self.client.delete(key)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value):
+        self.client.set(key, value)
+
+    def publish(self, channel, message):
+        self.client.publish(channel, message)
+
+    def subscribe(self, channel):
+        return RedisSubscription(self.client, channel)
+
+
+class RedisSubscription:
+    def __init__(self, client, channel):
+        self.pubsub = client.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(channel)
+
+    def wait(self, timeout):
+        received = self.pubsub.get_message(timeout=timeout) is not None
+        # Пропускаем накопившиеся уведомления - нужен только последний образ
+        while self.pubsub.get_message(timeout=0) is not None:
+            received = True
+        return received
+
+
+def create_cluster_backend():
+    if CLUSTER_BACKEND == "memory":
+        return MemoryBackend()
+    if CLUSTER_BACKEND == "redis":
+        if redis is None:
+            raise RuntimeError("CLUSTER_BACKEND=redis requires the redis package")
+        return RedisBackend(CLUSTER_REDIS_URL)
+    raise ValueError(f"Unknown CLUSTER_BACKEND: {CLUSTER_BACKEND}")
+
+
+def cluster_key(name):
+    return f"{CLUSTER_PREFIX}:{name}"
+
+
+def become_leader(backend):
+    """Реплика стала лидером: восстановление состояния из backend и запуск приёма"""
+    global cluster_role
+    state = backend.get(cluster_key("state"))
+    if state:
+        with write_lock:
+            apply_state_snapshot(json_loads(gzip.decompress(state)))
+            expire_flights()
+            publish_state()
+        print(f"👑 Restored {persist_stats['restored_flights']} flights from cluster state")
+
+    cluster_role = "leader"
+    cluster_stats["elections"] += 1
+    run_threads()
+
+
+def publish_cluster_state(backend):
+    """Состояние для восстановления на следующем лидере"""
+    snapshot = capture_snapshot()
+    backend.set(cluster_key("state"), gzip.compress(json_dumps(snapshot), compresslevel=5))
+
+
+def run_cluster_node(backend=None, node_id=NODE_ID):
+    """Цикл узла кластера: выборы лидера, публикация или приём образов снимков
+
+    Лидер продлевает аренду каждые CLUSTER_LEASE_TTL / 3 секунд. Если аренду
+    продлить не удалось (отказ или ошибки backend дольше CLUSTER_LEASE_TTL),
+    процесс завершается: остановить уже запущенные потоки приёма нельзя, а
+    второй одновременный приёмник недопустим.
+    """
+    global cluster_role
+    backend = backend or create_cluster_backend()
+    lease_key = cluster_key("leader")
+    cluster_role = "follower"
+    subscription = backend.subscribe(cluster_key("updates"))
+    delta_history = {"dsr": deque(), "edsr": deque()}
+    last_versions = None
+    last_renew = 0.0
+    last_success = 0.0
+    last_state = 0.0
+    last_image_id = None
+
+    while True:
+        # Аренда могла истечь, пока backend был недоступен - её уже может держать другой узел
+        if cluster_role == "leader" and time.monotonic() - last_success >= CLUSTER_LEASE_TTL:
+            print(f"Cluster lease of {node_id} expired without renewal, exiting")
+            os._exit(1)
+
+        try:
+            now = time.monotonic()
+            if cluster_role == "follower" or now - last_renew >= CLUSTER_LEASE_TTL / 3:
+                leader = backend.acquire_lease(lease_key, node_id, CLUSTER_LEASE_TTL)
+                last_renew = now
+                if leader:
+                    last_success = now
+                if not leader and cluster_role == "leader":
+                    print(f"Lost cluster leadership ({node_id}), exiting")
+                    os._exit(1)
+                if leader and cluster_role == "follower":
+                    print(f"👑 {node_id} is now the cluster leader")
+                    become_leader(backend)
+                cluster_stats["leader"] = node_id if leader else backend.get(lease_key)
+
+            if cluster_role == "leader":
+                versions = {name: published_state["versions"].get(name, 0) for name in SHARED_STORES}
+                if versions != last_versions:
+                    with Span("cluster_publish"):
+                        parts = build_shared_image(delta_history)
+                        write_shared_image(parts)
+                        # Сначала образ, затем его короткий идентификатор - реплики сверяют только его
+                        image_id = f"{node_id}-{BOOT_ID}-{cluster_stats['published'] + 1}".encode()
+                        backend.set(cluster_key("image"), b"".join(parts))
+                        backend.set(cluster_key("image_id"), image_id)
+                        backend.publish(cluster_key("updates"), image_id)
+                    last_versions = versions
+                    cluster_stats["published"] += 1
+                    cluster_stats["last_image_at"] = time.time()
+                if now - last_state >= CLUSTER_STATE_INTERVAL:
+                    publish_cluster_state(backend)
+                    last_state = now
+                time.sleep(SHARED_PUBLISH_INTERVAL)
+            else:
+                # Ждём уведомления, но не дольше трети аренды - чтобы вовремя подхватить лидерство.
+                # Образ (мегабайты) забираем, только если сменился его идентификатор
+                subscription.wait(min(CLUSTER_LEASE_TTL / 3, 1.0))
+                image_id = backend.get(cluster_key("image_id"))
+                if image_id and image_id != last_image_id:
+                    image = backend.get(cluster_key("image"))
+                    if image:
+                        write_shared_image([image])
+                        last_image_id = image_id
+                        cluster_stats["received"] += 1
+                        cluster_stats["last_image_at"] = time.time()
+        except Exception as e:
+            print(f"Error in cluster node loop: {e}")
+            time.sleep(1)
+
+
+@app.route('/api/v1/cluster')
+def api_v1_cluster():
+    """Роль узла в кластере и время последнего образа снимков"""
+    return jsonify({"node": NODE_ID, "role": cluster_role, "backend": CLUSTER_BACKEND or None, **cluster_stats}), 200
+
+
+@app.route('/api/v1/sources')
+@ingestor_only
+def api_v1_sources():
+    """Состояние опроса внешнего API: задержка и свежесть по источникам"""
+    return jsonify(get_source_status()), 200
+
+
+@app.route('/api/v1/ingest')
+@ingestor_only
+def api_v1_ingest():
+    """Метрики конвейера приёма кадров"""
+    return jsonify(get_ingest_stats()), 200
+
+
+def render_metrics():
+    """Метрики в текстовом формате Prometheus"""
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+
+    def histograms(name, help_text, items, label):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for key, histogram in sorted(items):
+            lines.extend(histogram.render(name, f'{label}="{key}"' if label else ""))
+
+    stats = get_ingest_stats()
+    metric("schedule24_frames_total", "counter", "Processed websocket frames by message type",
+           [(f'type="{msg_type}"', count) for msg_type, count in sorted(frame_counts.items())])
+    histograms("schedule24_frame_processing_seconds", "Time to apply one frame to the stores",
+               list(frame_latency.items()), "type")
+    histograms("schedule24_frame_queue_delay_seconds", "Time from websocket receive to processing",
+               [("", frame_queue_delay)], None)
+    for key in ("received", "coalesced", "dropped", "errors", "reconnects"):
+        metric(f"schedule24_ingest_{key}_total", "counter", f"Ingest pipeline {key} count", [("", stats[key])])
+    metric("schedule24_ingest_queue_depth", "gauge", "Frames waiting in the ingest queue", [("", stats["queue_depth"])])
+
+    state = published_state
+    metric("schedule24_flights", "gauge", "Flights in store",
+           [('store="dsr"', len(state["dsr"])), ('store="edsr"', len(state["edsr"]))])
+    metric("schedule24_live_flights", "gauge", "Flights with fresh ACFT_DATA",
+           [(f'store="{name}"', sum(1 for flight in state[name].values() if flight.get("live")))
+            for name in ("dsr", "edsr")])
+    metric("schedule24_stream_subscribers", "gauge", "Connected SSE/WebSocket subscribers",
+           [(f'channel="{channel}"', len(subscribers)) for channel, subscribers in stream_subscribers.items()])
+
+    histograms("schedule24_upstream_fetch_seconds", "External API request latency",
+               list(upstream_latency.items()), "source")
+    metric("schedule24_upstream_errors_total", "counter", "External API request errors",
+           [(f'source="{name}"', status["errors"]) for name, status in source_status.items()])
+    metric("schedule24_upstream_not_modified_total", "counter", "External API 304 or unchanged responses",
+           [(f'source="{name}"', status["not_modified"] + status["unchanged"]) for name, status in source_status.items()])
+    metric("schedule24_upstream_breaker_open", "gauge", "Circuit breaker is open",
+           [(f'source="{name}"', int(status["state"] == "open")) for name, status in source_status.items()])
+
+    histograms("schedule24_http_request_seconds", "Request latency by route",
+               list(request_latency.items()), "endpoint")
+    metric("schedule24_http_response_bytes_total", "counter", "Response body bytes by route",
+           [(f'endpoint="{endpoint}"', size) for endpoint, size in sorted(response_bytes.items())])
+    metric("schedule24_cache_total", "counter", "Snapshot cache lookups",
+           [(f'cache="{key.rsplit("_", 1)[0]}",result="{key.rsplit("_", 1)[1]}"', count)
+            for key, count in sorted(cache_stats.items()) if key != "not_modified"])
+    metric("schedule24_not_modified_total", "counter", "Responses answered with 304",
+           [("", cache_stats["not_modified"])])
+    histograms("schedule24_span_seconds", "Span timing of hot functions (when tracing is enabled)",
+               list(span_latency.items()), "span")
+    metric("schedule24_slow_operations_total", "counter", "Spans slower than the slow-operation threshold",
+           [(f'span="{name}"', count) for name, count in sorted(span_slow.items())])
+
+    return "\n".join(lines) + "\n"
+
+
+@app.route('/metrics')
+def metrics():
+    """Метрики для Prometheus"""
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+
+profile_lock = threading.Lock()
+
+
+def sample_stacks(seconds, interval):
+    """Семплирующий профайлер по sys._current_frames()
+
+    Возвращает стеки в folded формате (flamegraph.pl, speedscope, inferno):
+    "поток;функция (файл:строка);... <число семплов>". Поток, который ведёт
+    замер, в профиль не попадает.
+    """
+    own_ident = threading.get_ident()
+    counts = defaultdict(int)
+    samples = 0
+    deadline = time.perf_counter() + seconds
+
+    while time.perf_counter() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            counts[";".join(reversed(stack))] += 1
+        samples += 1
+        time.sleep(interval)
+
+    lines = [f"{stack} {count}" for stack, count in sorted(counts.items(), key=lambda item: -item[1])]
+    return samples, "\n".join(lines) + "\n"
+
+
+@app.route('/api/v1/admin/profile', methods=['POST'])
+def api_v1_admin_profile():
+    """Семплирующий профиль процесса: ?seconds=10&interval=0.005, ответ в folded формате"""
+    try:
+        if not ADMIN_TOKEN:
+            return jsonify({"error": "Admin API is disabled (ADMIN_TOKEN is not set)"}), 403
+        if not check_admin_auth():
+            return jsonify({"error": "Unauthorized"}), 401
+
+        seconds = min(float(request.args.get("seconds", 10)), PROFILE_MAX_SECONDS)
+        interval = max(float(request.args.get("interval", 0.005)), 0.001)
+
+        if not profile_lock.acquire(blocking=False):
+            return jsonify({"error": "Profile already running"}), 409
+        try:
+            print(f"🔬 Profiling for {seconds}s (interval {interval * 1000:.0f} ms)")
+            samples, folded = sample_stacks(seconds, interval)
+        finally:
+            profile_lock.release()
+
+        return Response(folded, mimetype="text/plain", headers={"X-Profile-Samples": str(samples)})
+
+    except ValueError:
+        return jsonify({"error": "Invalid seconds or interval"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/v1/admin/tracing', methods=['GET', 'POST'])
+def api_v1_admin_tracing():
+    """Состояние тайминга горячих функций; POST {"enabled": bool, "threshold_ms": float}"""
+    try:
+        if not ADMIN_TOKEN:
+            return jsonify({"error": "Admin API is disabled (ADMIN_TOKEN is not set)"}), 403
+        if not check_admin_auth():
+            return jsonify({"error": "Unauthorized"}), 401
+
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            if "enabled" in data:
+                tracing["enabled"] = bool(data["enabled"])
+            if "threshold_ms" in data:
+                tracing["threshold_ms"] = float(data["threshold_ms"])
+            print(f"Span timing {'enabled' if tracing['enabled'] else 'disabled'}, "
+                  f"slow threshold {tracing['threshold_ms']} ms")
+
+        spans = {
+            name: {
+                "count": histogram.count,
+                "total_ms": round(histogram.sum * 1000, 3),
+                "mean_ms": round(histogram.sum * 1000 / histogram.count, 3) if histogram.count else None,
+                "slow": span_slow.get(name, 0),
+            }
+            for name, histogram in sorted(span_latency.items())
+        }
+        return jsonify({**tracing, "spans": spans}), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 def run_websocket_client():
     """Запуск WebSocket клиента"""
     loop = asyncio.new_event_loop()
@@ -906,12 +4202,236 @@ def run_websocket_client():
 
 def run_cleanup_loop():
     """Запуск цикла очистки старых данных"""
+    last_stats_refresh = time.time()
+    last_positions_refresh = 0
     while True:
-        cleanup_old_data()
-        time.sleep(60)
+        try:
+            with write_lock:
+                changed = expire_flights()
+                if time.time() - last_stats_refresh >= AIRPORT_STATS_REFRESH:
+                    changed = refresh_airport_stats() or changed
+                    last_stats_refresh = time.time()
+                if time.time() - last_positions_refresh >= AIRPORT_STATS_REFRESH:
+                    changed = refresh_airport_positions() or changed
+                    last_positions_refresh = time.time()
+                if changed:
+                    publish_state()
+        except Exception as e:
+            print(f"Error expiring flights: {e}")
+        time.sleep(EXPIRY_TICK)
+
+
+# Персистентность: снимок состояния + журнал применённых обновлений в STATE_DIR.
+# В журнал попадают только планы полётов и ивентовые ATC/ATIS - ACFT_DATA и
+# внешние ATC/ATIS восстанавливаются сами в течение секунд после старта.
+persistence_enabled = False
+persist_queue = deque()
+persist_condition = threading.Condition()
+persist_seq = 0
+persist_stats = {
+    "journaled": 0,
+    "fsyncs": 0,
+    "snapshots": 0,
+    "last_snapshot": None,
+    "restored_flights": 0,
+    "replayed": 0,
+    "errors": 0,
+}
 
 
-if __name__ == "__main__":
+def get_state_paths():
+    return os.path.join(STATE_DIR, "snapshot.json.gz"), os.path.join(STATE_DIR, "journal.jsonl")
+
+
+def journal_append(kind, data, ts=None):
+    """Постановка записи в журнал (под write_lock, запись на диск в фоновом потоке)"""
+    global persist_seq
+    if not persistence_enabled:
+        return
+    persist_seq += 1
+    entry = {"seq": persist_seq, "ts": ts if ts is not None else time.time(), "type": kind, "data": data}
+    with persist_condition:
+        persist_queue.append(("journal", entry))
+        persist_condition.notify()
+
+
+def capture_snapshot():
+    """Копия состояния для снимка (под write_lock)"""
+    with write_lock:
+        return {
+            "seq": persist_seq,
+            "ts": time.time(),
+            "dsr": {callsign: record.to_state() for callsign, record in dsr.items()},
+            "edsr": {callsign: record.to_state() for callsign, record in edsr.items()},
+            "atc": atc,
+            "atis": atis,
+            "eatc": eatc,
+            "eatis": eatis,
+        }
+
+
+def write_snapshot(snapshot):
+    """Атомарная запись снимка: временный файл, fsync, rename"""
+    snapshot_path, _ = get_state_paths()
+    tmp_path = snapshot_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(gzip.compress(json_dumps(snapshot), compresslevel=5))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, snapshot_path)
+
+    dir_fd = os.open(STATE_DIR, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def run_persistence_writer():
+    """Фоновая запись журнала пачками и периодические снимки
+
+    fsync журнала выполняется не чаще JOURNAL_FSYNC_INTERVAL секунд (0 - после
+    каждой пачки). После записи снимка журнал обрезается: всё, что в нём было,
+    уже входит в снимок.
+    """
+    _, journal_path = get_state_paths()
+    journal = open(journal_path, "ab")
+    last_fsync = time.time()
+    last_snapshot = time.time()
+    pending_fsync = False
+
+    while True:
+        with persist_condition:
+            if not persist_queue:
+                persist_condition.wait(timeout=max(JOURNAL_FSYNC_INTERVAL, 0.1))
+            batch = list(persist_queue)
+            persist_queue.clear()
+
+        try:
+            if batch:
+                journal.write(b"".join(json_dumps(entry) + b"\n" for _, entry in batch))
+                journal.flush()
+                persist_stats["journaled"] += len(batch)
+                pending_fsync = True
+
+            now = time.time()
+            if pending_fsync and now - last_fsync >= JOURNAL_FSYNC_INTERVAL:
+                os.fsync(journal.fileno())
+                persist_stats["fsyncs"] += 1
+                last_fsync = now
+                pending_fsync = False
+
+            if now - last_snapshot >= SNAPSHOT_INTERVAL:
+                os.fsync(journal.fileno())
+                pending_fsync = False
+                snapshot = capture_snapshot()
+                write_snapshot(snapshot)
+                journal.close()
+                journal = open(journal_path, "wb")
+                last_snapshot = now
+                persist_stats["snapshots"] += 1
+                persist_stats["last_snapshot"] = snapshot["ts"]
+                print(f"💾 Snapshot saved: {len(snapshot['dsr'])} flights, {len(snapshot['edsr'])} event flights")
+        except Exception as e:
+            persist_stats["errors"] += 1
+            print(f"Error writing state to {STATE_DIR}: {e}")
+
+
+def restore_flights(flights, event=False):
+    """Восстановление рейсов из снимка вместе с индексами и дедлайнами"""
+    store = edsr if event else dsr
+    for callsign, state in flights.items():
+        record = FlightRecord.from_state(state)
+        record.live = False
+        store[callsign] = record
+        index_flight(callsign, record.player_name, record.realcallsign, event=event)
+        update_airport_presence(callsign, record, record.last_fresh_time or time.time(), event=event)
+        schedule_flight(callsign, event=event)
+        mark_flight_changed(callsign, event=event)
+    return len(flights)
+
+
+def apply_state_snapshot(snapshot):
+    """Применение снимка capture_snapshot() к пустому состоянию (под write_lock)"""
+    global atc, atis
+    persist_stats["restored_flights"] += restore_flights(snapshot.get("dsr", {}))
+    persist_stats["restored_flights"] += restore_flights(snapshot.get("edsr", {}), event=True)
+    atc = snapshot.get("atc") or atc
+    atis = snapshot.get("atis") or atis
+    apply_event_atc_data(snapshot.get("eatc") or [])
+    apply_event_atis_data(list((snapshot.get("eatis") or {}).values()))
+    for name in ("atc", "atis"):
+        bump_version(name)
+
+
+def restore_state():
+    """Загрузка снимка и повтор журнала при старте (до запуска фоновых потоков)"""
+    global persist_seq
+    snapshot_path, journal_path = get_state_paths()
+    started = time.time()
+
+    with write_lock:
+        if os.path.exists(snapshot_path):
+            try:
+                with open(snapshot_path, "rb") as f:
+                    snapshot = json_loads(gzip.decompress(f.read()))
+                persist_seq = snapshot.get("seq", 0)
+                apply_state_snapshot(snapshot)
+            except Exception as e:
+                persist_stats["errors"] += 1
+                print(f"Error loading snapshot {snapshot_path}: {e}")
+
+        if os.path.exists(journal_path):
+            with open(journal_path, "rb") as f:
+                for line in f:
+                    try:
+                        entry = json_loads(line)
+                    except ValueError:
+                        # Оборванная последняя запись после аварийной остановки
+                        break
+                    if entry["seq"] <= persist_seq:
+                        continue
+                    persist_seq = entry["seq"]
+                    if entry["type"] == "frame":
+                        apply_frame(entry["data"], entry["ts"])
+                    elif entry["type"] == "eatc":
+                        apply_event_atc_data(entry["data"])
+                    elif entry["type"] == "eatis":
+                        apply_event_atis_data(entry["data"])
+                    persist_stats["replayed"] += 1
+
+        expire_flights()
+        publish_state()
+
+    print(f"💾 State restored in {time.time() - started:.2f}s: "
+          f"{persist_stats['restored_flights']} flights, {persist_stats['replayed']} journal entries")
+
+
+def start_persistence():
+    """Восстановление состояния и запуск фоновой записи, если задан STATE_DIR"""
+    global persistence_enabled
+    if not STATE_DIR:
+        return
+    os.makedirs(STATE_DIR, exist_ok=True)
+    restore_state()
+    persistence_enabled = True
+
+    writer_thread = threading.Thread(target=run_persistence_writer)
+    writer_thread.daemon = True
+    writer_thread.start()
+
+
+def run_threads():
+    """Фоновые потоки ingestor: приём кадров, опрос API, очистка, рассылка"""
+    # Восстановление состояния после перезапуска (в кластере состояние хранит backend)
+    if cluster_role is None:
+        start_persistence()
+
+    # Запуск обработчика кадров
+    ingest_thread = threading.Thread(target=run_ingest_processor)
+    ingest_thread.daemon = True
+    ingest_thread.start()
+
     # Запуск WebSocket клиента в фоновом потоке
     ws_thread = threading.Thread(target=run_websocket_client)
     ws_thread.daemon = True
@@ -927,6 +4447,41 @@ if __name__ == "__main__":
     updater_thread.daemon = True
     updater_thread.start()
 
+    # Запуск рассылки push-обновлений
+    broadcaster_thread = threading.Thread(target=run_broadcaster)
+    broadcaster_thread.daemon = True
+    broadcaster_thread.start()
+
+    if STREAM_WS_PORT:
+        stream_ws_thread = threading.Thread(target=run_stream_ws_server)
+        stream_ws_thread.daemon = True
+        stream_ws_thread.start()
+
+    if SERVE_MODE == "ingestor" and cluster_role is None:
+        shared_thread = threading.Thread(target=run_shared_publisher)
+        shared_thread.daemon = True
+        shared_thread.start()
+        print(f"Publishing shared snapshots to {SHARED_SNAPSHOT_FILE}")
+
+
+if __name__ == "__main__":
+    if SERVE_MODE not in ("standalone", "ingestor", "worker"):
+        sys.exit(f"Unknown SERVE_MODE: {SERVE_MODE}")
+
+    # SIGTERM (docker stop, systemd) - обычный выход, чтобы отработал atexit (рекордер)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    # Worker только читает снимки ingestor (обычно запускается как gunicorn main:app);
+    # в кластере потоки приёма запускает узел, ставший лидером
+    if CLUSTER_BACKEND and SERVE_MODE != "worker":
+        cluster_thread = threading.Thread(target=run_cluster_node, args=(create_cluster_backend(),))
+        cluster_thread.daemon = True
+        cluster_thread.start()
+        print(f"Cluster node {NODE_ID} ({CLUSTER_BACKEND})")
+    elif SERVE_MODE != "worker":
+        run_threads()
+
+    print(f"Serve mode: {SERVE_MODE}")
     print(f"Starting Flask application on {FLASK_HOST}:{FLASK_PORT}...")
     print(f"Debug mode: {DEBUG}")
     print(f"External API: {EXTERNAL_API_URL}")
@@ -0,0 +1,17 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def main(tmp_path, monkeypatch):
+    """Модуль main с чистым состоянием и снимком во временном каталоге"""
+    monkeypatch.setenv("SERVE_MODE", "standalone")
+    monkeypatch.setenv("CLUSTER_BACKEND", "")
+    monkeypatch.setenv("SHARED_SNAPSHOT_FILE", str(tmp_path / "24schedule.snapshot"))
+    import main as module
+    return importlib.reload(module)
@@ -0,0 +1,71 @@
+"""История аэропортов: вылеты, прилёты и текущие значения на реальной посадке"""
+import time
+
+
+def flight_plan(departure, arrival):
+    return {"t": "FLIGHT_PLAN", "d": {
+        "robloxName": "player1", "callsign": "TST1", "realcallsign": "RC-1",
+        "departing": departure, "arriving": arrival, "flightlevel": "FL300",
+        "aircraft": "Boeing 737", "flightrules": "IFR", "route": "GPS DCT",
+    }}
+
+
+def acft(on_ground, speed, altitude):
+    return {"t": "ACFT_DATA", "d": {"RC-1": {
+        "playerName": "player1", "heading": 90, "altitude": altitude, "aircraftType": "Boeing 737",
+        "position": {"x": 0, "y": 0}, "speed": speed, "groundSpeed": speed, "wind": "090/5",
+        "isOnGround": on_ground, "isEmergencyOccuring": False,
+    }}}
+
+
+# Стоянка, руление, разбег, набор, эшелон, снижение, касание, пробег, руление, стоянка
+FLIGHT = [
+    (True, 0, 0), (True, 20, 0), (True, 140, 0), (False, 200, 3000), (False, 450, 31000),
+    (False, 250, 8000), (True, 140, 0), (True, 30, 0), (True, 15, 0), (True, 0, 0),
+]
+
+
+def totals(main, icao, now):
+    with main.write_lock:
+        main.publish_state()
+    _, series = main.history_series(main.published_state["airport_history"][icao], "1m", now)
+    return sum(series["departures"]), sum(series["arrivals"]), series["on_ground"][-1], series["airborne"][-1]
+
+
+def test_landing_without_arrived_state(main):
+    now = time.time() - len(FLIGHT)
+    main.apply_frame(flight_plan("IRFD", "ILAR"), received_at=now)
+    states = []
+    for step, (on_ground, speed, altitude) in enumerate(FLIGHT, 1):
+        main.apply_frame(acft(on_ground, speed, altitude), received_at=now + step)
+        states.append(main.dsr["TST1"].state)
+
+    # Посадка проходит 4 -> 1 -> 0, минуя 5
+    assert states[5:] == [4, 4, 1, 1, 0]
+    assert 5 not in states
+    assert main.airport_presence["dsr"]["TST1"] == ("ILAR", "on_ground")
+
+    end = now + len(FLIGHT)
+    assert totals(main, "IRFD", end) == (1, 0, 0, 0)
+    assert totals(main, "ILAR", end) == (0, 1, 1, 0)
+
+
+def test_history_endpoint_reads_published_state(main):
+    now = time.time()
+    main.apply_frame(flight_plan("IRFD", "ILAR"), received_at=now)
+    main.apply_frame(acft(True, 0, 0), received_at=now)
+    client = main.app.test_client()
+
+    # До публикации изменения буферов не видны обработчикам
+    assert client.get("/api/v1/airport_history?airport=IRFD").get_json()["airports"] == {}
+    with main.write_lock:
+        main.publish_state()
+    published = client.get("/api/v1/airport_history?airport=IRFD").get_json()["airports"]["IRFD"]
+    assert published["on_ground"][-1] == 1
+
+    main.apply_frame(acft(False, 200, 3000), received_at=now)
+    assert client.get("/api/v1/airport_history?airport=IRFD").get_json()["airports"]["IRFD"] == published
+    with main.write_lock:
+        main.publish_state()
+    series = client.get("/api/v1/airport_history?airport=IRFD").get_json()["airports"]["IRFD"]
+    assert series["departures"][-1] == 1 and series["on_ground"][-1] == 0
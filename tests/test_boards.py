@@ -0,0 +1,45 @@
+"""Версии табло аэропортов у worker"""
+from collections import deque
+
+from bench import synthetic
+from bench.bench_suite import load_flights
+
+
+def worker_board_versions(main, monkeypatch, history):
+    """Опубликовать снимок ingestor и прочитать версии табло как worker"""
+    main.write_shared_image(main.build_shared_image(history))
+    monkeypatch.setattr(main, "SERVE_MODE", "worker")
+    try:
+        version, versions, _ = main.get_board_state("boards")
+        return version, dict(versions)
+    finally:
+        monkeypatch.setattr(main, "SERVE_MODE", "standalone")
+
+
+def test_worker_bumps_only_changed_airports(main, monkeypatch):
+    monkeypatch.setattr(main, "SHARED_CHECK_INTERVAL", 0)
+    history = {"dsr": deque(), "edsr": deque()}
+    load_flights(main, 200)
+    main.apply_external_atis_data([{"airport": "IRFD", "content": "A"}, {"airport": "IPPH", "content": "B"}])
+    _, before = worker_board_versions(main, monkeypatch, history)
+    assert set(synthetic.AIRPORTS) <= set(before)
+
+    main.apply_external_atis_data([{"airport": "IRFD", "content": "C"}, {"airport": "IPPH", "content": "B"}])
+    version, after = worker_board_versions(main, monkeypatch, history)
+    assert [icao for icao in after if after[icao] != before.get(icao)] == ["IRFD"]
+
+    # Новая версия рейсов без изменений на табло не меняет ни одной версии
+    with main.write_lock:
+        main.bump_version("dsr")
+        main.publish_state()
+    same_version, same = worker_board_versions(main, monkeypatch, history)
+    assert same == after
+    assert same_version == version
+
+    # Изменённый рейс меняет табло только своих аэропортов
+    flight = main.published_state["dsr"]["SYN0"]
+    with main.write_lock:
+        main.apply_frame(synthetic.make_acft_frame(1, tick=7))
+        main.publish_state()
+    _, moved = worker_board_versions(main, monkeypatch, history)
+    assert {icao for icao in moved if moved[icao] != same.get(icao)} == {flight["departure"], flight["arrival"]}
@@ -0,0 +1,122 @@
+"""Аренда лидера: лидер без продлённой аренды должен завершиться, а не продолжать приём"""
+import time
+
+import pytest
+
+
+class Fenced(BaseException):
+    """Вместо os._exit: не перехватывается except Exception в цикле узла"""
+
+
+class Elected(BaseException):
+    pass
+
+
+@pytest.fixture
+def cluster(main, monkeypatch):
+    monkeypatch.setattr(main, "CLUSTER_LEASE_TTL", 0.3)
+    monkeypatch.setattr(main, "SHARED_PUBLISH_INTERVAL", 0.01)
+
+    def exit_(code):
+        raise Fenced(code)
+
+    def become_leader(backend):
+        # Без запуска потоков приёма
+        main.cluster_role = "leader"
+
+    monkeypatch.setattr(main.os, "_exit", exit_)
+    monkeypatch.setattr(main, "become_leader", become_leader)
+    return main
+
+
+def failing_backend(main, calls=1):
+    """MemoryBackend, который после первых calls захватов аренды недоступен"""
+    backend = main.MemoryBackend()
+    acquire = backend.acquire_lease
+    attempts = []
+
+    def acquire_lease(key, node_id, ttl):
+        attempts.append(node_id)
+        if len(attempts) > calls:
+            raise ConnectionError("backend is down")
+        return acquire(key, node_id, ttl)
+
+    backend.acquire_lease = acquire_lease
+    return backend
+
+
+def test_leader_exits_when_lease_is_taken(cluster):
+    backend = cluster.MemoryBackend()
+    lease_key = cluster.cluster_key("leader")
+
+    def steal(channel, message, publish=backend.publish):
+        # Первая публикация образа: аренду перехватывает другой узел
+        with backend.condition:
+            backend.values[lease_key] = "other"
+            backend.expires[lease_key] = time.monotonic() + 60
+        publish(channel, message)
+
+    backend.publish = steal
+    with pytest.raises(Fenced):
+        cluster.run_cluster_node(backend, "node-a")
+    assert backend.get(lease_key) == "other"
+
+
+def test_leader_exits_when_renewal_keeps_failing(cluster):
+    backend = failing_backend(cluster)
+    started = time.monotonic()
+    with pytest.raises(Fenced) as error:
+        cluster.run_cluster_node(backend, "node-a")
+    assert error.value.args == (1,)
+    assert cluster.cluster_role == "leader"
+    # Не раньше истечения аренды, которую другой узел ещё не мог захватить
+    assert time.monotonic() - started >= cluster.CLUSTER_LEASE_TTL
+
+
+def test_follower_waits_for_lease_expiry(cluster, monkeypatch):
+    backend = cluster.MemoryBackend()
+    lease_key = cluster.cluster_key("leader")
+    assert backend.acquire_lease(lease_key, "other", cluster.CLUSTER_LEASE_TTL)
+
+    def become_leader(backend):
+        raise Elected()
+
+    monkeypatch.setattr(cluster, "become_leader", become_leader)
+    started = time.monotonic()
+    with pytest.raises(Elected):
+        cluster.run_cluster_node(backend, "node-b")
+    assert time.monotonic() - started >= cluster.CLUSTER_LEASE_TTL * 0.9
+    assert backend.get(lease_key) == "node-b"
+
+
+def test_follower_fetches_image_only_when_it_changes(cluster, monkeypatch):
+    monkeypatch.setattr(cluster, "CLUSTER_LEASE_TTL", 0.06)
+    backend = cluster.MemoryBackend()
+    assert backend.acquire_lease(cluster.cluster_key("leader"), "other", 60)
+    image_key, image_id_key = cluster.cluster_key("image"), cluster.cluster_key("image_id")
+    backend.set(image_key, b"image-1")
+    backend.set(image_id_key, b"id-1")
+
+    get = backend.get
+    fetched = []
+    polls = []
+
+    def counting_get(key):
+        if key == image_key:
+            fetched.append(get(image_id_key))
+        elif key == image_id_key:
+            polls.append(key)
+            if len(polls) == 10:
+                # Лидер публикует новый образ
+                backend.set(image_key, b"image-2")
+                backend.set(image_id_key, b"id-2")
+            if len(polls) > 20:
+                raise Elected()
+        return get(key)
+
+    backend.get = counting_get
+    with pytest.raises(Elected):
+        cluster.run_cluster_node(backend, "node-b")
+    assert fetched == [b"id-1", b"id-2"]
+    assert cluster.cluster_stats["received"] == 2
+    assert cluster.cluster_role == "follower"
@@ -0,0 +1,47 @@
+"""Дельта-эндпоинт /api/v1/dsr?since="""
+import gzip
+
+from bench import synthetic
+from bench.bench_suite import load_flights
+
+
+def test_full_delta_is_served_from_snapshot_cache(main):
+    load_flights(main, 100)
+    client = main.app.test_client()
+    flights = main.published_state["dsr"]
+
+    response = client.get("/api/v1/dsr?since=0")
+    delta = response.get_json()
+    assert delta["full"] and delta["upserts"] == flights and delta["removed"] == []
+    assert delta["boot"] == main.BOOT_ID
+
+    # Повторные первые опросы не сериализуют снимок заново
+    misses = main.cache_stats["snapshot_miss"]
+    response = client.get("/api/v1/dsr?since=0", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.data) == client.get("/api/v1/dsr?since=0").data
+    assert client.get("/api/v1/dsr?since=0", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+    assert main.cache_stats["snapshot_miss"] == misses
+
+    # Чужой boot и since новее текущей версии - тоже полный снимок
+    version = delta["version"]
+    assert client.get(f"/api/v1/dsr?since={version}&boot=other").get_json()["full"]
+    assert client.get(f"/api/v1/dsr?since={version + 100}").get_json()["full"]
+
+
+def test_incremental_delta(main):
+    load_flights(main, 100)
+    client = main.app.test_client()
+    version = client.get("/api/v1/dsr?since=0").get_json()["version"]
+
+    with main.write_lock:
+        main.apply_frame(synthetic.make_acft_frame(5, tick=3))
+        main.publish_state()
+    delta = client.get(f"/api/v1/dsr?since={version}&boot={main.BOOT_ID}").get_json()
+    assert not delta["full"]
+    assert delta["upserts"] == {callsign: main.published_state["dsr"][callsign] for callsign in delta["upserts"]}
+    assert 0 < len(delta["upserts"]) <= 5
+
+    # После публикации полный снимок собирается для новой версии
+    full = client.get("/api/v1/dsr?since=0").get_json()
+    assert full["version"] == main.published_state["versions"]["dsr"]
@@ -0,0 +1,66 @@
+"""Инкрементальный индекс рейсов и фильтры /api/v1/dsr"""
+import time
+
+from bench import synthetic
+from bench.bench_suite import load_flights
+
+
+def assert_index_matches(main, name="dsr"):
+    state = main.published_state
+    assert state[f"{name}_index"] == main.build_flight_index(state[name])
+
+
+def test_incremental_index_matches_rebuild(main):
+    load_flights(main, 200)
+    assert_index_matches(main)
+
+    for tick in range(1, 6):
+        with main.write_lock:
+            # Часть ВС пропадает из кадра, новые планы меняют аэропорты
+            main.apply_frame(synthetic.make_acft_frame(200 - tick * 20, tick=tick))
+            for i in range(tick * 10, tick * 10 + 10):
+                main.apply_frame(synthetic.make_flight_plan(i, seed=tick))
+            main.publish_state()
+        assert_index_matches(main)
+
+    # Все рейсы удалены, затем часть подключается снова
+    main.expire_flights(time.time() + 10 ** 6)
+    with main.write_lock:
+        main.publish_state()
+    assert_index_matches(main)
+    assert not main.published_state["dsr_index"]
+
+    load_flights(main, 50)
+    assert_index_matches(main)
+
+
+def test_query_matches_scan(main):
+    load_flights(main, 200)
+    flights = main.published_state["dsr"]
+    client = main.app.test_client()
+
+    airport = synthetic.AIRPORTS[0]
+    result = client.get(f"/api/v1/dsr?airport={airport}&role=dep&state=0,1,2").get_json()
+    assert result == {
+        callsign: flight for callsign, flight in flights.items()
+        if flight.get("departure") == airport and flight.get("state") in (0, 1, 2)
+    }
+
+    result = client.get("/api/v1/dsr?live=1&fields=state").get_json()
+    assert result == {callsign: {"state": flight["state"]} for callsign, flight in flights.items() if flight.get("live")}
+
+
+def test_role_requires_airport(main):
+    response = main.app.test_client().get("/api/v1/dsr?role=dep")
+    assert response.status_code == 400
+
+
+def test_query_cache_is_lru(main, monkeypatch):
+    monkeypatch.setattr(main, "QUERY_CACHE_SIZE", 2)
+    load_flights(main, 20)
+    client = main.app.test_client()
+    for query in ("live=1", "state=0", "live=1", "state=1"):
+        client.get(f"/api/v1/dsr?{query}")
+    # live=1 запрашивался недавно и остаётся в кэше, state=0 вытеснен
+    cached = [dict(key[2]) for key in main.query_cache]
+    assert cached == [{"live": True}, {"state": (1,)}]
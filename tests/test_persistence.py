@@ -0,0 +1,56 @@
+"""Снимок состояния и журнал: восстановление после перезапуска для каждого JSON бэкенда"""
+import importlib
+import time
+
+import pytest
+
+import main as main_module
+
+FULL_PLAN = (b'{"t":"FLIGHT_PLAN","d":{"robloxName":"player1","callsign":"TST1","realcallsign":"RC-1",'
+             b'"departing":"IRFD","arriving":"ILAR","flightlevel":"FL300","aircraft":"Boeing 737",'
+             b'"flightrules":"IFR","route":"GPS DCT"}}')
+# Без маршрута, эшелона и аэропортов - после восстановления должны остаться значения по умолчанию
+SHORT_PLAN = b'{"t":"FLIGHT_PLAN","d":{"robloxName":"player2","callsign":"TST2","realcallsign":"RC-2"}}'
+EVENT_ATC = [{"airport": "IRFD", "position": "TWR", "holder": "atc1", "queue": []}]
+
+
+def write_journal(main):
+    """Записать очередь журнала так же, как run_persistence_writer"""
+    _, journal_path = main.get_state_paths()
+    with open(journal_path, "ab") as journal:
+        journal.write(b"".join(main.json_dumps(entry) + b"\n" for _, entry in main.persist_queue))
+    main.persist_queue.clear()
+
+
+def start(monkeypatch, tmp_path, backend):
+    main = importlib.reload(main_module)
+    main.set_json_backend(backend)
+    monkeypatch.setattr(main, "STATE_DIR", str(tmp_path))
+    return main
+
+
+@pytest.mark.parametrize("backend", main_module.get_json_backends())
+def test_snapshot_and_journal_round_trip(main, monkeypatch, tmp_path, backend):
+    main = start(monkeypatch, tmp_path, backend)
+    main.persistence_enabled = True
+    now = time.time()
+    with main.write_lock:
+        main.apply_frame(main.decode_ws_frame(FULL_PLAN), received_at=now - 10)
+        main.write_snapshot(main.capture_snapshot())
+        main.persist_queue.clear()
+
+        # После снимка - только в журнале
+        main.apply_frame(main.decode_ws_frame(SHORT_PLAN), received_at=now)
+        main.apply_event_atc_data(EVENT_ATC)
+        main.journal_append("eatc", EVENT_ATC)
+        main.publish_state()
+    write_journal(main)
+    expected = {callsign: record.to_state() for callsign, record in main.dsr.items()}
+    assert expected["TST2"]["route"] == "N/A" and expected["TST2"]["departure"] == "ZZZZ"
+
+    restored = start(monkeypatch, tmp_path, backend)
+    restored.restore_state()
+    assert {callsign: record.to_state() for callsign, record in restored.dsr.items()} == expected
+    assert restored.persist_stats["restored_flights"] == 1
+    assert restored.persist_stats["replayed"] == 2
+    assert restored.published_state["eatc"] == EVENT_ATC
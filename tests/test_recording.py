@@ -0,0 +1,44 @@
+"""Запись кадров (RECORD_FILE) и её воспроизведение после аварийной остановки"""
+import json
+import time
+
+from bench import bench_codec, replay
+
+
+def record(main, path, start, count):
+    """Рекордер без close() - как процесс, убитый после сброса буфера"""
+    recorder = main.FrameRecorder(str(path), flush_interval=0)
+    now = time.time()
+    for i in range(start, start + count):
+        recorder.write(json.dumps({"t": "ACFT_DATA", "d": {"n": i}}), now + i)
+    return recorder
+
+
+def frame_numbers(frames):
+    return [json.loads(frame)["d"]["n"] for _, frame in frames]
+
+
+def test_replay_after_killed_run(main, tmp_path):
+    path = tmp_path / "rec.jsonl.gz"
+    killed = record(main, path, 0, 10)
+    # Файл в том виде, в каком его оставил бы os._exit: member без окончания
+    truncated = path.read_bytes()
+    killed.close()
+    path.write_bytes(truncated)
+
+    # Следующий запуск дописывает новый member и закрывается нормально
+    record(main, path, 10, 5).close()
+
+    assert frame_numbers(replay.load_recording(str(path))) == list(range(15))
+    assert len(bench_codec.load_frames(str(path))) == 15
+
+
+def test_replay_of_cut_file(main, tmp_path):
+    path = tmp_path / "rec.jsonl.gz"
+    record(main, path, 0, 200).close()
+    data = path.read_bytes()
+    for size in (len(data) // 3, len(data) // 2, len(data) - 5):
+        path.write_bytes(data[:size])
+        numbers = frame_numbers(replay.load_recording(str(path)))
+        assert numbers == list(range(len(numbers)))
+    assert numbers
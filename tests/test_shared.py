@@ -0,0 +1,73 @@
+"""Образ разделяемого снимка (ingestor -> worker): размер дельт и ответы на ?since"""
+import copy
+import json
+from collections import deque
+
+import pytest
+
+from bench import synthetic
+from bench.bench_suite import load_flights
+
+
+@pytest.fixture
+def clock(main, monkeypatch):
+    """Ручные часы для окна и шага контрольных точек дельт"""
+    now = [1000.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(main, "SHARED_CHECK_INTERVAL", 0)
+    return now
+
+
+def publish(main, history, frame):
+    with main.write_lock:
+        main.apply_frame(frame)
+        main.publish_state()
+    parts = main.build_shared_image(history)
+    main.write_shared_image(parts)
+    return parts
+
+
+def delta_sizes(parts):
+    header = json.loads(parts[2])
+    return {name: sum(size for _, size in header["stores"][name]["deltas"].values()) for name in ("dsr", "edsr")}
+
+
+def test_image_stays_bounded_under_churn(main, clock):
+    load_flights(main, 300)
+    history = {"dsr": deque(), "edsr": deque()}
+    sizes = []
+    for tick in range(1, 31):
+        clock[0] += 0.5
+        # Каждый тик меняются все ВС - дельты почти равны снимку
+        parts = publish(main, history, synthetic.make_acft_frame(300, tick=tick))
+        snapshot_size = len(main.get_snapshot("dsr")["identity"])
+        assert delta_sizes(parts)["dsr"] <= main.SHARED_DELTA_BUDGET * snapshot_size
+        sizes.append(sum(len(part) for part in parts))
+    assert max(sizes) <= 1.5 * min(sizes)
+
+
+def test_worker_answers_since_from_nearest_checkpoint(main, clock, monkeypatch):
+    load_flights(main, 300)
+    history = {"dsr": deque(), "edsr": deque()}
+    seen = {}
+    for tick in range(1, 31):
+        clock[0] += 0.5
+        publish(main, history, synthetic.make_acft_frame(10, tick=tick))
+        seen[main.published_state["versions"]["dsr"]] = copy.deepcopy(main.published_state["dsr"])
+    current = main.published_state["dsr"]
+
+    monkeypatch.setattr(main, "SERVE_MODE", "worker")
+    client = main.app.test_client()
+    incremental = 0
+    for version, flights in seen.items():
+        delta = client.get(f"/api/v1/dsr?since={version}&boot={main.BOOT_ID}").get_json()
+        if delta["full"]:
+            state = delta["upserts"]
+        else:
+            incremental += 1
+            state = dict(flights, **delta["upserts"])
+            for callsign in delta["removed"]:
+                state.pop(callsign, None)
+        assert state == current
+    # Последние SHARED_DELTA_WINDOW секунд обслуживаются дельтами
+    assert incremental >= main.SHARED_DELTA_WINDOW / 0.5 - main.SHARED_DELTA_STEP / 0.5
@@ -0,0 +1,97 @@
+"""Пространственные запросы: окно карты и радиус против полного перебора"""
+import random
+
+import pytest
+
+from bench import synthetic
+from bench.bench_suite import load_flights
+
+
+@pytest.fixture
+def loaded(main):
+    load_flights(main, 300)
+    rnd = random.Random(0)
+    with main.write_lock:
+        for icao in synthetic.AIRPORTS:
+            main.airport_positions[icao] = [rnd.uniform(-50000, 50000), rnd.uniform(-50000, 50000), 1]
+        main.refresh_airport_positions()
+        main.publish_state()
+    return main
+
+
+def live_positions(main):
+    return {callsign: (flight["pos_x"], flight["pos_y"])
+            for callsign, flight in main.published_state["dsr"].items() if flight.get("live")}
+
+
+def brute_nearest(x, y, table):
+    return min(table, key=lambda icao: (table[icao]["x"] - x) ** 2 + (table[icao]["y"] - y) ** 2)
+
+
+def test_bbox_matches_scan(loaded):
+    client = loaded.app.test_client()
+    positions = live_positions(loaded)
+    table = loaded.published_state["airport_positions"]
+    rnd = random.Random(1)
+    for _ in range(20):
+        x1, x2 = sorted(rnd.uniform(-60000, 60000) for _ in range(2))
+        y1, y2 = sorted(rnd.uniform(-60000, 60000) for _ in range(2))
+        result = client.get(f"/api/v1/aircraft/bbox?bbox={x2},{y1},{x1},{y2}").get_json()
+        expected = {callsign for callsign, (x, y) in positions.items() if x1 <= x <= x2 and y1 <= y <= y2}
+        assert set(result) == expected
+        for callsign, item in result.items():
+            assert item["nearest_airport"] == brute_nearest(*positions[callsign], table)
+            assert item["fir"] == table[item["nearest_airport"]]["fir"]
+
+
+def test_radius_matches_scan(loaded):
+    client = loaded.app.test_client()
+    positions = live_positions(loaded)
+    rnd = random.Random(2)
+    for _ in range(20):
+        cx, cy, radius = rnd.uniform(-50000, 50000), rnd.uniform(-50000, 50000), rnd.uniform(1000, 40000)
+        result = client.get(f"/api/v1/aircraft/radius?x={cx}&y={cy}&radius={radius}").get_json()
+        distances = {callsign: ((x - cx) ** 2 + (y - cy) ** 2) ** 0.5 for callsign, (x, y) in positions.items()}
+        expected = {callsign for callsign, distance in distances.items() if distance <= radius}
+        assert set(result) == expected
+        assert [item["distance"] for item in result.values()] == sorted(item["distance"] for item in result.values())
+
+    result = client.get("/api/v1/aircraft/radius?x=0&y=0&radius=100000&limit=5").get_json()
+    assert len(result) == 5
+
+
+@pytest.mark.parametrize("query", [
+    "bbox?bbox=0,0,inf,10",
+    "bbox?bbox=nan,0,10,10",
+    "bbox?bbox=0,0,1e400,10",
+    "radius?x=0&y=0&radius=inf",
+    "radius?x=nan&y=0&radius=10",
+    "radius?x=1e308&y=0&radius=1e308",
+    "radius?x=0&y=0&radius=0",
+    "radius?x=0&y=0&radius=-5",
+    "radius?x=0&y=0&radius=10&limit=0",
+    "radius?x=0&y=0&radius=10&limit=-1",
+    "radius?x=0&y=0&radius=10&limit=",
+])
+def test_invalid_query_rejected(loaded, query):
+    assert loaded.app.test_client().get(f"/api/v1/aircraft/{query}").status_code == 400
+
+
+def test_taxi_in_is_learned_for_arrival(main):
+    record = main.FlightRecord()
+    record.has_fpl = True
+    record.departure, record.arrival = "IRFD", "ILAR"
+    record.is_on_ground = True
+    record.pos_x, record.pos_y = 100.0, 100.0
+    record.state = 1
+    main.learn_airport_position(record)
+    assert main.airport_positions["IRFD"][:2] == [100.0, 100.0]
+
+    # После посадки руление к стоянке (состояние 1, затем 0) - аэропорт прибытия
+    record.has_departed = True
+    record.pos_x, record.pos_y = 40000.0, 40000.0
+    for state in (1, 0):
+        record.state = state
+        main.learn_airport_position(record)
+    assert main.airport_positions["IRFD"][:2] == [100.0, 100.0]
+    assert main.airport_positions["ILAR"][:2] == [40000.0, 40000.0]